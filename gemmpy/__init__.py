@@ -0,0 +1,5 @@
+##
+## gemmpy: shared Python tooling for the GeMM experiment launchers
+## (`studies/*/*.py`). Like the launchers themselves, everything in here
+## assumes that it is run from the model root folder.
+##
@@ -0,0 +1,196 @@
+##
+## Adaptive sequential sampling of a parameter space. Instead of spending the same
+## number of runs on every point of a fixed design, an initial Latin hypercube is
+## run first; then a Gaussian process surrogate is fitted to a response of the
+## finished runs (an end-of-run metric, see `gemmpy/metrics.py`), and new batches
+## of points are placed where the surrogate is most uncertain or changes fastest,
+## until the run budget is spent. Parameters are handled on the unit cube of
+## `gemmpy/sweep.py`, so value lists and `Range`s can be mixed.
+##
+## All points and responses are logged to `<prefix>_adaptive.tsv` after every round. As the choice of points
+## only depends on the responses, an interrupted sweep that is relaunched with
+## the same settings revisits the same points, which the run cache then skips.
+##
+
+import numpy as np
+
+from gemmpy import metrics, sweep
+
+## THE SURROGATE
+
+class GaussianProcess:
+    """
+    A Gaussian process regression with a squared exponential kernel on the unit
+    cube. The length scale and the noise level are chosen from a small grid by
+    maximising the marginal likelihood of the (standardised) responses.
+    """
+
+    lengthscales = [0.05, 0.1, 0.2, 0.4, 0.8]
+    noises = [1e-3, 1e-2, 0.1, 0.3]
+
+    def kernel(self, A, B):
+        d = ((A[:, None, :] - B[None, :, :]) ** 2).sum(axis=2)
+        return np.exp(-0.5 * d / self.lengthscale ** 2)
+
+    def condition(self, X, y):
+        "Condition the process on standardised data, with the current hyperparameters."
+        self.X = X
+        K = self.kernel(X, X) + self.noise * np.eye(len(X))
+        self.L = np.linalg.cholesky(K)
+        self.alpha = np.linalg.solve(self.L.T, np.linalg.solve(self.L, y))
+        return -0.5 * y @ self.alpha - np.log(np.diag(self.L)).sum()
+
+    def fit(self, X, y):
+        X, y = np.asarray(X, dtype=float), np.asarray(y, dtype=float)
+        self.mean = y.mean()
+        self.scale = y.std() if y.std() > 0 else 1.0
+        z = (y - self.mean) / self.scale
+        best = None
+        for l in self.lengthscales:
+            for n in self.noises:
+                self.lengthscale, self.noise = l, n
+                likelihood = self.condition(X, z)
+                if best is None or likelihood > best[0]:
+                    best = (likelihood, l, n)
+        self.lengthscale, self.noise = best[1], best[2]
+        self.z = z
+        self.condition(X, z)
+        return self
+
+    def predict(self, X):
+        "The predicted mean and standard deviation at the points `X`."
+        X = np.asarray(X, dtype=float)
+        k = self.kernel(X, self.X)
+        mean = k @ self.alpha
+        v = np.linalg.solve(self.L, k.T)
+        std = np.sqrt(np.maximum(1 + self.noise - (v ** 2).sum(axis=0), 0))
+        return self.mean + self.scale * mean, self.scale * std
+
+    def gradient(self, X, h=0.01):
+        "The norm of the gradient of the predicted mean at the points `X` (by finite differences)."
+        X = np.asarray(X, dtype=float)
+        grad = np.zeros(len(X))
+        for d in range(X.shape[1]):
+            step = np.zeros(X.shape[1])
+            step[d] = h
+            grad += ((self.predict(X + step)[0] - self.predict(X - step)[0]) / (2 * h)) ** 2
+        return np.sqrt(grad)
+
+
+## THE DESIGN
+
+def snap(space, u):
+    "Move unit coordinates to the centre of the bin of their value (for value lists)."
+    return [u[d] if isinstance(space[k], sweep.Range) else
+            (min(int(u[d] * len(space[k])), len(space[k]) - 1) + 0.5) / len(space[k])
+            for d, k in enumerate(space)]
+
+def point(space, u):
+    "The parameter values at unit coordinates `u`."
+    return {k: sweep.scale(space[k], u[d]) for d, k in enumerate(space)}
+
+class AdaptiveSweep:
+    """
+    An adaptive sweep over `space` (as for `sweep.Sweep`), optimising the
+    sampling of `response` (a metric, e.g. "diversity:lineages"). `initial`
+    points are run first, then `batch` points per round, until `budget` runs
+    (points times seeds) have been started. New points are chosen from
+    `candidates` points of a Sobol sequence, scoring their predicted standard
+    deviation, weighted up by `gradient` times the steepness of the surrogate
+    (both relative to the maximum over all candidates).
+    """
+
+    def __init__(self, space, response, budget, initial=20, batch=8, gradient=1.0,
+                 candidates=1024, seed=0):
+        metrics.parse_metric(response)
+        self.space = space
+        self.response = response
+        self.budget = budget
+        self.initial = initial
+        self.batch = batch
+        self.gradient = gradient
+        self.candidates = candidates
+        self.seed = seed
+        self.evaluated = [] # (round, unit coordinates, point, response)
+        self.runs = 0
+
+    def unit_space(self):
+        return {k: sweep.Range(0, 1) for k in self.space}
+
+    def initial_points(self, n):
+        "The unit coordinates of the initial Latin hypercube."
+        return [snap(self.space, list(p.values()))
+                for p in sweep.latin_hypercube_points(self.unit_space(), n, self.seed)]
+
+    def select(self, n):
+        """
+        Choose the unit coordinates of the next `n` points. After each choice,
+        the surrogate is conditioned on its predicted value there, so that a
+        batch spreads out instead of piling up in one spot.
+        """
+        done = [(u, r) for rnd, u, p, r in self.evaluated if r is not None]
+        if len(done) < 2:
+            return self.initial_points(n)
+        X = np.array([u for u, r in done])
+        gp = GaussianProcess().fit(X, [r for u, r in done])
+        pool = {tuple(snap(self.space, list(p.values()))): True
+                for p in sweep.sobol_points(self.unit_space(), self.candidates, skip=1)}
+        pool = np.array(list(pool))
+        steepness = gp.gradient(pool)
+        steepness = steepness / steepness.max() if steepness.max() > 0 else steepness
+        chosen = []
+        for i in range(min(n, len(pool))):
+            std = gp.predict(pool)[1]
+            score = std / std.max() * (1 + self.gradient * steepness) if std.max() > 0 else steepness
+            score[chosen] = -np.inf
+            best = int(np.argmax(score))
+            chosen.append(best)
+            predicted = (gp.predict(pool[best:best+1])[0][0] - gp.mean) / gp.scale
+            X = np.vstack([X, pool[best]])
+            gp.z = np.append(gp.z, predicted)
+            gp.condition(X, gp.z)
+        return [list(pool[i]) for i in chosen]
+
+    def runname(self, prefix, index, seed):
+        return prefix+"_adaptive"+str(index).zfill(4)+"_"+str(seed)
+
+    def log(self, prefix):
+        "Write all evaluated points and their responses to `<prefix>_adaptive.tsv`."
+        with open(prefix+"_adaptive.tsv", "w") as f:
+            f.write("\t".join(["round", "index"] + list(self.space) + [self.response])+"\n")
+            for i, (rnd, u, p, r) in enumerate(self.evaluated):
+                f.write("\t".join([str(rnd), str(i)] + [str(p[k]) for k in self.space] +
+                                  ["NA" if r is None else str(r)])+"\n")
+
+    def run(self, prefix, seeds, setup, execute):
+        """
+        Run the sweep. `setup(name, seed, **params)` writes the config of a run
+        and returns its job (cf. `setup_run` in the launchers), `execute(jobs)`
+        runs a list of jobs to completion (cf. `run_experiment`). Every point is
+        run once per seed, and its response is the mean over the seeds.
+        Returns the list of (round, unit coordinates, point, response) tuples.
+        """
+        seeds = list(seeds)
+        rnd = 0
+        n = min(self.initial, self.budget // len(seeds))
+        while n > 0:
+            units = self.initial_points(n) if rnd == 0 else self.select(n)
+            jobs, batch = [], []
+            for u in units:
+                index = len(self.evaluated) + len(batch)
+                p = point(self.space, u)
+                runs = [setup(self.runname(prefix, index, seed), seed, **p) for seed in seeds]
+                jobs.extend(runs)
+                batch.append((u, p, runs))
+            print("Adaptive sweep, round "+str(rnd)+": "+str(len(units))+" points, "+
+                  str(len(jobs))+" runs ("+str(self.runs + len(jobs))+" of "+str(self.budget)+").")
+            execute(jobs)
+            self.runs += len(jobs)
+            for u, p, runs in batch:
+                values = [metrics.metric(job.dest, self.response) for job in runs]
+                values = [v for v in values if v is not None]
+                self.evaluated.append((rnd, u, p, sum(values) / len(values) if values else None))
+            self.log(prefix)
+            rnd += 1
+            n = min(self.batch, (self.budget - self.runs) // len(seeds))
+        return self.evaluated
@@ -0,0 +1,196 @@
+##
+## Aggregate the `pops.tsv` files (written by `printpopstats`) of an experiment
+## into a partitioned Parquet dataset. Each file is streamed in chunks, only the
+## requested metric columns are kept, and the `Scenario` is derived from `conf`
+## as in `analyse_fragmentation_study.R`. Only new or changed runs are processed,
+## in parallel across files.
+##
+## Usage: python3 -m gemmpy.aggregate <experiment> [options]
+##
+
+import os, sys, glob, json, time, argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from urllib.parse import quote
+
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from gemmpy.cache import MARKER
+from gemmpy.compact import open_output, output_exists, output_state
+
+# the columns used by `analyse_fragmentation_study.R`
+default_metrics = ["time", "x", "y", "prec", "capacity", "replicate", "conf",
+                   "lineage", "adults", "heterozygosity", "precadaptationmean",
+                   "dispmeanmean", "dispmeanstd", "dispshapemean", "dispshapestd",
+                   "precoptmean", "precoptstd", "prectolmean", "prectolstd",
+                   "tempoptmean", "temptolmean", "repsizemean"]
+
+# column types that should not be inferred (all others are read as floats)
+column_types = {"time":pa.int64(), "x":pa.int64(), "y":pa.int64(), "replicate":pa.int64(),
+                "juveniles":pa.int64(), "adults":pa.int64(), "isisland":pa.string(),
+                "lineage":pa.string(), "conf":pa.string()}
+
+partition_schema = pa.schema([("experiment", pa.string()), ("scenario", pa.string()),
+                              ("replicate", pa.int64())])
+
+MANIFEST = "_manifest.json"
+
+## AUXILIARY FUNCTIONS
+
+def find_runs(resultsdir, experiment, finished=False):
+    """
+    Find the output directories of an experiment that contain a `pops.tsv`
+    (plain or compacted, see `gemmpy/compact.py`). If `finished` is true, only
+    include runs that are marked as complete by the run cache (runs launched
+    without the cache, or before it existed, have no marker).
+    """
+    runs = []
+    unmarked = 0
+    for rundir in sorted(glob.glob(os.path.join(resultsdir, "*"+experiment+"_*"))):
+        if not os.path.isdir(rundir) or not output_exists(rundir, "pops.tsv"):
+            continue
+        if not finished or os.path.exists(os.path.join(rundir, MARKER)):
+            runs.append(rundir)
+        else:
+            unmarked += 1
+    if unmarked:
+        print("Skipping "+str(unmarked)+" runs that are not marked as complete "+
+              "(they may still be running, or were launched without the run cache).")
+    return runs
+
+def file_state(path):
+    "Return the size and modification time of a file, to detect changes."
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime]
+
+def partition_dir(dataset, experiment, scen, replicate):
+    "Return the directory of a dataset partition."
+    return os.path.join(dataset, "experiment="+quote(experiment, safe=""),
+                        "scenario="+quote(scen, safe=""), "replicate="+str(replicate))
+
+
+## CONVERSION
+
+def convert_run(rundir, dataset, experiment, metrics, blocksize=1 << 24):
+    """
+    Stream the `pops.tsv` of one run into the dataset. Writes one Parquet file per
+    partition (scenario and replicate) touched by the run. Returns the list of files
+    written and the number of rows.
+    """
+    runname = os.path.basename(os.path.normpath(rundir))
+    with open_output(rundir, "pops.tsv") as f:
+        header = f.readline().rstrip("\n").split("\t")
+    columns = [m for m in metrics if m in header]
+    for required in ["conf", "replicate"]:
+        if required not in columns:
+            columns.append(required)
+    types = {c: column_types.get(c, pa.float64()) for c in columns}
+    popfile = open_output(rundir, "pops.tsv", "rb")
+    reader = pacsv.open_csv(popfile, read_options=pacsv.ReadOptions(block_size=blocksize),
+                            parse_options=pacsv.ParseOptions(delimiter="\t"),
+                            convert_options=pacsv.ConvertOptions(
+                                include_columns=columns, column_types=types,
+                                null_values=["NA", ""]))
+    writers = {}
+    files = []
+    nrows = 0
+    try:
+        for batch in reader:
+            table = pa.Table.from_batches([batch])
+            # derive the scenario as in the R scripts: str_replace(conf, "_\\d+\\.config", "")
+            scenarios = pc.replace_substring_regex(table["conf"], r"_\d+\.config", "",
+                                                   max_replacements=1)
+            table = table.drop_columns(["conf"])
+            data = table.drop_columns(["replicate"])
+            for scen in pc.unique(scenarios).to_pylist():
+                for rep in pc.unique(table["replicate"]).to_pylist():
+                    mask = pc.and_(pc.equal(scenarios, scen), pc.equal(table["replicate"], rep))
+                    part = data.filter(mask)
+                    if part.num_rows == 0:
+                        continue
+                    if (scen, rep) not in writers:
+                        pdir = partition_dir(dataset, experiment, scen, rep)
+                        os.makedirs(pdir, exist_ok=True)
+                        files.append(os.path.join(pdir, runname+".parquet"))
+                        writers[(scen, rep)] = pq.ParquetWriter(files[-1], part.schema)
+                    writers[(scen, rep)].write_table(part)
+                    nrows += part.num_rows
+    finally:
+        for w in writers.values():
+            w.close()
+        popfile.close()
+    return files, nrows
+
+def aggregate(experiment, resultsdir="results", dataset=None, metrics=default_metrics,
+              nprocs=None, finished=False):
+    """
+    Add all new or changed runs of an experiment to its dataset (by default
+    `aggregated/<experiment>`). If `finished` is true, only runs that are marked
+    as complete are added. Returns the dataset path.
+    """
+    if dataset is None:
+        dataset = os.path.join("aggregated", experiment)
+    os.makedirs(dataset, exist_ok=True)
+    manifestfile = os.path.join(dataset, MANIFEST)
+    manifest = json.load(open(manifestfile)) if os.path.exists(manifestfile) else {}
+    todo = []
+    for rundir in find_runs(resultsdir, experiment, finished):
+        state = output_state(rundir, "pops.tsv")
+        entry = manifest.get(rundir)
+        if entry and entry["state"] == state and entry["metrics"] == metrics:
+            continue
+        if entry: # the run changed, remove its old data
+            for f in entry["files"]:
+                if os.path.exists(f):
+                    os.remove(f)
+            del manifest[rundir]
+        todo.append((rundir, state))
+    print("Aggregating "+str(len(todo))+" new runs of the "+experiment+" experiment.")
+    t0 = time.time()
+    rows = 0
+    with ProcessPoolExecutor(nprocs) as pool:
+        futures = {pool.submit(convert_run, rundir, dataset, experiment, metrics): (rundir, state)
+                   for rundir, state in todo}
+        for future in as_completed(futures):
+            rundir, state = futures[future]
+            try:
+                files, nrows = future.result()
+            except Exception as e:
+                print("Failed to aggregate "+rundir+": "+str(e), file=sys.stderr)
+                continue
+            rows += nrows
+            manifest[rundir] = {"state":state, "metrics":metrics, "files":files}
+            with open(manifestfile, "w") as f:
+                json.dump(manifest, f)
+    print("Added "+str(rows)+" rows in "+str(round(time.time() - t0, 1))+" seconds.")
+    return dataset
+
+def load(dataset, columns=None, filter=None):
+    """
+    Load an aggregated dataset as a pyarrow table. The partition keys are available
+    as the columns `experiment`, `scenario`, and `replicate`.
+    """
+    data = ds.dataset(dataset, format="parquet",
+                      partitioning=ds.partitioning(partition_schema, flavor="hive"),
+                      exclude_invalid_files=True)
+    return data.to_table(columns=columns, filter=filter)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Aggregate the pops.tsv files of an experiment.")
+    parser.add_argument("experiment", help="experiment name (as used in the result folder names)")
+    parser.add_argument("-r", "--results", default="results", help="results folder")
+    parser.add_argument("-d", "--dataset", default=None,
+                        help="output dataset (default: aggregated/<experiment>)")
+    parser.add_argument("-m", "--metrics", default=None,
+                        help="comma-separated list of columns to keep")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="number of parallel processes (default: number of cores)")
+    parser.add_argument("--finished", action="store_true", default=False,
+                        help="only include runs that are marked as complete by the run cache")
+    args = parser.parse_args()
+    metrics = args.metrics.split(",") if args.metrics else default_metrics
+    aggregate(args.experiment, args.results, args.dataset, metrics, args.jobs, args.finished)
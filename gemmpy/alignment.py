@@ -0,0 +1,111 @@
+##
+## Export per-timestep alignments from the genome dumps of finished runs (the
+## Python successor of `studies/zosterops/speciation_post.jl`). For every timestep
+## in a run's `seqs_s*.fa`, the first half of each individual's genes is
+## concatenated into one sequence, and all individuals are written to
+## `<run>/chrs/chrs_<timestep>.fa`, ready for tree building (e.g. with FastTree).
+## Work is spread over a process pool by run and timestep.
+##
+## Usage: python3 -m gemmpy.alignment [rundir ...] [--pattern <regex>] [--jobs <n>]
+##
+
+import os, re, sys, glob, time, argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from gemmpy.fasta import FastaReader, build_index, INDEX_SUFFIX
+
+## AUXILIARY FUNCTIONS
+
+def find_runs(resultsdir, pattern):
+    "Find all result directories matching a pattern that contain a genome dump."
+    return [d for d in sorted(glob.glob(os.path.join(resultsdir, "*")))
+            if re.search(pattern, os.path.basename(d)) and glob.glob(os.path.join(d, "seqs_s*.fa"))]
+
+def seqfiles(rundir):
+    "Return the genome dumps of a run."
+    return sorted(glob.glob(os.path.join(rundir, "seqs_s*.fa")))
+
+def concat_genome(genome):
+    """
+    Concatenate the sequences of the first half of an individual's genes (as
+    `concat_chrs` in `speciation_post.jl` does).
+    """
+    return "".join(seq for chrm, gene, header, seq in genome[:len(genome) // 2])
+
+
+## PIPELINE STAGES
+
+def index_run(seqfile):
+    "Make sure a genome dump is indexed. Returns its timesteps."
+    indexfile = seqfile+INDEX_SUFFIX
+    if not os.path.exists(indexfile) or os.path.getmtime(indexfile) < os.path.getmtime(seqfile):
+        build_index(seqfile)
+    with FastaReader(seqfile) as reader:
+        return reader.timesteps()
+
+def export_timestep(seqfile, timestep, outdir):
+    """
+    Write the alignment of one timestep, streaming one individual at a time.
+    Returns the number of individuals and bytes written.
+    """
+    os.makedirs(outdir, exist_ok=True)
+    outfile = os.path.join(outdir, "chrs_"+str(timestep)+".fa")
+    n, size = 0, 0
+    with FastaReader(seqfile) as reader, open(outfile+".part", "w") as out:
+        for lineage, ind, record in reader.records(timestep):
+            entry = ">"+lineage+"_"+str(ind)+"\n"+concat_genome(reader.genome(record))+"\n"
+            out.write(entry)
+            n += 1
+            size += len(entry)
+    os.replace(outfile+".part", outfile) # only complete alignments get the final name
+    return n, size
+
+def export_alignments(rundirs, nprocs=None):
+    "Export the alignments of all timesteps of the given runs in parallel."
+    t0 = time.time()
+    tasks = []
+    with ProcessPoolExecutor(nprocs) as pool:
+        # first make sure every genome dump is indexed (one pass per file)
+        indexing = {pool.submit(index_run, f): f for d in rundirs for f in seqfiles(d)}
+        for future in as_completed(indexing):
+            seqfile = indexing[future]
+            try:
+                timesteps = future.result()
+            except Exception as e:
+                print("Failed to index "+seqfile+": "+str(e), file=sys.stderr)
+                continue
+            outdir = os.path.join(os.path.dirname(seqfile), "chrs")
+            tasks.extend((seqfile, t, outdir) for t in timesteps)
+        print("Indexed "+str(len(indexing))+" genome dumps in "+str(round(time.time() - t0, 1))+
+              " seconds, exporting "+str(len(tasks))+" alignments.")
+        # then export each timestep separately
+        futures = {pool.submit(export_timestep, *task): task for task in tasks}
+        done, inds, size = 0, 0, 0
+        for future in as_completed(futures):
+            seqfile, timestep, outdir = futures[future]
+            try:
+                n, nbytes = future.result()
+            except Exception as e:
+                print("Failed to export timestep "+str(timestep)+" of "+seqfile+": "+str(e),
+                      file=sys.stderr)
+                continue
+            done, inds, size = done + 1, inds + n, size + nbytes
+            elapsed = time.time() - t0
+            print("["+str(done)+"/"+str(len(tasks))+"] "+os.path.join(outdir, "chrs_"+str(timestep)+".fa")+
+                  ": "+str(n)+" individuals ("+str(round(inds / elapsed))+" individuals/s, "+
+                  str(round(size / elapsed / 2**20, 1))+" MB/s)")
+    print("Exported "+str(done)+" alignments with "+str(inds)+" sequences in "+
+          str(round(time.time() - t0, 1))+" seconds.")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Export per-timestep alignments from genome dumps.")
+    parser.add_argument("rundirs", nargs="*", help="result directories to process")
+    parser.add_argument("-r", "--results", default="results", help="results folder")
+    parser.add_argument("-p", "--pattern", default=r"savannah_.*",
+                        help="regex for result directories to process, if none are given")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="number of parallel processes (default: number of cores)")
+    args = parser.parse_args()
+    rundirs = args.rundirs if args.rundirs else find_runs(args.results, args.pattern)
+    export_alignments(rundirs, args.jobs)
@@ -0,0 +1,203 @@
+##
+## Compute the time series of `analyse_fragmentation_study.R` (population size,
+## heterozygosity and trait means/standard deviations of a species) from an
+## aggregated dataset (see `gemmpy/aggregate.py`). Each scenario is summarised
+## per timestep and replicate with Arrow group-bys, in parallel across
+## scenarios, and the replicates are then combined into means with bootstrap
+## confidence intervals (like `mean_cl_boot`). The per-replicate summaries are
+## cached in the dataset, keyed on the state of the scenario's input files, so
+## only scenarios with new runs are recomputed.
+##
+## Usage: python3 -m gemmpy.analysis <experiment> [-s <species>] [-o <file>] [--replicates]
+##
+## The output is a TSV table (time, scenario, summary, n, mean, lower, upper)
+## that can be read by R with `read_tsv()` for plotting.
+##
+
+import os, sys, glob, json, time, argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from urllib.parse import quote, unquote
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from gemmpy import aggregate
+
+# the summaries per timestep and replicate: name -> (column, aggregation)
+default_summaries = {"popsize":("adults", "sum"),
+                     "heterozygosity":("heterozygosity", "mean"),
+                     "precopt":("precoptmean", "mean"), "precoptstd":("precoptstd", "mean"),
+                     "prectol":("prectolmean", "mean"), "prectolstd":("prectolstd", "mean"),
+                     "dispmean":("dispmeanmean", "mean"), "dispmeanstd":("dispmeanstd", "mean"),
+                     "dispshape":("dispshapemean", "mean"), "dispshapestd":("dispshapestd", "mean"),
+                     "tempopt":("tempoptmean", "mean"), "temptol":("temptolmean", "mean"),
+                     "repsize":("repsizemean", "mean")}
+
+CACHEDIR = "_analysis" # ignored by pyarrow when reading the dataset
+INDEX = "index.json"
+
+## AUXILIARY FUNCTIONS
+
+def dataset_path(experiment):
+    return os.path.join("aggregated", experiment)
+
+def scenarios(dataset):
+    "The scenarios of an aggregated dataset (from its partition folders)."
+    names = set()
+    for d in glob.glob(os.path.join(dataset, "experiment=*", "scenario=*")):
+        names.add(unquote(os.path.basename(d)[len("scenario="):]))
+    return sorted(names)
+
+def input_state(dataset, scenario):
+    "The size and modification time of each data file of a scenario."
+    files = glob.glob(os.path.join(dataset, "experiment=*", "scenario="+quote(scenario, safe=""),
+                                   "replicate=*", "*.parquet"))
+    return {os.path.relpath(f, dataset): aggregate.file_state(f) for f in sorted(files)}
+
+def cache_file(dataset, scenario, species):
+    name = quote(scenario, safe="")+"."+("all" if not species else quote("+".join(species), safe=""))
+    return os.path.join(dataset, CACHEDIR, name+".parquet")
+
+
+## SUMMARIES
+
+def summarise_replicates(dataset, scenario, species=None, summaries=default_summaries):
+    """
+    Summarise one scenario per timestep and replicate. Returns a table with
+    the columns `time`, `replicate` and one column per summary (summaries of
+    columns that are not in the dataset are left out).
+    """
+    data = ds.dataset(dataset, format="parquet",
+                      partitioning=ds.partitioning(aggregate.partition_schema, flavor="hive"))
+    summaries = {s: v for s, v in summaries.items() if v[0] in data.schema.names}
+    condition = ds.field("scenario") == scenario
+    if species:
+        condition = condition & ds.field("lineage").isin(list(species))
+    columns = sorted(set(c for c, agg in summaries.values()))
+    table = data.to_table(columns=["time", "replicate"] + columns, filter=condition)
+    grouped = table.group_by(["time", "replicate"]).aggregate(
+        [(c, agg) for c, agg in set(summaries.values())])
+    result = grouped.select(["time", "replicate"])
+    for s, (c, agg) in summaries.items():
+        result = result.append_column(s, grouped[c+"_"+agg].cast(pa.float64()))
+    return result.sort_by([("time", "ascending"), ("replicate", "ascending")])
+
+def bootstrap_ci(groups, resamples=1000, level=0.95, seed=0):
+    """
+    Compute the mean and a bootstrap confidence interval of each group of
+    values (a list of arrays). Groups of the same size are resampled together.
+    Returns three arrays: means, lower and upper bounds.
+    """
+    rng = np.random.default_rng(seed)
+    means, lower, upper = (np.full(len(groups), np.nan) for i in range(3))
+    sizes = np.array([len(g) for g in groups])
+    for n in np.unique(sizes):
+        if n == 0:
+            continue
+        members = np.nonzero(sizes == n)[0]
+        values = np.array([groups[i] for i in members])
+        samples = values[:, rng.integers(0, n, (resamples, n))].mean(axis=2)
+        means[members] = values.mean(axis=1)
+        lower[members] = np.quantile(samples, (1 - level) / 2, axis=1)
+        upper[members] = np.quantile(samples, 1 - (1 - level) / 2, axis=1)
+    return means, lower, upper
+
+def combine_replicates(replicates):
+    """
+    Combine the per-replicate summaries of all scenarios (a dict of tables)
+    into a long table of means and confidence intervals per timestep,
+    scenario and summary.
+    """
+    rows = {"time":[], "scenario":[], "summary":[], "n":[]}
+    groups = []
+    for scenario, table in sorted(replicates.items()):
+        times = table["time"].to_numpy()
+        steps, starts = np.unique(times, return_index=True)
+        bounds = list(starts) + [len(times)]
+        for s in table.column_names[2:]:
+            values = table[s].to_numpy(zero_copy_only=False)
+            for i, t in enumerate(steps):
+                v = values[bounds[i]:bounds[i+1]]
+                v = v[~np.isnan(v)]
+                rows["time"].append(int(t))
+                rows["scenario"].append(scenario)
+                rows["summary"].append(s)
+                rows["n"].append(len(v))
+                groups.append(v)
+    rows["mean"], rows["lower"], rows["upper"] = bootstrap_ci(groups)
+    return pa.table(rows)
+
+
+## CACHING
+
+def analyse(experiment, dataset=None, species=None, summaries=default_summaries, nprocs=None):
+    """
+    Summarise all scenarios of an experiment, reusing the cached summaries of
+    scenarios whose input files haven't changed. Returns a dict of the
+    per-replicate tables by scenario.
+    """
+    if dataset is None:
+        dataset = dataset_path(experiment)
+    os.makedirs(os.path.join(dataset, CACHEDIR), exist_ok=True)
+    indexfile = os.path.join(dataset, CACHEDIR, INDEX)
+    index = json.load(open(indexfile)) if os.path.exists(indexfile) else {}
+    replicates, todo = {}, {}
+    for scenario in scenarios(dataset):
+        cachefile = cache_file(dataset, scenario, species)
+        key = {"files":input_state(dataset, scenario), "summaries":summaries}
+        if index.get(os.path.basename(cachefile)) == json.loads(json.dumps(key)) \
+           and os.path.exists(cachefile):
+            replicates[scenario] = pq.read_table(cachefile)
+        else:
+            todo[scenario] = key
+    if todo:
+        print("Summarising "+str(len(todo))+" of "+str(len(todo) + len(replicates))+
+              " scenarios of the "+experiment+" experiment.", file=sys.stderr)
+    t0 = time.time()
+    with ProcessPoolExecutor(nprocs) as pool:
+        futures = {pool.submit(summarise_replicates, dataset, s, species, summaries): s for s in todo}
+        for future in as_completed(futures):
+            scenario = futures[future]
+            replicates[scenario] = future.result()
+            cachefile = cache_file(dataset, scenario, species)
+            pq.write_table(replicates[scenario], cachefile)
+            index[os.path.basename(cachefile)] = todo[scenario]
+            with open(indexfile, "w") as f:
+                json.dump(index, f)
+    if todo:
+        print("Done in "+str(round(time.time() - t0, 1))+" seconds.", file=sys.stderr)
+    return replicates
+
+def write_tsv(table, filename=None):
+    "Write a table as TSV (to stdout if no filename is given)."
+    out = open(filename, "w") if filename else sys.stdout
+    out.write("\t".join(table.column_names)+"\n")
+    for row in zip(*[table[c].to_pylist() for c in table.column_names]):
+        out.write("\t".join("NA" if v is None or v != v else str(v) for v in row)+"\n")
+    if filename:
+        out.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compute the time series of an aggregated experiment.")
+    parser.add_argument("experiment", help="experiment name (as used by gemmpy.aggregate)")
+    parser.add_argument("-d", "--dataset", default=None,
+                        help="aggregated dataset (default: aggregated/<experiment>)")
+    parser.add_argument("-s", "--species", default=None,
+                        help="comma-separated list of lineages to include (default: all)")
+    parser.add_argument("-o", "--output", default=None, help="output file (default: stdout)")
+    parser.add_argument("--replicates", action="store_true", default=False,
+                        help="write the summaries per replicate instead of the means")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="number of parallel processes (default: number of cores)")
+    args = parser.parse_args()
+    species = sorted(args.species.split(",")) if args.species else None
+    replicates = analyse(args.experiment, args.dataset, species, nprocs=args.jobs)
+    if args.replicates:
+        tables = [t.add_column(0, "scenario", pa.array([s] * t.num_rows, pa.string()))
+                  for s, t in sorted(replicates.items())]
+        write_tsv(pa.concat_tables(tables) if tables else pa.table({}), args.output)
+    else:
+        write_tsv(combine_replicates(replicates), args.output)
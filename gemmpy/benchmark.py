@@ -0,0 +1,273 @@
+##
+## A benchmark suite for the GeMM engine. A fixed matrix of cases (map sizes
+## from 10^2 to 10^5 cells, genome representations, linkage, niches, modes and
+## output settings) is run for a fixed number of timesteps with several seeds,
+## using `rungemm_benchmark.jl`, which excludes compilation from the timing.
+## Wall time per timestep, allocations and peak memory of each case are appended
+## to a JSON history (`benchmarks/history.json`) and compared against a stored
+## baseline (`benchmarks/baseline.json`), so that regressions are caught.
+##
+## Usage: python3 -m gemmpy.benchmark run [--cases <regex>] [--seeds <n>] [--timesteps <n>]
+##        python3 -m gemmpy.benchmark baseline [<history entry>]
+##        python3 -m gemmpy.benchmark compare [<history entry>]
+##        python3 -m gemmpy.benchmark list
+##
+
+import os, re, sys, json, time, shutil, argparse, statistics, subprocess
+import numpy as np
+
+from gemmpy import cache, mapgen, resources
+
+benchmark_dir = "benchmarks"
+
+# settings shared by all cases (small populations, so that large maps stay feasible)
+base_settings = {"quiet":"true", "logging":"false", "debug":"false", "stats":"true",
+                 "lineages":"false", "fasta":"off", "raw":"false", "outfreq":10,
+                 "mode":"default", "linkage":"random", "nniches":2, "usebiggenes":"false",
+                 "compressgenes":"true", "cellsize":1e5, "mutate":"true", "static":"false"}
+
+# Zosterops mode settings (from `studies/zosterops/zosterops.config`)
+zosterops_settings = {"mode":"zosterops", "indsize":"adult", "capgrowth":"true",
+                      "degpleiotropy":0, "tolerance":0.1, "speciation":"ecological",
+                      "bodytemp":312.0, "cellsize":8, "fertility":2, "dispmean":18,
+                      "dispshape":2, "maxrepsize":2.5, "minrepsize":2.3, "maxseedsize":2.0,
+                      "minseedsize":1.5, "maxtemp":303, "mintemp":283, "mortalitytype":"global",
+                      "mortality":0.125, "heterozygosity":"true", "linkage":"none",
+                      "species":'[Dict("lineage"=>"silvanus","precopt"=>180,"prectol"=>90,'+
+                                '"tempopt"=>293,"temptol"=>2),Dict("lineage"=>"flavilateralis",'+
+                                '"precopt"=>50,"prectol"=>47,"tempopt"=>293,"temptol"=>2)]',
+                      "traitnames":'["compat","dispmean","dispshape","numpollen","precopt",'+
+                                   '"prectol","repsize","seqsimilarity","seedsize","tempopt","temptol"]'}
+
+# The benchmark matrix: each case is a map size ("cells", default 1000) plus the
+# settings that differ from `base_settings`. (Keep the names stable, they are
+# used to compare against the baseline.)
+benchmark_cases = {
+    "cells_1e2":{"cells":100},
+    "cells_1e3":{"cells":1000},
+    "cells_1e4":{"cells":10000},
+    "cells_1e5":{"cells":100000},
+    "biggenes":{"usebiggenes":"true"},
+    "uncompressed":{"compressgenes":"false"},
+    "biggenes_uncompressed":{"usebiggenes":"true", "compressgenes":"false"},
+    "linkage_none":{"linkage":"none"},
+    "linkage_full":{"linkage":"full"},
+    "nniches_1":{"nniches":1},
+    "mode_invasion":{"mode":"invasion", "global-species-pool":50, "propagule-pressure":1,
+                     "burn-in":5, "disturbance":1},
+    "mode_zosterops":zosterops_settings,
+    "output_raw":{"raw":"true"},
+    "output_fasta":{"fasta":"all", "fastaoutfreq":10},
+    "output_outfreq1":{"outfreq":1, "lineages":"true"}
+}
+
+## SETTING UP THE CASES
+
+def map_file(workdir, cells, timesteps, zosterops=False):
+    """
+    Generate a continent map with (about) the given number of cells, unless it
+    exists. Zosterops mode needs a rectangle with 1-based coordinates in
+    row-major order and no other landmasses (see `coordinate`), so its maps are
+    reordered and have no dummy island.
+    """
+    side = max(1, int(round(cells ** 0.5)))
+    mapfile = os.path.join(workdir, "bench_"+("zosterops_" if zosterops else "")+
+                           str(side * side)+"_"+str(timesteps)+".map")
+    if not os.path.exists(mapfile):
+        if zosterops:
+            land = mapgen.continent(side, side, x=1, y=1, precipitation=True)
+            order = np.lexsort((land["x"], land["y"])) # by row, then by column
+            land = {k: v[order] if isinstance(v, np.ndarray) else v for k, v in land.items()}
+            mapgen.make_map(mapfile, [land], timesteps, ocean=False)
+        else:
+            mapgen.make_map(mapfile, [mapgen.continent(side, side, precipitation=True)], timesteps)
+    return mapfile
+
+def write_config(config, mapfile, dest, seed, settings):
+    "Write the config file of a benchmark run."
+    with open(config, "w") as cf:
+        cf.write("# GeMM benchmark case, generated by `gemmpy/benchmark.py`\n")
+        cf.write("maps "+os.path.basename(mapfile)+"\n")
+        cf.write("dest "+dest+"\n")
+        cf.write("seed "+str(seed)+"\n")
+        for k in settings.keys():
+            cf.write(k+" "+str(settings[k])+"\n")
+
+def setup_case(name, seed, timesteps, workdir):
+    """
+    Write the map and config files for one benchmark run, and for its warm-up
+    run (a map of the same size with a single timestep, so that nothing the
+    warm-up leaves behind differs from the timed run). Returns both config
+    files and the output directory of the timed run.
+    """
+    case = dict(benchmark_cases[name])
+    cells = case.pop("cells", 1000)
+    settings = dict(base_settings)
+    settings.update(case)
+    dest = os.path.join(workdir, "results", name+"_"+str(seed))
+    config = os.path.join(workdir, name+"_"+str(seed)+".config")
+    zosterops = settings["mode"] == "zosterops"
+    write_config(config, map_file(workdir, cells, timesteps, zosterops), dest, seed, settings)
+    warmup = os.path.join(workdir, name+"_warmup.config")
+    write_config(warmup, map_file(workdir, cells, 1, zosterops), dest+"_warmup", seed, settings)
+    return config, warmup, dest
+
+
+## RUNNING THE BENCHMARKS
+
+def run_case(name, seed, timesteps, workdir):
+    "Run one benchmark case with one seed. Returns its measurements (or None if it failed)."
+    config, warmup, dest = setup_case(name, seed, timesteps, workdir)
+    for d in (dest, dest+"_warmup"):
+        shutil.rmtree(d, ignore_errors=True)
+    start = time.time()
+    proc = subprocess.Popen(["julia", "rungemm_benchmark.jl", config, warmup],
+                            stdout=subprocess.PIPE, text=True)
+    stats = None
+    for line in proc.stdout:
+        if line.startswith("GEMMBENCH\t"):
+            stats = [float(v) for v in line.split("\t")[1:5]]
+    returncode = proc.wait()
+    walltime = time.time() - start
+    if returncode != 0 or stats is None:
+        print("Benchmark "+name+" (seed "+str(seed)+") failed with exit code "+str(returncode)+".",
+              file=sys.stderr)
+        return None
+    maps = [f for f in os.listdir(dest) if f.endswith(".map")] if os.path.isdir(dest) else []
+    output = resources.directory_size(dest) - sum(os.path.getsize(os.path.join(dest, m)) for m in maps)
+    for d in (dest, dest+"_warmup"):
+        shutil.rmtree(d, ignore_errors=True)
+    return {"simtime":stats[0], "timestep":stats[0] / timesteps, "allocated":stats[1] / timesteps,
+            "gctime":stats[2], "walltime":walltime, "output":output,
+            "maxrss":stats[3] / 1024 if len(stats) > 3 and stats[3] else None}
+
+def summarise_case(runs):
+    "Combine the measurements of one case over all seeds."
+    times = [r["timestep"] for r in runs]
+    return {"timestep":statistics.median(times), "timestep_min":min(times),
+            "timestep_max":max(times),
+            "allocated":statistics.median(r["allocated"] for r in runs),
+            "gctime":statistics.median(r["gctime"] for r in runs),
+            "output":statistics.median(r["output"] for r in runs),
+            "maxrss":max((r["maxrss"] for r in runs if r["maxrss"] is not None), default=None),
+            "seeds":len(runs)}
+
+def run_benchmarks(cases=None, seeds=3, timesteps=20, label=""):
+    """
+    Run the benchmark matrix (or the cases matching the regular expression
+    `cases`) and append the results to the history. Returns the history entry.
+    """
+    names = [n for n in benchmark_cases if cases is None or re.search(cases, n)]
+    workdir = os.path.join(benchmark_dir, "runs")
+    os.makedirs(workdir, exist_ok=True)
+    entry = {"date":time.strftime("%Y-%m-%d %H:%M:%S"), "commit":cache.git_commit(),
+             "host":os.uname().nodename, "label":label, "timesteps":timesteps,
+             "seeds":seeds, "cases":{}}
+    for name in names:
+        print("Benchmarking "+name+" ("+str(seeds)+" seeds, "+str(timesteps)+" timesteps).")
+        runs = [r for r in (run_case(name, s, timesteps, workdir) for s in range(1, seeds+1)) if r]
+        if runs:
+            entry["cases"][name] = summarise_case(runs)
+    history = load_history()
+    history.append(entry)
+    save_json(os.path.join(benchmark_dir, "history.json"), history)
+    return entry
+
+
+## HISTORY AND BASELINE
+
+def save_json(filename, data):
+    "Write a JSON file atomically."
+    with open(filename+".tmp", "w") as f:
+        json.dump(data, f, indent=1)
+    os.replace(filename+".tmp", filename)
+
+def load_history():
+    "Return the list of all benchmark entries (oldest first)."
+    path = os.path.join(benchmark_dir, "history.json")
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return json.load(f)
+
+def load_baseline():
+    "Return the baseline entry (or None)."
+    path = os.path.join(benchmark_dir, "baseline.json")
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def set_baseline(index=-1):
+    "Make a history entry (by default the most recent one) the new baseline."
+    entry = load_history()[index]
+    save_json(os.path.join(benchmark_dir, "baseline.json"), entry)
+    return entry
+
+def compare(entry, baseline, threshold=0.1):
+    """
+    Compare the time per timestep and peak memory of each case against the
+    baseline. A case counts as a regression if it is slower (or uses more memory)
+    by more than `threshold`, and its fastest seed is slower than the slowest
+    seed of the baseline. Prints a table and returns the regressed cases.
+    """
+    regressions = []
+    print("%-24s %12s %12s %8s %10s %10s %8s" % ("case", "baseline", "current", "change",
+                                                "base RSS", "RSS", "change"))
+    for name, current in entry["cases"].items():
+        if name not in baseline["cases"]:
+            continue
+        base = baseline["cases"][name]
+        timechange = current["timestep"] / base["timestep"] - 1
+        rsschange = current["maxrss"] / base["maxrss"] - 1 \
+            if current["maxrss"] and base["maxrss"] else 0
+        slower = timechange > threshold and current["timestep_min"] > base["timestep_max"]
+        if slower or rsschange > threshold:
+            regressions.append(name)
+        print("%-24s %10.2fms %10.2fms %+7.1f%% %7.0f MB %7.0f MB %+7.1f%%%s" % (
+            name, base["timestep"] * 1000, current["timestep"] * 1000, timechange * 100,
+            base["maxrss"] or 0, current["maxrss"] or 0, rsschange * 100,
+            "  REGRESSION" if name in regressions else ""))
+    return regressions
+
+def describe(entry):
+    return entry["date"]+" "+entry["commit"][:10]+(" ("+entry["label"]+")" if entry["label"] else "")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run and compare GeMM benchmarks.")
+    parser.add_argument("command", choices=["run", "baseline", "compare", "list"])
+    parser.add_argument("entry", nargs="?", type=int, default=-1,
+                        help="history entry for baseline/compare (default: the most recent)")
+    parser.add_argument("-c", "--cases", default=None, help="regular expression selecting cases")
+    parser.add_argument("-s", "--seeds", type=int, default=3, help="number of seeds per case")
+    parser.add_argument("-t", "--timesteps", type=int, default=20, help="timesteps per run")
+    parser.add_argument("-l", "--label", default="", help="a note for the history entry")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="relative slowdown that counts as a regression")
+    args = parser.parse_args()
+    history = load_history()
+    if args.command == "list":
+        baseline = load_baseline()
+        for i, e in enumerate(history):
+            print(str(i)+": "+describe(e)+", "+str(len(e["cases"]))+" cases"+
+                  (" [baseline]" if baseline and e["date"] == baseline["date"] else ""))
+        sys.exit(0)
+    if args.command == "baseline":
+        if not history:
+            parser.error("no benchmark results yet")
+        print("New baseline: "+describe(set_baseline(args.entry)))
+        sys.exit(0)
+    if args.command == "run":
+        entry = run_benchmarks(args.cases, args.seeds, args.timesteps, args.label)
+    elif history:
+        entry = history[args.entry]
+    else:
+        parser.error("no benchmark results yet")
+    baseline = load_baseline()
+    if baseline is None:
+        print("No baseline to compare against (set one with `python3 -m gemmpy.benchmark baseline`).")
+        sys.exit(0)
+    print("Comparing "+describe(entry)+" against the baseline "+describe(baseline)+".")
+    if compare(entry, baseline, args.threshold):
+        sys.exit(1)
@@ -0,0 +1,137 @@
+##
+## A content-addressed run cache. Each run is identified by a hash of its
+## (normalised) config file, its seed, the contents of its map files and the
+## current git commit. Runs whose results are already complete are skipped, and
+## half-finished output directories are moved aside so the run can be re-queued.
+##
+
+import os, sys, json, time, shutil, hashlib, subprocess
+
+MARKER = ".gemmpy_complete" # written to the output directory of every completed run
+
+## AUXILIARY FUNCTIONS
+
+def read_config(config):
+    "Parse a GeMM config file into a dict (ignoring comments and blank lines)."
+    settings = {}
+    with open(config) as cf:
+        for line in cf:
+            line = line.split("#")[0].strip()
+            if not line:
+                continue
+            tokens = line.split(None, 1)
+            settings[tokens[0]] = tokens[1] if len(tokens) > 1 else ""
+    return settings
+
+def normalise_config(settings):
+    "Return a canonical text form of the settings, leaving out the output directory."
+    return "\n".join(k+" "+settings[k] for k in sorted(settings.keys()) if k != "dest")
+
+def map_files(config, settings, resolved=False):
+    """
+    Return the paths of the map files used by a config. As in GeMM (cf. `getsettings`),
+    they are relative to the folder of the config, unless they are `resolved` already
+    (as in the copy of the settings that GeMM writes to the output directory).
+    """
+    if "maps" not in settings:
+        return []
+    maps = settings["maps"].strip('"').split(",")
+    return [m if resolved else os.path.join(os.path.dirname(config), m) for m in maps if m]
+
+def file_hash(path):
+    "Return the SHA-256 hash of a file's contents."
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+_commit = None
+
+def git_commit():
+    "Return the current git commit of the model code (as recorded in the code snapshots)."
+    global _commit
+    if _commit is None:
+        try:
+            _commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True,
+                                     text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            _commit = "unknown"
+    return _commit
+
+def run_key(job):
+    "Compute the cache key of a job from its config, seed, maps and code version."
+    settings = read_config(job.config)
+    h = hashlib.sha256()
+    h.update(normalise_config(settings).encode())
+    h.update(("\nseed "+str(job.seed)).encode())
+    for m in map_files(job.config, settings):
+        h.update(("\nmap "+(file_hash(m) if os.path.isfile(m) else "missing")).encode())
+    h.update(("\ncommit "+git_commit()).encode())
+    return h.hexdigest()
+
+
+## THE CACHE
+
+class RunCache:
+    "An index of completed runs, stored as one small JSON file per run key."
+
+    def __init__(self, cachedir="results/.runcache"):
+        self.cachedir = cachedir
+        os.makedirs(cachedir, exist_ok=True)
+
+    def entry(self, key):
+        "Return the cache entry for a key (or None)."
+        path = os.path.join(self.cachedir, key+".json")
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def complete(self, dest, key=None):
+        "Check whether `dest` holds a completed run (with the given key, if any)."
+        marker = os.path.join(dest, MARKER)
+        if not os.path.exists(marker):
+            return False
+        with open(marker) as f:
+            return key is None or f.read().strip() == key
+
+    def skip(self, job):
+        """
+        Decide whether a job can be skipped because its results already exist.
+        Incomplete or outdated output directories are moved out of the way (never
+        deleted), so that GeMM doesn't refuse to start the run.
+        """
+        job.key = run_key(job)
+        entry = self.entry(job.key)
+        if entry and self.complete(entry["dest"], job.key):
+            print("Skipping "+job.name+", results are cached in "+entry["dest"]+".")
+            return True
+        if job.dest and self.complete(job.dest, job.key): # e.g. the cache folder was lost
+            print("Skipping "+job.name+", results are complete in "+job.dest+".")
+            self.store(job)
+            return True
+        if job.dest and os.path.exists(job.dest):
+            if self.complete(job.dest):
+                stale = job.dest+"_"+open(os.path.join(job.dest, MARKER)).read().strip()[:8]
+                print("Results in "+job.dest+" are outdated, moving them to "+stale+".",
+                      file=sys.stderr)
+                shutil.move(job.dest, stale)
+            else:
+                aside = job.dest+".incomplete-"+time.strftime("%Y%m%d-%H%M%S")
+                print("Results in "+job.dest+" are incomplete, moving them to "+aside+".",
+                      file=sys.stderr)
+                shutil.move(job.dest, aside)
+        return False
+
+    def store(self, job, status="done"):
+        "Record a completed job in the cache and mark its output directory."
+        key = job.key or run_key(job)
+        if not job.dest or not os.path.isdir(job.dest):
+            return
+        with open(os.path.join(job.dest, MARKER), "w") as f:
+            f.write(key+"\n")
+        with open(os.path.join(self.cachedir, key+".json"), "w") as f:
+            json.dump({"name":job.name, "dest":job.dest, "seed":job.seed,
+                       "status":status, "commit":git_commit(),
+                       "finished":time.strftime("%Y-%m-%d %H:%M:%S")}, f)
@@ -0,0 +1,324 @@
+##
+## A catalogue of simulation runs, kept in a local SQLite database
+## (`results/catalogue.sqlite`). The scheduler and the worker pool register every
+## job they start, with its full parameter set, seed, map hashes, git commit and
+## code snapshot (see `gemmpy/snapshot.py`), and record its exit status, wall time,
+## resource use and output file sizes when it finishes. Analysis scripts can then
+## select runs by parameter instead of by matching the names of result folders.
+##
+## Usage: python3 -m gemmpy.catalogue list [<condition> ...] [--dirs] [--all]
+##        python3 -m gemmpy.catalogue cost <parameter> [<condition> ...]
+##        python3 -m gemmpy.catalogue samples <run>
+##        python3 -m gemmpy.catalogue index [<resultsdir>]
+##
+## Conditions are written as "<name><op><value>", e.g. "speciation=neutral",
+## "tolerance<=0.1", "status!=done" or "walltime>3600".
+##
+
+import os, re, sys, time, sqlite3, argparse
+from contextlib import closing
+
+from gemmpy import cache, resources, scheduler, snapshot
+
+schema = """
+CREATE TABLE IF NOT EXISTS runs (id INTEGER PRIMARY KEY, name TEXT, experiment TEXT,
+    config TEXT, dest TEXT, seed INTEGER, gitcommit TEXT, runkey TEXT, started REAL,
+    finished REAL, status TEXT, returncode INTEGER, walltime REAL, maxrss REAL,
+    outputsize INTEGER, cputime REAL, meanrss REAL, readbytes INTEGER, writtenbytes INTEGER,
+    snapshot TEXT);
+CREATE TABLE IF NOT EXISTS params (run INTEGER, name TEXT, value TEXT, PRIMARY KEY (run, name));
+CREATE TABLE IF NOT EXISTS maps (run INTEGER, path TEXT, hash TEXT);
+CREATE TABLE IF NOT EXISTS outputs (run INTEGER, path TEXT, size INTEGER);
+CREATE TABLE IF NOT EXISTS samples (run INTEGER, time REAL, cputime REAL, rss REAL,
+    read INTEGER, written INTEGER, output INTEGER);
+CREATE INDEX IF NOT EXISTS params_by_value ON params (name, value);
+CREATE INDEX IF NOT EXISTS runs_by_dest ON runs (dest);
+CREATE INDEX IF NOT EXISTS samples_by_run ON samples (run);
+"""
+
+# run properties that can be used in conditions (everything else is a parameter)
+run_columns = ["name", "experiment", "config", "dest", "seed", "gitcommit", "status",
+               "returncode", "walltime", "maxrss", "outputsize", "cputime", "meanrss",
+               "readbytes", "writtenbytes", "snapshot"]
+
+# columns added to the runs table since the first version of the catalogue
+added_columns = {"cputime":"REAL", "meanrss":"REAL", "readbytes":"INTEGER", "writtenbytes":"INTEGER",
+                 "snapshot":"TEXT"}
+
+## AUXILIARY FUNCTIONS
+
+def parse_condition(text):
+    "Parse a condition written as '<name><op><value>' into a (name, op, value) tuple."
+    match = re.match(r"^\s*([\w-]+)\s*(==|=|!=|<=|>=|<|>)\s*(.*?)\s*$", text)
+    if not match:
+        raise ValueError("Invalid condition: "+text)
+    op = "=" if match.group(2) == "==" else match.group(2)
+    return match.group(1), op, match.group(3)
+
+def condition_sql(name, op, value):
+    "Translate a condition into an SQL expression on the runs table and its arguments."
+    numeric = op not in ("=", "!=")
+    if name in run_columns:
+        column = "CAST(runs."+name+" AS REAL)" if numeric else "runs."+name
+        return column+" "+op+" ?", [float(value) if numeric else value]
+    column = "CAST(value AS REAL)" if numeric else "value"
+    return ("runs.id IN (SELECT run FROM params WHERE name = ? AND "+column+" "+op+" ?)",
+            [name, float(value) if numeric else value])
+
+def setting_value(value):
+    "Strip the quotes that GeMM puts around strings when it writes out its settings (cf. `writesettings`)."
+    return value[1:-1] if len(value) > 1 and value[0] == value[-1] == '"' else value
+
+def output_files(dest):
+    "Return the paths (relative to `dest`) and sizes of all files in an output directory."
+    files = []
+    if dest and os.path.isdir(dest):
+        for root, dirs, names in os.walk(dest):
+            for n in names:
+                path = os.path.join(root, n)
+                if os.path.isfile(path):
+                    files.append((os.path.relpath(path, dest), os.path.getsize(path)))
+    return sorted(files)
+
+def experiment_name(name):
+    "The experiment of a run, i.e. its name up to the first underscore."
+    return name.split("_")[0]
+
+
+## THE CATALOGUE
+
+class Catalogue:
+    """
+    The run catalogue database. Every call opens its own connection, so one
+    catalogue can be shared between threads and between several launchers
+    running at the same time.
+    """
+
+    def __init__(self, path="results/catalogue.sqlite"):
+        self.path = path
+        self.hashes = {} # map hashes, keyed on (path, mtime, size)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with closing(self.connect()) as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(schema)
+            columns = [c[1] for c in db.execute("PRAGMA table_info(runs)")]
+            for c in added_columns:
+                if c not in columns:
+                    db.execute("ALTER TABLE runs ADD COLUMN "+c+" "+added_columns[c])
+
+    def connect(self):
+        db = sqlite3.connect(self.path, timeout=60)
+        db.row_factory = sqlite3.Row
+        return db
+
+    def map_hash(self, path):
+        "Return the hash of a map file (cached as long as the file is unchanged)."
+        if not os.path.isfile(path):
+            return "missing"
+        stat = os.stat(path)
+        ident = (path, stat.st_mtime, stat.st_size)
+        if ident not in self.hashes:
+            self.hashes[ident] = cache.file_hash(path)
+        return self.hashes[ident]
+
+    def register(self, job, start=None, maps=None):
+        """
+        Record that a job has been started. Returns its run ID (also stored as
+        `job.runid`). The map files are taken from the job's config, unless given.
+        """
+        start = start if start is not None else time.time()
+        settings = cache.read_config(job.config) if os.path.exists(job.config) else {}
+        params = dict(settings)
+        params.update(job.params)
+        params.pop("dest", None)
+        params.pop("seed", None)
+        maps = maps if maps is not None else cache.map_files(job.config, settings)
+        with closing(self.connect()) as db, db:
+            cursor = db.execute("INSERT INTO runs (name, experiment, config, dest, seed, gitcommit, "+
+                                "snapshot, runkey, started, status) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                (job.name, experiment_name(job.name), job.config, job.dest,
+                                 job.seed, cache.git_commit(), snapshot.current(), job.key, start,
+                                 "running"))
+            job.runid = cursor.lastrowid
+            db.executemany("INSERT INTO params VALUES (?, ?, ?)",
+                           [(job.runid, k, str(v)) for k, v in params.items()])
+            db.executemany("INSERT INTO maps VALUES (?, ?, ?)",
+                           [(job.runid, m, self.map_hash(m)) for m in maps])
+        return job.runid
+
+    def finish(self, result):
+        """
+        Record the outcome of a job (a `scheduler.Result`), including its output
+        files and its resource samples (see `gemmpy/resources.py`).
+        """
+        runid = result.job.runid
+        if runid is None:
+            return
+        files = output_files(result.job.dest)
+        costs = resources.run_costs(result)
+        with closing(self.connect()) as db, db:
+            db.execute("UPDATE runs SET started = ?, finished = ?, status = ?, returncode = ?, "+
+                       "walltime = ?, maxrss = ?, outputsize = ?, cputime = ?, meanrss = ?, "+
+                       "readbytes = ?, writtenbytes = ? WHERE id = ?",
+                       (result.start, result.end, result.status, result.returncode,
+                        result.walltime, result.maxrss, sum(size for path, size in files),
+                        costs["cputime"], costs["meanrss"], costs["read"], costs["written"], runid))
+            db.execute("DELETE FROM outputs WHERE run = ?", (runid,))
+            db.executemany("INSERT INTO outputs VALUES (?, ?, ?)",
+                           [(runid, path, size) for path, size in files])
+            db.executemany("INSERT INTO samples VALUES (?, ?, ?, ?, ?, ?, ?)",
+                           [(runid,)+tuple(s) for s in result.samples])
+
+    def where(self, conditions, latest=True):
+        "Build the WHERE clause for a list of conditions (strings or tuples)."
+        clauses, args = [], []
+        for c in conditions:
+            sql, values = condition_sql(*(parse_condition(c) if isinstance(c, str) else c))
+            clauses.append(sql)
+            args.extend(values)
+        if latest: # only the most recent run of each output directory
+            clauses.append("runs.id IN (SELECT max(id) FROM runs GROUP BY dest)")
+        return (" WHERE "+" AND ".join(clauses) if clauses else ""), args
+
+    def find(self, *conditions, latest=True, **params):
+        """
+        Select runs by condition (see `parse_condition`) and/or by parameter value
+        (`find("tolerance<0.1", speciation="neutral")`). Returns a list of dicts,
+        with the run's settings under "params". Unless `latest` is false, runs
+        that were repeated in the same output directory are only listed once.
+        """
+        conditions = list(conditions) + [(k, "=", str(v)) for k, v in params.items()]
+        where, args = self.where(conditions, latest)
+        with closing(self.connect()) as db:
+            runs = [dict(r) for r in db.execute("SELECT * FROM runs"+where+" ORDER BY id", args)]
+            for r in runs:
+                r["params"] = {p["name"]: p["value"] for p in
+                               db.execute("SELECT name, value FROM params WHERE run = ?", (r["id"],))}
+        return runs
+
+    def cost(self, parameter, *conditions):
+        """
+        Summarise the cost of the finished runs for each value of a parameter:
+        number of runs, mean and maximum wall time, mean CPU time, maximum peak
+        RSS, mean bytes written and mean output size. Sorted by mean wall time,
+        slowest first.
+        """
+        where, args = self.where(list(conditions)+["status!=running"])
+        with closing(self.connect()) as db:
+            return [dict(r) for r in db.execute(
+                "SELECT params.value AS value, count(*) AS runs, avg(walltime) AS meanwall, "+
+                "max(walltime) AS maxwall, avg(cputime) AS meancpu, max(maxrss) AS maxrss, "+
+                "avg(writtenbytes) AS meanwritten, avg(outputsize) AS meansize "+
+                "FROM runs JOIN params ON params.run = runs.id AND params.name = ?"+where+
+                " GROUP BY params.value ORDER BY meanwall DESC", [parameter]+args)]
+
+    def samples(self, name):
+        "Return the resource samples of the most recent run with the given name."
+        with closing(self.connect()) as db:
+            return [tuple(r) for r in db.execute(
+                "SELECT time, cputime, rss, read, written, output FROM samples WHERE run = "+
+                "(SELECT max(id) FROM runs WHERE name = ?) ORDER BY time", (name,))]
+
+    def index(self, resultsdir="results"):
+        """
+        Add existing output directories that are not in the catalogue yet (e.g.
+        from before the catalogue was introduced), using the config file that
+        GeMM copies into each one. Its values are unquoted to match those of
+        registered runs. (GeMM has already resolved the map paths in this copy,
+        so they are not relative to it.) Returns the number of runs added.
+        """
+        with closing(self.connect()) as db:
+            known = set(r[0] for r in db.execute("SELECT dest FROM runs"))
+        added = 0
+        for name in sorted(os.listdir(resultsdir)):
+            dest = os.path.join(resultsdir, name)
+            configs = [f for f in os.listdir(dest) if re.search(r"\.conf(ig)?$", f)] \
+                if os.path.isdir(dest) else []
+            if dest in known or not configs:
+                continue
+            config = os.path.join(dest, configs[0])
+            params = {k: setting_value(v) for k, v in cache.read_config(config).items()}
+            seed = params.get("seed")
+            job = scheduler.Job(name, config, dest, int(seed) if seed and seed.isdigit() else None,
+                                params)
+            files = output_files(dest)
+            mtimes = [os.path.getmtime(os.path.join(dest, f)) for f, s in files]
+            self.register(job, min(mtimes), cache.map_files(config, params, resolved=True))
+            complete = os.path.exists(os.path.join(dest, cache.MARKER))
+            with closing(self.connect()) as db, db:
+                db.execute("UPDATE runs SET gitcommit = NULL, finished = ?, status = ?, "+
+                           "walltime = ?, outputsize = ? WHERE id = ?",
+                           (max(mtimes), "done" if complete else "unknown",
+                            max(mtimes) - min(mtimes), sum(s for f, s in files), job.runid))
+                db.executemany("INSERT INTO outputs VALUES (?, ?, ?)",
+                               [(job.runid, f, s) for f, s in files])
+            added += 1
+        return added
+
+
+## OUTPUT
+
+def print_runs(runs):
+    "Print a table of runs."
+    print("%-40s %6s %-18s %12s %10s %10s" % ("run", "seed", "status", "wall time", "peak RSS", "output"))
+    for r in runs:
+        print("%-40s %6s %-18s %12s %10s %10s" % (
+            r["name"], r["seed"], r["status"],
+            scheduler.format_duration(r["walltime"]) if r["walltime"] is not None else "-",
+            str(round(r["maxrss"]))+" MB" if r["maxrss"] is not None else "-",
+            resources.format_bytes(r["outputsize"])))
+
+def print_cost(parameter, rows):
+    "Print the cost summary of a parameter."
+    print("%-20s %6s %12s %12s %12s %10s %10s %10s" % (parameter, "runs", "mean wall", "max wall",
+                                                       "mean CPU", "peak RSS", "written", "output"))
+    for r in rows:
+        print("%-20s %6d %12s %12s %12s %10s %10s %10s" % (
+            r["value"], r["runs"],
+            scheduler.format_duration(r["meanwall"]) if r["meanwall"] is not None else "-",
+            scheduler.format_duration(r["maxwall"]) if r["maxwall"] is not None else "-",
+            scheduler.format_duration(r["meancpu"]) if r["meancpu"] is not None else "-",
+            str(round(r["maxrss"]))+" MB" if r["maxrss"] is not None else "-",
+            resources.format_bytes(r["meanwritten"]), resources.format_bytes(r["meansize"])))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Query the catalogue of simulation runs.")
+    parser.add_argument("command", choices=["list", "cost", "samples", "index"])
+    parser.add_argument("args", nargs="*",
+                        help="conditions (list), a parameter and conditions (cost), a run name (samples), "+
+                        "or a results folder (index)")
+    parser.add_argument("-d", "--database", default="results/catalogue.sqlite",
+                        help="catalogue file")
+    parser.add_argument("--dirs", action="store_true", help="only print the output directories")
+    parser.add_argument("--all", action="store_true",
+                        help="include earlier runs in the same output directory")
+    args = parser.parse_args()
+    if args.command != "index" and not os.path.exists(args.database):
+        print("No catalogue found at "+args.database+".", file=sys.stderr)
+        sys.exit(1)
+    catalogue = Catalogue(args.database)
+    try:
+        if args.command == "list":
+            runs = catalogue.find(*args.args, latest=not args.all)
+            if args.dirs:
+                for r in runs:
+                    print(r["dest"])
+            else:
+                print_runs(runs)
+        elif args.command == "cost":
+            if not args.args:
+                parser.error("cost needs a parameter name")
+            print_cost(args.args[0], catalogue.cost(*args.args))
+        elif args.command == "samples":
+            if not args.args:
+                parser.error("samples needs a run name")
+            print("\t".join(resources.sample_columns))
+            for s in catalogue.samples(args.args[0]):
+                print("\t".join(str(v) for v in s))
+        else:
+            resultsdir = args.args[0] if args.args else "results"
+            print("Added "+str(catalogue.index(resultsdir))+" runs from "+resultsdir+".")
+    except ValueError as e:
+        print(str(e), file=sys.stderr)
+        sys.exit(1)
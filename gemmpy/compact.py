@@ -0,0 +1,372 @@
+##
+## Compact the output folder of a finished run. GeMM copies every map file into
+## the folder of each run (see `setupdatadir`) and writes its logs as plain text,
+## so an experiment's results are mostly duplicated maps and compressible text.
+## Compaction replaces the map copies with references into a content-addressed
+## store shared by all runs (`<results>/.mapstore`, one file per distinct map,
+## named by its SHA-256 hash), and packs the logs and population statistics
+## (`*.log`, `pops*.tsv`) into one zstd-compressed container, `outputs.zpack`.
+## The container compresses each member in independent chunks and ends with an
+## index of its members, so any part of any file can be read without
+## decompressing the rest.
+##
+## Tools read run outputs through `open_output(rundir, name)`, which returns the
+## plain file if it exists and the packed (or referenced) copy otherwise. The
+## individual and sequence dumps (`inds_s*.tsv`, `seqs_s*.fa`) are left as plain
+## files, as their readers (`gemmpy/inds.py`, `gemmpy/alignment.py`,
+## `gemmpy/fasta.py`) need them on disk.
+##
+## Usage: python3 -m gemmpy.compact pack <rundir> [...]
+##        python3 -m gemmpy.compact list <rundir>
+##        python3 -m gemmpy.compact cat <rundir> <file>
+##        python3 -m gemmpy.compact extract <rundir> [<file> ...]
+##
+
+import os, io, sys, json, bisect, struct, shutil, hashlib, fnmatch, argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import zstandard
+
+PACK = "outputs.zpack"
+STORE = ".mapstore" # in the results folder
+MAGIC = b"GEMMPACK"
+FOOTER = struct.Struct("<QQ8s") # index offset, index length, magic
+
+# the run outputs that are packed, and those that are moved to the map store
+packed_patterns = ["*.log", "pops*.tsv"]
+map_patterns = ["*.map"]
+
+CHUNKSIZE = 1 << 22 # uncompressed bytes per independently compressed chunk
+
+## AUXILIARY FUNCTIONS
+
+def matches(name, patterns):
+    return any(fnmatch.fnmatch(name, p) for p in patterns)
+
+def default_store(rundir):
+    return os.path.join(os.path.dirname(os.path.abspath(rundir)), STORE)
+
+def hash_file(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def store_blob(path, store):
+    "Add a file to the content-addressed store (unless it is already there). Returns its hash."
+    digest = hash_file(path)
+    blob = os.path.join(store, digest[:2], digest)
+    if not os.path.exists(blob):
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        shutil.copyfile(path, blob+".tmp")
+        os.replace(blob+".tmp", blob)
+    return digest
+
+
+## READING A PACK
+
+class Pack:
+    "An `outputs.zpack` container, opened for reading."
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        self.file.seek(-FOOTER.size, os.SEEK_END)
+        offset, length, magic = FOOTER.unpack(self.file.read(FOOTER.size))
+        if magic != MAGIC:
+            raise ValueError(path+" is not a GeMM output pack.")
+        self.file.seek(offset)
+        self.index = json.loads(self.file.read(length))
+        self.members = self.index["members"]
+        self.dctx = zstandard.ZstdDecompressor()
+
+    def __contains__(self, name):
+        return name in self.members
+
+    def names(self):
+        return list(self.members)
+
+    def chunk(self, offset, length):
+        "Read and decompress one chunk."
+        self.file.seek(offset)
+        return self.dctx.decompress(self.file.read(length))
+
+    def blob(self, name):
+        "The path of a referenced member in the map store."
+        digest = self.members[name]["ref"]
+        store = os.path.join(os.path.dirname(self.path), self.index["store"])
+        return os.path.join(store, digest[:2], digest)
+
+    def open(self, name, mode="r", owner=False):
+        """
+        Open a member for reading, in text ('r') or binary ('rb') mode. If `owner`
+        is true, the pack is closed when the member is.
+        """
+        if name not in self.members:
+            raise FileNotFoundError(name+" is not in "+self.path+".")
+        if "ref" in self.members[name]:
+            if owner:
+                self.close()
+            return open(self.blob(name), mode)
+        raw = io.BufferedReader(Member(self, self.members[name], owner), CHUNKSIZE)
+        return raw if "b" in mode else io.TextIOWrapper(raw)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class Member(io.RawIOBase):
+    """
+    A seekable, read-only view of a packed file. Only the chunks that are
+    actually read are decompressed (the last one is kept).
+    """
+
+    def __init__(self, pack, entry, owner=False):
+        self.pack = pack
+        self.owner = owner
+        self.chunks = entry["chunks"] # (offset, compressed length, uncompressed length)
+        self.size = entry["size"]
+        self.starts = []
+        start = 0
+        for c in self.chunks:
+            self.starts.append(start)
+            start += c[2]
+        self.pos = 0
+        self.cached = (None, b"")
+
+    def close(self):
+        if self.owner and not self.closed:
+            self.pack.close()
+        io.RawIOBase.close(self)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.pos
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self.pos = max(0, offset)
+        return self.pos
+
+    def readinto(self, buffer):
+        if self.pos >= self.size:
+            return 0
+        i = bisect.bisect_right(self.starts, self.pos) - 1
+        if self.cached[0] != i:
+            self.cached = (i, self.pack.chunk(self.chunks[i][0], self.chunks[i][1]))
+        data = self.cached[1]
+        start = self.pos - self.starts[i]
+        n = min(len(buffer), len(data) - start)
+        buffer[:n] = data[start:start+n]
+        self.pos += n
+        return n
+
+
+## READING RUN OUTPUTS
+
+def pack_of(rundir):
+    "The pack of a run folder (or None if it hasn't been compacted)."
+    path = os.path.join(rundir, PACK)
+    return Pack(path) if os.path.exists(path) else None
+
+def packed(rundir):
+    "The index entries of the packed files of a run ({} if it hasn't been compacted)."
+    pack = pack_of(rundir)
+    if pack is None:
+        return {}
+    pack.close()
+    return pack.members
+
+def open_output(rundir, name, mode="r"):
+    """
+    Open an output file of a run for reading, whether it is still a plain file
+    or has been compacted. Raises FileNotFoundError if the run has no such file.
+    """
+    path = os.path.join(rundir, name)
+    if os.path.exists(path):
+        return open(path, mode)
+    pack = pack_of(rundir)
+    if pack is None or name not in pack:
+        if pack:
+            pack.close()
+        raise FileNotFoundError("No "+name+" in "+rundir+".")
+    return pack.open(name, mode, owner=True)
+
+def output_exists(rundir, name):
+    if os.path.exists(os.path.join(rundir, name)):
+        return True
+    return name in packed(rundir)
+
+def output_state(rundir, name):
+    """
+    Return the size and modification time of an output file, to detect changes.
+    (Packed files keep the values they had before compaction.)
+    """
+    path = os.path.join(rundir, name)
+    if os.path.exists(path):
+        st = os.stat(path)
+        return [st.st_size, st.st_mtime]
+    members = packed(rundir)
+    if name not in members:
+        raise FileNotFoundError("No "+name+" in "+rundir+".")
+    return [members[name]["size"], members[name]["mtime"]]
+
+def list_outputs(rundir):
+    "List the files of a run folder, including the packed ones (but not the pack itself)."
+    return sorted(set(n for n in os.listdir(rundir) if n != PACK) | set(packed(rundir)))
+
+
+## COMPACTING A RUN
+
+def write_member(out, path, cctx, chunksize=CHUNKSIZE):
+    "Compress a file into the pack in independent chunks. Returns its chunk list."
+    chunks = []
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunksize), b""):
+            data = cctx.compress(block)
+            chunks.append((out.tell(), len(data), len(block)))
+            out.write(data)
+    return chunks
+
+def compact(rundir, store=None, level=3):
+    """
+    Compact a run folder: move its maps to the store (default: `.mapstore` next
+    to the run folder) and pack its text outputs. A folder that was compacted
+    before keeps its packed files, and any new files are added. The originals
+    are only removed once the new pack is complete. Returns the number of bytes
+    freed in the run folder.
+    """
+    store = store if store else default_store(rundir)
+    old = pack_of(rundir)
+    members = {} if old is None else dict(old.members)
+    files = sorted(n for n in os.listdir(rundir)
+                   if os.path.isfile(os.path.join(rundir, n)) and n != PACK)
+    maps = [n for n in files if matches(n, map_patterns)]
+    texts = [n for n in files if matches(n, packed_patterns)]
+    if not maps and not texts:
+        if old:
+            old.close()
+        return 0
+    before = sum(os.path.getsize(os.path.join(rundir, n)) for n in maps + texts)
+    before += os.path.getsize(old.path) if old else 0
+    cctx = zstandard.ZstdCompressor(level=level)
+    tmp = os.path.join(rundir, PACK+".tmp")
+    with open(tmp, "wb") as out:
+        out.write(MAGIC)
+        for name, entry in list(members.items()):
+            if name in maps or name in texts:
+                del members[name] # replaced by a newer file
+            elif "chunks" in entry: # copy the compressed chunks of the old pack
+                chunks = []
+                for offset, length, size in entry["chunks"]:
+                    old.file.seek(offset)
+                    chunks.append((out.tell(), length, size))
+                    out.write(old.file.read(length))
+                members[name] = dict(entry, chunks=chunks)
+        for name in maps:
+            path = os.path.join(rundir, name)
+            members[name] = {"ref":store_blob(path, store), "size":os.path.getsize(path),
+                             "mtime":os.path.getmtime(path)}
+        for name in texts:
+            path = os.path.join(rundir, name)
+            members[name] = {"chunks":write_member(out, path, cctx),
+                             "size":os.path.getsize(path), "mtime":os.path.getmtime(path)}
+        index = json.dumps({"store":os.path.relpath(store, rundir), "members":members}).encode()
+        offset = out.tell()
+        out.write(index)
+        out.write(FOOTER.pack(offset, len(index), MAGIC))
+    if old:
+        old.close()
+    os.replace(tmp, os.path.join(rundir, PACK))
+    for name in maps + texts:
+        os.remove(os.path.join(rundir, name))
+    return before - os.path.getsize(os.path.join(rundir, PACK))
+
+def extract(rundir, names=None):
+    "Restore packed (or referenced) files of a run folder as plain files (default: all)."
+    pack = pack_of(rundir)
+    if pack is None:
+        return []
+    names = names if names else pack.names()
+    for name in names:
+        with pack.open(name, "rb") as src, open(os.path.join(rundir, name), "wb") as dst:
+            shutil.copyfileobj(src, dst, CHUNKSIZE)
+        os.utime(os.path.join(rundir, name), (pack.members[name]["mtime"],) * 2)
+    pack.close()
+    return names
+
+
+class Compactor:
+    """
+    Compact the folders of finished runs in the background, so that the
+    scheduler can go on starting runs. `store` and `level` are passed on to
+    `compact`; a compactor can be given to the executors as their `compact`
+    setting (or True, to use the defaults).
+    """
+
+    def __init__(self, store=None, level=3, threads=1):
+        self.store = store
+        self.level = level
+        self.pool = ThreadPoolExecutor(threads)
+        self.futures = []
+        self.saved = 0
+
+    def submit(self, rundir):
+        if rundir and os.path.isdir(rundir):
+            self.futures.append((rundir, self.pool.submit(compact, rundir, self.store, self.level)))
+
+    def wait(self):
+        "Wait for all compactions, and print how much space they saved."
+        for rundir, future in self.futures:
+            try:
+                self.saved += future.result()
+            except Exception as e:
+                print("Failed to compact "+rundir+": "+str(e), file=sys.stderr)
+        if self.futures:
+            print("Compacted "+str(len(self.futures))+" run folders, saving "+
+                  str(round(self.saved / 2**20, 1))+" MB.")
+        self.futures = []
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compact run folders, or read files from them.")
+    parser.add_argument("command", choices=["pack", "list", "cat", "extract"])
+    parser.add_argument("runs", nargs="+", help="run folders (cat/extract: one folder and file names)")
+    parser.add_argument("-s", "--store", default=None,
+                        help="map store (default: .mapstore in the results folder)")
+    parser.add_argument("-l", "--level", type=int, default=3, help="zstd compression level")
+    args = parser.parse_args()
+    if args.command == "pack":
+        for run in args.runs:
+            saved = compact(run, args.store, args.level)
+            print(run+": saved "+str(round(saved / 2**20, 1))+" MB")
+    elif args.command == "list":
+        for run in args.runs:
+            members = packed(run)
+            for name in list_outputs(run):
+                entry = members.get(name)
+                where = "plain" if os.path.exists(os.path.join(run, name)) else \
+                    ("map store" if "ref" in entry else "packed")
+                size = os.path.getsize(os.path.join(run, name)) if where == "plain" else entry["size"]
+                print("%-40s %14d  %s" % (name, size, where))
+    elif args.command == "cat":
+        with open_output(args.runs[0], args.runs[1], "rb") as f:
+            shutil.copyfileobj(f, sys.stdout.buffer)
+    else:
+        for name in extract(args.runs[0], args.runs[1:]):
+            print("Extracted "+name)
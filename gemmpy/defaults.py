@@ -0,0 +1,74 @@
+##
+## The default settings shared by the launchers (`studies/zosterops/habitatstudy.py`,
+## `studies/zosterops/sensitivity_analysis.py`, `studies/zosterops/Phylogeny_study/
+## phylogenystudy.py`). A launcher takes a copy of each and changes what it needs,
+## e.g. `scheduler_settings = defaults.scheduler(watchdog=["population == 0 for 10"])`.
+## Features that change how runs are started or what they leave behind are off by
+## default and have to be turned on explicitly.
+##
+
+import os
+
+# Limits for running the jobs of an experiment (see `gemmpy/scheduler.py`):
+# maxjobs = number of concurrent runs (default: number of cores),
+# maxmem = memory cap per run in MB, maxcpu = CPU time cap per run in seconds,
+# cache = skip runs whose results already exist (see `gemmpy/cache.py`),
+# watchdog = rules on `diversity.log` for stopping runs early (see `gemmpy/watchdog.py`),
+# e.g. ["population == 0 for 10"], ["lineages == 1 for 5"] or ["gamma unchanged for 50"],
+# catalogue = register all runs in `results/catalogue.sqlite` (see `gemmpy/catalogue.py`),
+# profile = sample the CPU, memory and I/O use of each run every n seconds, and print
+# the cost per swept parameter at the end (see `gemmpy/resources.py`), e.g. 30,
+# totalmem = memory for all concurrent runs in MB (True = this machine's); runs are only
+# started while their predicted peak memory fits (see `gemmpy/planner.py`),
+# compact = pack the logs and population statistics of each finished run and move its
+# map copies to a shared store (see `gemmpy/compact.py`); the R and Julia analysis
+# scripts read the plain files (`python3 -m gemmpy.compact extract <run>` restores them)
+scheduler_settings = {
+    "maxjobs":os.cpu_count(),
+    "maxmem":None,
+    "maxcpu":None,
+    "cache":True,
+    "watchdog":None,
+    "catalogue":False,
+    "profile":None,
+    "totalmem":None,
+    "compact":False
+}
+
+# Further settings for the slurm backend (see `gemmpy/executors.py`):
+# maxjobs = number of concurrently running array tasks, cpus/mem/timelimit/partition =
+# resources per run (passed on to `sbatch`), wait = follow the jobs until they finish
+slurm_settings = {
+    "maxjobs":None,
+    "cpus":1,
+    "mem":None,
+    "timelimit":None,
+    "partition":None,
+    "wait":False
+}
+
+# Settings for converging replicates (see `gemmpy/replicates.py`): metrics = end-of-run
+# metrics that must converge (see `gemmpy/metrics.py`), threshold = widest acceptable
+# 95% confidence interval, relative to the mean (or absolute, if relative is False),
+# wave = new runs per scenario and wave (on average), minseeds = seeds per scenario
+# before checking. (The metrics are read after each wave, so the backend has to wait
+# for the runs.)
+replicate_settings = {
+    "metrics":["diversity:lineages", "pops:heterozygosity"],
+    "threshold":0.1,
+    "relative":True,
+    "wave":5,
+    "minseeds":5
+}
+
+def scheduler(**changes):
+    "A copy of the default scheduler settings, with the given values changed."
+    return dict(scheduler_settings, **changes)
+
+def slurm(**changes):
+    "A copy of the default slurm settings, with the given values changed."
+    return dict(slurm_settings, **changes)
+
+def replicates(**changes):
+    "A copy of the default replicate settings, with the given values changed."
+    return dict(replicate_settings, **changes)
@@ -0,0 +1,295 @@
+##
+## Executors run the jobs of an experiment somewhere. All of them take an
+## iterable of `scheduler.Job`s in `run(jobs)` and return a list of
+## `scheduler.Result`s, so launchers can switch between them with one setting:
+##
+## - "local": a bounded queue of Julia processes (`scheduler.Scheduler`)
+## - "workers": a pool of warm Julia workers (`workers.WorkerPool`)
+## - "slurm": slurm job arrays, one array per `arraysize` jobs (`SlurmExecutor`)
+## - "mock": a local stand-in for slurm, for testing launchers (`MockExecutor`)
+##
+## Usage (in a launcher): executors.make_executor(backend, scheduler_settings,
+##                                                slurm_settings).run(jobs)
+##
+
+import os, sys, time, shlex, subprocess
+
+from gemmpy import cache, catalogue, compact, scheduler, workers
+
+## SLURM JOB ARRAYS
+
+# slurm job states that mean a job has not finished yet
+active_states = ["PENDING", "CONFIGURING", "RUNNING", "COMPLETING", "REQUEUED",
+                 "RESIZING", "SUSPENDED"]
+
+# the result status of a finished slurm job, by its state
+slurm_status = {"COMPLETED":"done", "TIMEOUT":"killed (time)",
+                "OUT_OF_MEMORY":"killed (memory)", "CANCELLED":"killed (cancelled)"}
+
+def slurm_time(timestamp):
+    "Convert a timestamp printed by `sacct` into seconds since the epoch (None if unknown)."
+    try:
+        return time.mktime(time.strptime(timestamp, "%Y-%m-%dT%H:%M:%S"))
+    except ValueError:
+        return None
+
+def exit_code(code):
+    "Convert an exit code printed by `sacct` (`<code>:<signal>`) into a `Popen` return code."
+    try:
+        status, sig = (int(c) for c in code.split(":"))
+    except ValueError:
+        return None
+    return -sig if sig else status
+
+
+class SlurmExecutor:
+    """
+    Submit jobs to slurm as job arrays. The command lines of each batch of up
+    to `arraysize` jobs (slurm's `MaxArraySize` is 1001 by default) are written
+    to a jobs file in `workdir`, and one `sbatch --array` call starts them all;
+    each array task runs the line given by its task ID. At most `maxjobs` tasks
+    of an array run at once (default: no limit). `cpus`, `mem` (e.g. "50GB"),
+    `timelimit` (e.g. "2-00:00:00") and `partition` are passed on to `sbatch`,
+    as are any further `options`. If `maxmem` (in MB) or `maxcpu` (in seconds)
+    are given instead, they are used as the memory and time limits.
+    `cache`, `catalogue` and `compact` work as for `scheduler.Scheduler`; with a
+    `cache`, each array task writes the completion marker of its run itself, so
+    that finished runs are skipped on the next launch even if nobody waited for
+    them. If `wait` is true, the jobs are followed with `sacct` (every `interval`
+    seconds) until they have all finished, and their results are recorded (and
+    their folders compacted); tasks that `sacct` hasn't listed for `missing`
+    seconds count as failed. Otherwise, `run` returns as soon as everything is
+    submitted. (Watchdog rules and resource profiles need to observe the
+    processes, and are not available on slurm.)
+    """
+
+    def __init__(self, maxjobs=None, maxmem=None, maxcpu=None, cache=None, catalogue=None,
+                 compact=None, cpus=1, mem=None, timelimit=None, partition=None, arraysize=1000,
+                 wait=False, interval=60, missing=3600, workdir="slurm", options=None):
+        self.maxjobs = maxjobs
+        self.cache = cache_of(cache)
+        self.catalogue = catalogue_of(catalogue)
+        self.compactor = compactor_of(compact)
+        self.cpus = cpus
+        self.mem = mem if mem else (str(int(maxmem))+"M" if maxmem else None)
+        self.timelimit = timelimit if timelimit else (str(-(-int(maxcpu) // 60)) if maxcpu else None)
+        self.partition = partition
+        self.arraysize = arraysize
+        self.wait = wait
+        self.interval = interval
+        self.missing = missing
+        self.workdir = workdir
+        self.options = options if options else []
+        self.arrays = [] # (array job ID, list of jobs)
+        self.results = []
+        self.skipped = 0
+
+    def sbatch_args(self, name, jobsfile, ntasks):
+        "The `sbatch` command line for an array that runs the lines of a jobs file."
+        args = ["sbatch", "--parsable", "--job-name="+name,
+                "--array=1-"+str(ntasks)+("%"+str(self.maxjobs) if self.maxjobs else ""),
+                "--cpus-per-task="+str(self.cpus),
+                "--output="+os.path.join(self.workdir, name+"_%A_%a.out")]
+        if self.mem:
+            args.append("--mem="+self.mem)
+        if self.timelimit:
+            args.append("--time="+self.timelimit)
+        if self.partition:
+            args.append("--partition="+self.partition)
+        task = 'eval "$(sed -n "${SLURM_ARRAY_TASK_ID}p" '+shlex.quote(jobsfile)+')"'
+        return args + self.options + ["--wrap", task]
+
+    def task_command(self, job):
+        "The line of the jobs file for a job (which marks the run as complete if it succeeds)."
+        line = shlex.join(job.command())
+        if self.cache and job.key and job.dest:
+            marker = os.path.join(job.dest, cache.MARKER)
+            line += " && echo "+shlex.quote(job.key)+" > "+shlex.quote(marker)
+        return line
+
+    def submit(self, args, jobsfile):
+        "Submit an array job. Returns its job ID."
+        output = subprocess.run(args, capture_output=True, text=True, check=True).stdout
+        return output.strip().split(";")[0] # "<jobid>[;<cluster>]"
+
+    def states(self, arrayid):
+        """
+        Query the state of the tasks of an array job. Returns a dict mapping task
+        numbers to (state, return code, start, end) tuples. Pending tasks that are
+        listed as ranges (e.g. "[5-10%4]") are included as "PENDING".
+        """
+        output = subprocess.run(["sacct", "-X", "-n", "-P", "-j", arrayid,
+                                 "--format=JobID,State,ExitCode,Start,End"],
+                                capture_output=True, text=True).stdout
+        states = {}
+        for line in output.splitlines():
+            fields = line.split("|")
+            if len(fields) < 5 or not fields[0].startswith(arrayid+"_"):
+                continue
+            task = fields[0][len(arrayid)+1:]
+            if task.isdigit():
+                states[int(task)] = (fields[1].split()[0], exit_code(fields[2]),
+                                     slurm_time(fields[3]), slurm_time(fields[4]))
+            elif task.startswith("["):
+                for span in task.strip("[]").split("%")[0].split(","):
+                    first, sep, last = span.partition("-")
+                    if first.isdigit() and (last.isdigit() or not sep):
+                        for i in range(int(first), int(last if sep else first) + 1):
+                            states.setdefault(i, ("PENDING", None, None, None))
+        return states
+
+    def submit_array(self, jobs):
+        "Write the jobs file for a batch of jobs and submit it as an array job."
+        os.makedirs(self.workdir, exist_ok=True)
+        name = catalogue.experiment_name(jobs[0].name)+"_"+str(len(self.arrays)+1)
+        jobsfile = os.path.join(self.workdir, name+"_"+time.strftime("%Y%m%d%H%M%S")+".jobs")
+        with open(jobsfile, "w") as f:
+            for job in jobs:
+                f.write(self.task_command(job)+"\n")
+        if self.catalogue:
+            for job in jobs:
+                self.catalogue.register(job)
+        arrayid = self.submit(self.sbatch_args(name, jobsfile, len(jobs)), jobsfile)
+        print("Submitted "+str(len(jobs))+" jobs as array job "+arrayid+" ("+jobsfile+").")
+        self.arrays.append((arrayid, jobs))
+        return arrayid
+
+    def finish(self, job, state, returncode, start, end):
+        "Record the result of a finished array task."
+        status = slurm_status.get(state, "failed")
+        now = time.time()
+        result = scheduler.Result(job, status, returncode, start or now, end or now)
+        self.results.append(result)
+        if self.cache and status == "done":
+            self.cache.store(job, status)
+        if self.catalogue:
+            self.catalogue.finish(result)
+        if self.compactor and status == "done":
+            self.compactor.submit(job.dest)
+        if status != "done":
+            print("Job "+job.name+" "+status+" (slurm state "+state+").", file=sys.stderr)
+        return result
+
+    def follow(self):
+        """
+        Wait until all submitted array jobs have finished, recording their results.
+        Tasks that `sacct` doesn't list for `missing` seconds are recorded as failed.
+        """
+        pending = {(arrayid, i+1): job for arrayid, jobs in self.arrays for i, job in enumerate(jobs)}
+        seen = {task: time.time() for task in pending}
+        while pending:
+            time.sleep(self.interval)
+            now = time.time()
+            for arrayid in set(a for a, i in pending):
+                for task, (state, returncode, start, end) in self.states(arrayid).items():
+                    if (arrayid, task) not in pending:
+                        continue
+                    seen[(arrayid, task)] = now
+                    if state not in active_states:
+                        self.finish(pending.pop((arrayid, task)), state, returncode, start, end)
+            for task in [t for t in pending if now - seen[t] > self.missing]:
+                print("Array task "+task[0]+"_"+str(task[1])+" has not been listed by sacct for "+
+                      str(self.missing)+" seconds.", file=sys.stderr)
+                self.finish(pending.pop(task), "MISSING", None, None, None)
+
+    def run(self, jobs):
+        """
+        Submit all jobs (skipping cached ones) as job arrays. If `wait` is set,
+        wait until they have finished. Returns a list of results (empty if not waiting).
+        """
+        t0 = time.time()
+        batch = []
+        for job in jobs:
+            if self.cache and self.cache.skip(job):
+                self.skipped += 1
+                continue
+            batch.append(job)
+            if len(batch) == self.arraysize:
+                self.submit_array(batch)
+                batch = []
+        if batch:
+            self.submit_array(batch)
+        if self.skipped:
+            print("Skipped "+str(self.skipped)+" jobs with cached results.")
+        if self.wait and self.arrays:
+            self.follow()
+            if self.compactor:
+                self.compactor.wait()
+            scheduler.summarise(self.results, time.time() - t0)
+        return self.results
+
+
+class MockExecutor(SlurmExecutor):
+    """
+    A local stand-in for slurm, for testing launchers and the array submission
+    on machines without a cluster. Arrays are "submitted" by recording their
+    `sbatch` command lines (in `submissions`); if `execute` is true, their tasks
+    are then run one after the other on this machine, otherwise they all
+    complete immediately. Unlike `SlurmExecutor`, it always waits for the results.
+    """
+
+    def __init__(self, *args, execute=False, **kwargs):
+        kwargs["wait"] = True
+        kwargs["interval"] = 0
+        SlurmExecutor.__init__(self, *args, **kwargs)
+        self.execute = execute
+        self.submissions = []
+        self.tasks = {} # maps array job IDs to their task states
+
+    def submit(self, args, jobsfile):
+        self.submissions.append(args)
+        arrayid = str(len(self.submissions))
+        with open(jobsfile) as f:
+            lines = f.read().splitlines()
+        self.tasks[arrayid] = {}
+        for i, line in enumerate(lines):
+            start = time.time()
+            returncode = subprocess.run(line, shell=True).returncode if self.execute else 0
+            self.tasks[arrayid][i+1] = ("COMPLETED" if returncode == 0 else "FAILED",
+                                        returncode, start, time.time())
+        return arrayid
+
+    def states(self, arrayid):
+        return self.tasks[arrayid]
+
+
+## CHOOSING AN EXECUTOR
+
+def cache_of(setting):
+    return cache.RunCache() if setting is True else setting
+
+def catalogue_of(setting):
+    return catalogue.Catalogue() if setting is True else setting
+
+def compactor_of(setting):
+    return compact.Compactor() if setting is True else setting
+
+backends = ["local", "workers", "slurm", "mock"]
+
+def make_executor(backend="local", settings=None, slurm=None):
+    """
+    Create the executor for a backend. `settings` are the launcher's scheduler
+    settings (see `scheduler.Scheduler`), `slurm` any further settings for the
+    slurm and mock executors (see `SlurmExecutor`).
+    """
+    settings = settings if settings else {}
+    if backend == "local":
+        return scheduler.Scheduler(**settings)
+    elif backend == "workers":
+        return workers.WorkerPool(settings.get("maxjobs"), settings.get("cache"),
+                                  settings.get("watchdog"), settings.get("catalogue"),
+                                  settings.get("profile"), settings.get("compact"))
+    elif backend in ("slurm", "mock"):
+        options = {k: settings.get(k) for k in ["maxmem", "maxcpu", "cache", "catalogue", "compact"]}
+        options.update(slurm if slurm else {})
+        return (SlurmExecutor if backend == "slurm" else MockExecutor)(**options)
+    raise ValueError("Unknown backend: "+str(backend)+" (use one of "+", ".join(backends)+").")
+
+def backend_option(argv, default="local"):
+    "Remove a `--<backend>` flag (e.g. `--slurm`) from the commandline and return the backend."
+    backend = default
+    for b in backends:
+        if "--"+b in argv:
+            argv.remove("--"+b)
+            backend = b
+    return backend
@@ -0,0 +1,263 @@
+##
+## An index and random-access reader for the `seqs_s*.fa` genome dumps written by
+## `writefasta`. The index records the byte offsets of every gene sequence, keyed
+## on timestep, lineage, individual ID, chromosome and gene (decoded from the
+## `makefasta` headers `>lineage_id_chrm_gene_traits`). The reader memory-maps the
+## FASTA file, so single individuals or lineages can be read without a scan.
+##
+## Usage: python3 -m gemmpy.fasta index <seqs.fa> [--inds <inds.tsv>] [--freq <fastaoutfreq>]
+##        python3 -m gemmpy.fasta get <seqs.fa> <timestep> (--id <id> | --lineage <lineage>)
+##
+
+import os, re, sys, mmap, json, array, argparse
+
+INDEX_SUFFIX = ".gidx"
+
+# per-gene and per-individual index columns with their array typecodes
+# (8-byte columns first, so that all columns stay aligned in the index file)
+gene_columns = [("hoff", "q"), ("hlen", "i"), ("slen", "i"), ("chrm", "i"), ("gene", "i")]
+ind_columns = [("id", "q"), ("first", "q"), ("block", "i"), ("lineage", "i"), ("ngenes", "i")]
+
+## AUXILIARY FUNCTIONS
+
+def parse_header(line):
+    "Split a FASTA header into lineage, ID, chromosome, gene number and traits."
+    lineage, ind, chrm, gene, traits = line[1:].rstrip("\r\n").rsplit("_", 4)
+    return lineage, int(ind), int(chrm), int(gene), traits
+
+def find_inds(fastafile):
+    "Return the `inds_s*.tsv` file belonging to a `seqs_s*.fa` file (or None)."
+    match = re.match(r"seqs_s(\d+)\.fa$", os.path.basename(fastafile))
+    if match:
+        indsfile = os.path.join(os.path.dirname(fastafile), "inds_s"+match.group(1)+".tsv")
+        if os.path.exists(indsfile):
+            return indsfile
+    return None
+
+def count_inds(indsfile):
+    "Count the individuals per timestep in an `inds_s*.tsv` file (cf. `speciation_post.jl`)."
+    counts = []
+    with open(indsfile, "rb") as f:
+        for line in f:
+            t = line[:line.find(b"\t")]
+            if t == b"time":
+                continue
+            t = int(t)
+            if counts and counts[-1][0] == t:
+                counts[-1][1] += 1
+            else:
+                counts.append([t, 1])
+    return counts
+
+
+## INDEX CREATION
+
+def build_index(fastafile, indsfile=None, fastaoutfreq=None):
+    """
+    Scan a FASTA file once and write its index to `<fastafile>.gidx`. Timesteps
+    are assigned by counting individuals in the matching `inds_s*.tsv` (as
+    written with `dumpindforfasta`). Without it, a new timestep is assumed to
+    start whenever an individual reappears, and timesteps are numbered in
+    multiples of `fastaoutfreq`.
+    """
+    if indsfile is None:
+        indsfile = find_inds(fastafile)
+    counts = count_inds(indsfile) if indsfile else None
+    if counts is None:
+        print("No individuals file found for "+fastafile+", guessing timesteps.", file=sys.stderr)
+    genes = {c: array.array(t) for c, t in gene_columns}
+    inds = {c: array.array(t) for c, t in ind_columns}
+    lineages, lineage_codes = [], {}
+    blocks = [] # [timestep, first individual, number of individuals]
+    current, seen, last = None, set(), None
+    offset = 0
+    with open(fastafile, "rb") as f:
+        for line in f:
+            if line[:1] != b">":
+                genes["slen"].append(len(line.rstrip(b"\r\n")))
+                offset += len(line)
+                continue
+            lineage, ind, chrm, gene, traits = parse_header(line.decode())
+            if (lineage, ind) != current or (chrm, gene) <= last:
+                # a new individual (when the ID changes, or when the same individual's
+                # genes start over at the next timestep), and possibly a new timestep
+                current = (lineage, ind)
+                if counts is not None:
+                    if not blocks or blocks[-1][2] == counts[len(blocks) - 1][1]:
+                        if len(blocks) == len(counts):
+                            raise ValueError("The FASTA file has more individuals than "+indsfile+".")
+                        blocks.append([counts[len(blocks)][0], len(inds["id"]), 0])
+                elif not blocks or current in seen:
+                    blocks.append([len(blocks) * (fastaoutfreq or 1), len(inds["id"]), 0])
+                    seen = set()
+                seen.add(current)
+                blocks[-1][2] += 1
+                if lineage not in lineage_codes:
+                    lineage_codes[lineage] = len(lineages)
+                    lineages.append(lineage)
+                inds["id"].append(ind)
+                inds["first"].append(len(genes["hoff"]))
+                inds["block"].append(len(blocks) - 1)
+                inds["lineage"].append(lineage_codes[lineage])
+                inds["ngenes"].append(0)
+            last = (chrm, gene)
+            inds["ngenes"][-1] += 1
+            genes["hoff"].append(offset)
+            genes["hlen"].append(len(line))
+            genes["chrm"].append(chrm)
+            genes["gene"].append(gene)
+            offset += len(line)
+    # sort the individuals of each timestep by ID for fast lookups
+    order = array.array("q", sorted(range(len(inds["id"])),
+                                    key=lambda i: (inds["block"][i], inds["id"][i])))
+    write_index(fastafile+INDEX_SUFFIX, {"fasta":os.path.basename(fastafile),
+                                         "size":offset, "blocks":blocks, "lineages":lineages},
+                [genes[c] for c, t in gene_columns] + [order] +
+                [inds[c] for c, t in ind_columns])
+    return fastafile+INDEX_SUFFIX
+
+def write_index(indexfile, header, columns):
+    "Write the JSON header and the binary columns of an index file."
+    header["lengths"] = [len(c) for c in columns]
+    header["types"] = [c.typecode for c in columns]
+    text = json.dumps(header).encode()+b"\n"
+    text += b" " * (-len(text) % 8) # pad to keep the columns aligned
+    with open(indexfile, "wb") as f:
+        f.write(text)
+        for c in columns:
+            c.tofile(f)
+            f.write(b"\0" * (-len(c) * c.itemsize % 8))
+
+
+## THE READER
+
+class FastaReader:
+    """
+    Random access to a genome dump through its index (which is built if it
+    doesn't exist yet or is outdated). Use as a context manager, or call `close()`.
+    """
+
+    def __init__(self, fastafile, indsfile=None, fastaoutfreq=None):
+        indexfile = fastafile+INDEX_SUFFIX
+        if (not os.path.exists(indexfile) or
+            os.path.getmtime(indexfile) < os.path.getmtime(fastafile)):
+            build_index(fastafile, indsfile, fastaoutfreq)
+        self.fastafile = open(fastafile, "rb")
+        self.fasta = mmap.mmap(self.fastafile.fileno(), 0, access=mmap.ACCESS_READ)
+        self.indexfile = open(indexfile, "rb")
+        self.index = mmap.mmap(self.indexfile.fileno(), 0, access=mmap.ACCESS_READ)
+        headerlen = self.index.find(b"\n") + 1
+        header = json.loads(self.index[:headerlen])
+        self.blocks = header["blocks"]
+        self.lineages = header["lineages"]
+        self.lineage_codes = {l: i for i, l in enumerate(self.lineages)}
+        self.block_codes = {b[0]: i for i, b in enumerate(self.blocks)}
+        # map the columns straight out of the index file
+        self.view = memoryview(self.index)
+        pos = headerlen + (-headerlen % 8)
+        columns = []
+        for n, t in zip(header["lengths"], header["types"]):
+            size = n * array.array(t).itemsize
+            columns.append(self.view[pos:pos+size].cast(t))
+            pos += size + (-size % 8)
+        names = [c for c, t in gene_columns] + ["order"] + [c for c, t in ind_columns]
+        cols = dict(zip(names, columns))
+        self.genes = {c: cols[c] for c, t in gene_columns}
+        self.order = cols["order"]
+        self.inds = {c: cols[c] for c, t in ind_columns}
+
+    def close(self):
+        for c in list(self.genes.values()) + list(self.inds.values()) + [self.order]:
+            c.release()
+        self.view.release()
+        self.index.close()
+        self.indexfile.close()
+        self.fasta.close()
+        self.fastafile.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def timesteps(self):
+        "Return the timesteps contained in the file."
+        return [b[0] for b in self.blocks]
+
+    def individual_count(self, timestep):
+        "Return the number of individuals recorded at a timestep."
+        return self.blocks[self.block_codes[timestep]][2]
+
+    def block(self, timestep):
+        "Return the range of individual records for a timestep."
+        if timestep not in self.block_codes:
+            raise KeyError("Timestep "+str(timestep)+" is not in the FASTA file.")
+        t, first, n = self.blocks[self.block_codes[timestep]]
+        return first, first + n
+
+    def genome(self, record):
+        """
+        Return the genome of an individual record as a list of
+        (chromosome, gene, header, sequence) tuples.
+        """
+        first = self.inds["first"][record]
+        genome = []
+        for g in range(first, first + self.inds["ngenes"][record]):
+            hoff, hlen = self.genes["hoff"][g], self.genes["hlen"][g]
+            header = self.fasta[hoff:hoff+hlen].rstrip(b"\r\n").decode()
+            seq = self.fasta[hoff+hlen:hoff+hlen+self.genes["slen"][g]].decode()
+            genome.append((self.genes["chrm"][g], self.genes["gene"][g], header, seq))
+        return genome
+
+    def records(self, timestep):
+        "Iterate over (lineage, ID, record) for all individuals at a timestep, in file order."
+        first, last = self.block(timestep)
+        for r in range(first, last):
+            yield self.lineages[self.inds["lineage"][r]], self.inds["id"][r], r
+
+    def individual(self, timestep, ind):
+        "Return the genome of the individual with the given ID at a timestep (or None)."
+        first, last = self.block(timestep)
+        lo, hi = first, last # binary search in the ID-sorted order of this block
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.inds["id"][self.order[mid]] < ind:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < last and self.inds["id"][self.order[lo]] == ind:
+            return self.genome(self.order[lo])
+        return None
+
+    def lineage(self, timestep, lineage):
+        "Return a dict of individual IDs to genomes for one lineage at a timestep."
+        code = self.lineage_codes.get(lineage)
+        first, last = self.block(timestep)
+        return {self.inds["id"][r]: self.genome(r) for r in range(first, last)
+                if self.inds["lineage"][r] == code}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Index and query GeMM FASTA genome dumps.")
+    parser.add_argument("command", choices=["index", "get"])
+    parser.add_argument("fasta", help="a seqs_s*.fa file")
+    parser.add_argument("timestep", type=int, nargs="?", help="timestep to query")
+    parser.add_argument("--inds", default=None, help="the matching inds_s*.tsv file")
+    parser.add_argument("--freq", type=int, default=None,
+                        help="fastaoutfreq (only needed without an inds file)")
+    parser.add_argument("--id", type=int, default=None, help="individual ID to query")
+    parser.add_argument("--lineage", default=None, help="lineage to query")
+    args = parser.parse_args()
+    if args.command == "index":
+        print("Wrote "+build_index(args.fasta, args.inds, args.freq))
+    else:
+        with FastaReader(args.fasta, args.inds, args.freq) as reader:
+            if args.id is not None:
+                genomes = {args.id: reader.individual(args.timestep, args.id) or []}
+            else:
+                genomes = reader.lineage(args.timestep, args.lineage)
+            for genome in genomes.values():
+                for chrm, gene, header, seq in genome:
+                    print(header)
+                    print(seq)
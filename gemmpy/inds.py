@@ -0,0 +1,231 @@
+##
+## Convert the raw individual dumps (`inds_s<seed>.tsv`, written by `dumpinds`
+## with one row per individual and output step) into a Parquet dataset that is
+## partitioned by timestep. The file is streamed in bounded blocks, the column
+## types are derived from the header written by `printheader` (whose columns
+## depend on `nniches` and `traitnames`), lineages are dictionary-encoded and
+## all measurements are stored as float32, compressed with zstd. Analyses can
+## then read only the columns and timesteps they need.
+##
+## Usage: python3 -m gemmpy.inds convert <rundir|inds.tsv> [...] [--remove] [-j <jobs>]
+##        python3 -m gemmpy.inds info <dataset>
+##        python3 -m gemmpy.inds traits <dataset> [-c <trait,...>] [-t <time>]
+##
+## The dataset of `results/run/inds_s1.tsv` is the folder `results/run/inds_s1/`.
+##
+
+import os, sys, glob, shutil, argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from gemmpy.resources import format_bytes
+
+# the columns written by `printheader` before the traits (all others are float32)
+integer_columns = {"time":pa.int32(), "patch_no":pa.int32(), "xloc":pa.int32(),
+                   "yloc":pa.int32(), "id":pa.int64(), "lnkgunits":pa.int32(),
+                   "ngenes":pa.int32()}
+flag_columns = ["island", "isolation", "invasible", "initpop", "new"]
+patch_columns = ["time", "patch_no", "xloc", "yloc", "temp", "capacity", "prec", "nicheb",
+                 "island", "isolation", "invasible", "initpop"]
+individual_columns = ["id", "lineage", "new", "tempadaptation", "precadaptation", "size",
+                      "lnkgunits", "ngenes"]
+
+partition_schema = pa.schema([("time", pa.int32())])
+
+## THE SCHEMA
+
+def read_header(filename):
+    """
+    Read the column names from the header of an individual dump. Every line
+    ends with a separator, so the trailing empty column is dropped.
+    """
+    with open(filename) as f:
+        header = f.readline().rstrip("\n").split("\t")
+    if header[0] != "time":
+        raise ValueError(filename+" has no header (it is only written at timestep 0).")
+    return header[:-1] if header[-1] == "" else header
+
+def column_type(name):
+    "The Arrow type of a column of the individual dump."
+    if name in integer_columns:
+        return integer_columns[name]
+    elif name in flag_columns:
+        return pa.bool_()
+    elif name == "lineage":
+        return pa.dictionary(pa.int32(), pa.string())
+    return pa.float32() # environment, adaptations, size and traits
+
+def schema(columns):
+    "The schema of a dump with the given header."
+    return pa.schema([(c, column_type(c)) for c in columns])
+
+def trait_columns(columns):
+    "The trait columns of a header (those after the fixed ones)."
+    return [c for c in columns if c not in patch_columns and c not in individual_columns]
+
+
+## CONVERSION
+
+def dataset_path(filename):
+    return os.path.splitext(filename)[0]
+
+def find_dumps(path):
+    "The individual dumps of a run folder (or the file itself)."
+    if os.path.isdir(path):
+        return sorted(glob.glob(os.path.join(path, "inds_s*.tsv")))
+    return [path]
+
+def convert(filename, dataset=None, blocksize=1 << 24, force=False):
+    """
+    Stream an individual dump into a Parquet dataset with one folder per
+    timestep (`time=<t>`), unless the dataset is already up to date. The
+    dataset is written to a temporary folder first, so that an interrupted
+    conversion leaves nothing behind. Returns the dataset path and the number
+    of rows converted (None if it was up to date).
+    """
+    if dataset is None:
+        dataset = dataset_path(filename)
+    if not force and os.path.isdir(dataset) and os.path.getmtime(dataset) >= os.path.getmtime(filename):
+        return dataset, None
+    columns = read_header(filename)
+    tmpdir = dataset+".tmp"
+    shutil.rmtree(tmpdir, ignore_errors=True)
+    # the trailing separator gives every row an empty last column
+    reader = pacsv.open_csv(filename, read_options=pacsv.ReadOptions(
+                                block_size=blocksize, skip_rows=1, column_names=columns+["_end"]),
+                            parse_options=pacsv.ParseOptions(delimiter="\t"),
+                            convert_options=pacsv.ConvertOptions(
+                                include_columns=columns, column_types=schema(columns),
+                                null_values=["NA", ""], true_values=["1"], false_values=["0"]))
+    datacolumns = [c for c in columns if c != "time"]
+    writers = {}
+    nfiles = {}
+    nrows = 0
+    try:
+        for batch in reader:
+            if batch.num_rows == 0:
+                continue
+            table = pa.Table.from_batches([batch])
+            times = pc.unique(table["time"]).to_pylist()
+            # the dump is written in time order, so files of earlier steps can be closed
+            for t in [t for t in writers if t < min(times)]:
+                writers.pop(t).close()
+            for t in times:
+                part = table.filter(pc.equal(table["time"], t)).select(datacolumns)
+                if t not in writers:
+                    pdir = os.path.join(tmpdir, "time="+str(t))
+                    os.makedirs(pdir, exist_ok=True)
+                    nfiles[t] = nfiles.get(t, -1) + 1
+                    writers[t] = pq.ParquetWriter(os.path.join(pdir, "part-"+str(nfiles[t])+".parquet"),
+                                                  part.schema, compression="zstd")
+                writers[t].write_table(part)
+                nrows += part.num_rows
+    finally:
+        for w in writers.values():
+            w.close()
+    shutil.rmtree(dataset, ignore_errors=True)
+    os.replace(tmpdir, dataset)
+    return dataset, nrows
+
+def dataset_size(dataset):
+    "The total size of the files in a dataset."
+    return sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(dataset) for f in files)
+
+def convert_all(paths, nprocs=None, remove=False, force=False):
+    """
+    Convert the individual dumps of several runs in parallel, printing the size
+    reduction of each. If `remove` is true, each dump is deleted once converted.
+    """
+    dumps = [f for p in paths for f in find_dumps(p)]
+    failed = 0
+    with ProcessPoolExecutor(nprocs) as pool:
+        futures = {pool.submit(convert, f, None, 1 << 24, force): f for f in dumps}
+        for future in as_completed(futures):
+            filename = futures[future]
+            try:
+                dataset, nrows = future.result()
+            except Exception as e:
+                print("Failed to convert "+filename+": "+str(e), file=sys.stderr)
+                failed += 1
+                continue
+            before, after = os.path.getsize(filename), dataset_size(dataset)
+            print(filename+": "+("up to date" if nrows is None else str(nrows)+" rows")+", "+
+                  format_bytes(before)+" -> "+format_bytes(after)+
+                  (" (%.1fx smaller)" % (before / after) if after else ""))
+            if remove:
+                os.remove(filename)
+    return failed
+
+
+## READING
+
+def open_dataset(dataset):
+    "Open a converted dump as a pyarrow dataset (`time` is the partition key)."
+    return ds.dataset(dataset, format="parquet",
+                      partitioning=ds.partitioning(partition_schema, flavor="hive"))
+
+def load(dataset, columns=None, times=None, filter=None):
+    """
+    Load (some columns of) a converted dump as a pyarrow table, optionally only
+    for some timesteps. Only the requested columns and partitions are read.
+    """
+    data = open_dataset(dataset)
+    if times is not None:
+        timefilter = ds.field("time").isin(list(times))
+        filter = timefilter if filter is None else filter & timefilter
+    return data.to_table(columns=columns, filter=filter)
+
+def traits(dataset):
+    "The trait columns of a converted dump."
+    return trait_columns(open_dataset(dataset).schema.names)
+
+def trait_summary(dataset, columns=None, times=None):
+    """
+    Summarise trait distributions per timestep: a list of (time, trait, n, mean,
+    standard deviation, minimum, maximum) tuples.
+    """
+    columns = columns or traits(dataset)
+    table = load(dataset, ["time"] + columns, times)
+    groups = table.group_by("time").aggregate(
+        [(c, f) for c in columns for f in ["count", "mean", "stddev", "min", "max"]])
+    rows = []
+    for r in sorted(groups.to_pylist(), key=lambda r: r["time"]):
+        for c in columns:
+            rows.append((r["time"], c, r[c+"_count"], r[c+"_mean"], r[c+"_stddev"],
+                         r[c+"_min"], r[c+"_max"]))
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Convert individual dumps to Parquet datasets.")
+    parser.add_argument("command", choices=["convert", "info", "traits"])
+    parser.add_argument("paths", nargs="+", help="run folders or dump files (convert), datasets")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="number of parallel processes (convert, default: number of cores)")
+    parser.add_argument("--remove", action="store_true", help="delete the dumps once converted")
+    parser.add_argument("-f", "--force", action="store_true", help="reconvert up-to-date dumps")
+    parser.add_argument("-c", "--columns", default=None,
+                        help="comma-separated list of traits (traits, default: all)")
+    parser.add_argument("-t", "--time", type=int, default=None, help="only this timestep (traits)")
+    args = parser.parse_args()
+    if args.command == "convert":
+        sys.exit(1 if convert_all(args.paths, args.jobs, args.remove, args.force) else 0)
+    for path in args.paths:
+        if args.command == "info":
+            data = open_dataset(path)
+            times = sorted(set(pc.unique(data.to_table(columns=["time"])["time"]).to_pylist()))
+            print(path+": "+str(data.count_rows())+" individuals, "+str(len(times))+" timesteps ("+
+                  (str(times[0])+"-"+str(times[-1]) if times else "none")+"), "+
+                  format_bytes(dataset_size(path))+", traits: "+", ".join(traits(path)))
+        else:
+            columns = args.columns.split(",") if args.columns else None
+            times = [args.time] if args.time is not None else None
+            print("time\ttrait\tn\tmean\tsd\tmin\tmax")
+            for row in trait_summary(path, columns, times):
+                print("\t".join("NA" if v is None else "%.6g" % v if isinstance(v, float) else str(v)
+                                for v in row))
@@ -0,0 +1,256 @@
+##
+## Convert the `lineages.log` files written by `recordlineages` (rows of
+## `t,X,Y,lineage,abundance,temp,prec`, with blank lines between updates) into a
+## sparse abundance cube (time x X x Y x lineage). The log is streamed in blocks,
+## lineage names are interned into one table, and the entries are stored sorted by
+## time, with an offset table, so that the abundance, richness and range maps of
+## any timestep can be sliced without parsing the text again. Cubes are saved as
+## `lineages.npz` next to the log (or as a zarr store, if `zarr` is installed).
+##
+## Usage: python3 -m gemmpy.lineages build <rundir> [...] [--zarr]
+##        python3 -m gemmpy.lineages info <rundir>
+##        python3 -m gemmpy.lineages ranges <rundir> [-t <time>]
+##        python3 -m gemmpy.lineages map <rundir> -t <time> [--lineage <name>] [--richness]
+##
+
+import os, argparse
+import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pacsv
+
+from gemmpy.compact import open_output, output_exists, output_state
+
+LOG = "lineages.log"
+CUBE = "lineages.npz"
+ZARR = "lineages.zarr"
+
+column_types = {"t":pa.int32(), "X":pa.int32(), "Y":pa.int32(),
+                "lineage":pa.dictionary(pa.int32(), pa.string()), "abundance":pa.int64(),
+                "temp":pa.float32(), "prec":pa.float32()}
+
+# the per-entry arrays of a cube
+entry_arrays = ["x", "y", "lineage", "abundance", "temp", "prec"]
+
+## READING THE LOG
+
+def read_log(filename, blocksize=1 << 24):
+    """
+    Stream a `lineages.log` file (a path or a binary file object) into a `Cube`.
+    Lineage names are interned: each entry stores the index of its lineage in
+    `Cube.lineages`.
+    """
+    reader = pacsv.open_csv(filename, read_options=pacsv.ReadOptions(block_size=blocksize),
+                            convert_options=pacsv.ConvertOptions(column_types=column_types))
+    names, index = [], {}
+    columns = {c: [] for c in ["t"] + entry_arrays}
+    for batch in reader:
+        if batch.num_rows == 0:
+            continue
+        lineage = batch.column("lineage")
+        for name in lineage.dictionary.to_pylist():
+            if name not in index:
+                index[name] = len(names)
+                names.append(name)
+        mapping = np.array([index[n] for n in lineage.dictionary.to_pylist()], dtype=np.uint32)
+        columns["lineage"].append(mapping[lineage.indices.to_numpy(zero_copy_only=False)])
+        for c, log_column in [("t", "t"), ("x", "X"), ("y", "Y"), ("abundance", "abundance"),
+                              ("temp", "temp"), ("prec", "prec")]:
+            columns[c].append(batch.column(log_column).to_numpy(zero_copy_only=False))
+    arrays = {c: np.concatenate(v) if v else np.array([]) for c, v in columns.items()}
+    return Cube.from_entries(arrays["t"], arrays, names)
+
+
+## THE CUBE
+
+class Cube:
+    """
+    A sparse (time x X x Y x lineage) abundance cube. The entries (one per
+    lineage and cell, as in the log) are sorted by time; those of the i-th
+    timestep `times[i]` are `offsets[i]:offsets[i+1]`.
+    """
+
+    def __init__(self, times, offsets, lineages, arrays):
+        self.times = times
+        self.offsets = offsets
+        self.lineages = lineages
+        self.arrays = arrays
+        self.xmin = int(arrays["x"].min()) if len(arrays["x"]) else 0
+        self.ymin = int(arrays["y"].min()) if len(arrays["y"]) else 0
+        self.shape = (int(arrays["x"].max()) - self.xmin + 1 if len(arrays["x"]) else 0,
+                      int(arrays["y"].max()) - self.ymin + 1 if len(arrays["y"]) else 0)
+        self.index = {name: i for i, name in enumerate(lineages)}
+
+    @classmethod
+    def from_entries(cls, t, arrays, lineages):
+        "Build a cube from per-entry arrays and their timesteps."
+        order = np.argsort(t, kind="stable") if np.any(np.diff(t) < 0) else slice(None)
+        t = t[order]
+        dtypes = {"x":np.int32, "y":np.int32, "lineage":np.uint32, "abundance":np.uint32,
+                  "temp":np.float32, "prec":np.float32}
+        arrays = {c: arrays[c][order].astype(dtypes[c]) for c in entry_arrays}
+        times, starts = np.unique(t, return_index=True)
+        offsets = np.append(starts, len(t)).astype(np.int64)
+        return cls(times.astype(np.int32), offsets, np.array(lineages, dtype=str), arrays)
+
+    def __len__(self):
+        return len(self.arrays["x"])
+
+    def entries(self, t):
+        "Return the slice of entries for timestep `t`."
+        i = np.searchsorted(self.times, t)
+        if i >= len(self.times) or self.times[i] != t:
+            raise KeyError("No data for timestep "+str(t)+".")
+        return slice(self.offsets[i], self.offsets[i+1])
+
+    def lineage_index(self, lineage):
+        if lineage not in self.index:
+            raise KeyError("Unknown lineage: "+str(lineage))
+        return self.index[lineage]
+
+    def grid(self, t, values, mask=None):
+        "Sum per-entry values of timestep `t` (optionally masked) onto the X x Y grid."
+        s = self.entries(t)
+        x = self.arrays["x"][s] - self.xmin
+        y = self.arrays["y"][s] - self.ymin
+        if mask is not None:
+            x, y, values = x[mask], y[mask], values[mask]
+        out = np.zeros(self.shape, dtype=np.int64)
+        np.add.at(out, (x, y), values)
+        return out
+
+    def abundance(self, t, lineage=None):
+        "The abundance map (X x Y) at timestep `t`, of all lineages or of one lineage."
+        s = self.entries(t)
+        mask = None if lineage is None else self.arrays["lineage"][s] == self.lineage_index(lineage)
+        return self.grid(t, self.arrays["abundance"][s], mask)
+
+    def richness(self, t):
+        "The number of lineages in each cell at timestep `t`."
+        s = self.entries(t)
+        return self.grid(t, np.ones(s.stop - s.start, dtype=np.int64))
+
+    def occupancy(self, t, lineage):
+        "A boolean map of the cells occupied by a lineage at timestep `t`."
+        return self.abundance(t, lineage) > 0
+
+    def range_areas(self, t):
+        "The number of occupied cells of each lineage at timestep `t` (indexed like `lineages`)."
+        s = self.entries(t)
+        return np.bincount(self.arrays["lineage"][s], minlength=len(self.lineages))
+
+    def total_abundances(self, t):
+        "The total abundance of each lineage at timestep `t` (indexed like `lineages`)."
+        s = self.entries(t)
+        return np.bincount(self.arrays["lineage"][s], weights=self.arrays["abundance"][s],
+                           minlength=len(self.lineages)).astype(np.int64)
+
+    def dense(self, t):
+        "The full abundance array (X x Y x lineage) at timestep `t`."
+        s = self.entries(t)
+        out = np.zeros(self.shape + (len(self.lineages),), dtype=np.uint32)
+        out[self.arrays["x"][s] - self.xmin, self.arrays["y"][s] - self.ymin,
+            self.arrays["lineage"][s]] = self.arrays["abundance"][s]
+        return out
+
+    def timeseries(self, lineage):
+        "The total abundance of a lineage at every timestep."
+        mask = self.arrays["lineage"] == self.lineage_index(lineage)
+        step = np.repeat(np.arange(len(self.times)), np.diff(self.offsets))
+        return np.bincount(step[mask], weights=self.arrays["abundance"][mask],
+                           minlength=len(self.times)).astype(np.int64)
+
+    ## STORAGE
+
+    def save(self, filename):
+        "Save the cube as an (uncompressed) npz file."
+        np.savez(filename, times=self.times, offsets=self.offsets, lineages=self.lineages,
+                 **self.arrays)
+
+    def save_zarr(self, path):
+        "Save the cube as a zarr store (requires `zarr`)."
+        import zarr # only needed for this format
+        root = zarr.open_group(path, mode="w")
+        root.array("lineages", self.lineages)
+        for name, values in [("times", self.times), ("offsets", self.offsets)] + list(self.arrays.items()):
+            root.array(name, values, chunks=(1 << 20,))
+
+    @classmethod
+    def load(cls, path):
+        "Load a cube from an npz file or a zarr store."
+        if os.path.isdir(path):
+            import zarr
+            data = zarr.open_group(path, mode="r")
+        else:
+            data = np.load(path)
+        return cls(data["times"][:], data["offsets"][:], np.asarray(data["lineages"][:], dtype=str),
+                   {c: data[c][:] for c in entry_arrays})
+
+
+## RUN FOLDERS
+
+def cube_path(rundir, usezarr=False):
+    return os.path.join(rundir, ZARR if usezarr else CUBE)
+
+def build(rundir, usezarr=False, force=False):
+    """
+    Convert the `lineages.log` of a run (plain or compacted), unless its cube is
+    already up to date. Returns the cube path (or None if the run has no log).
+    """
+    if not output_exists(rundir, LOG):
+        return None
+    path = cube_path(rundir, usezarr)
+    if not force and os.path.exists(path) and os.path.getmtime(path) >= output_state(rundir, LOG)[1]:
+        return path
+    with open_output(rundir, LOG, "rb") as log:
+        cube = read_log(log)
+    if usezarr:
+        cube.save_zarr(path)
+    else:
+        cube.save(path)
+    return path
+
+def open_cube(rundir):
+    "Load the cube of a run (a run folder, or the cube file itself), building it if needed."
+    if os.path.isfile(rundir) or rundir.endswith(".zarr"):
+        return Cube.load(rundir)
+    for usezarr in (False, True):
+        if os.path.exists(cube_path(rundir, usezarr)):
+            build(rundir, usezarr)
+            return Cube.load(cube_path(rundir, usezarr))
+    path = build(rundir)
+    if path is None:
+        raise FileNotFoundError("No "+LOG+" in "+rundir+".")
+    return Cube.load(path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Convert lineages.log files into abundance cubes.")
+    parser.add_argument("command", choices=["build", "info", "ranges", "map"])
+    parser.add_argument("runs", nargs="+", help="run folders (or cube files)")
+    parser.add_argument("-t", "--time", type=int, default=None, help="timestep (default: the last)")
+    parser.add_argument("-l", "--lineage", default=None, help="only this lineage (map)")
+    parser.add_argument("--richness", action="store_true", help="map the number of lineages (map)")
+    parser.add_argument("--zarr", action="store_true", help="store the cube with zarr (build)")
+    parser.add_argument("-f", "--force", action="store_true", help="rebuild existing cubes (build)")
+    args = parser.parse_args()
+    for run in args.runs:
+        if args.command == "build":
+            path = build(run, args.zarr, args.force)
+            print(run+": "+(path if path else "no "+LOG))
+            continue
+        cube = open_cube(run)
+        t = args.time if args.time is not None else (int(cube.times[-1]) if len(cube.times) else 0)
+        if args.command == "info":
+            print(run+": "+str(len(cube))+" entries, "+str(len(cube.times))+" timesteps ("+
+                  (str(cube.times[0])+"-"+str(cube.times[-1]) if len(cube.times) else "none")+"), "+
+                  str(len(cube.lineages))+" lineages, grid "+str(cube.shape[0])+"x"+str(cube.shape[1]))
+        elif args.command == "ranges":
+            areas, totals = cube.range_areas(t), cube.total_abundances(t)
+            print("lineage\tcells\tabundance")
+            for i in np.argsort(-areas):
+                if areas[i] > 0:
+                    print(cube.lineages[i]+"\t"+str(areas[i])+"\t"+str(totals[i]))
+        else:
+            grid = cube.richness(t) if args.richness else cube.abundance(t, args.lineage)
+            for row in grid.T: # one line per Y coordinate
+                print(" ".join("%4d" % v for v in row))
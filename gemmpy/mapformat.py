@@ -0,0 +1,329 @@
+##
+## A compact binary format for GeMM map files. Each map is stored as typed per-cell
+## columns (`id`, `x`, `y`, `temp`, `prec`, `capacity` and a bit mask of the
+## `initpop`, `isisland`, `isolated` and `invasible` flags). A series of maps (as
+## passed to the `maps` setting) goes into one file, with each map after the first
+## stored only as the cells that differ from its predecessor. Maps can be converted
+## to and from the text format without loss, so the Julia side keeps reading text.
+##
+## Usage: python3 -m gemmpy.mapformat pack <series.gmap> <map> [<map> ...]
+##        python3 -m gemmpy.mapformat unpack <series.gmap> [--outdir <dir>]
+##        python3 -m gemmpy.mapformat check <map> [<map> ...]
+##
+
+import os, sys, json, argparse
+import numpy as np
+
+SUFFIX = ".gmap"
+VERSION = 1
+
+value_columns = ["temp", "prec", "capacity"]
+flag_names = ["initpop", "isisland", "isolated", "invasible"]
+cell_columns = ["id", "x", "y"] + value_columns + ["flags"]
+
+## MAPS
+
+class Map:
+    """
+    A parsed map file. `cells` holds one array per cell column (`NaN` where a
+    value is not given in the file), `extra` any further cell parameters by row,
+    and `preamble` the comment lines before the first cell (with `None` in place
+    of the timestep line). A `changeset` only lists the cells that differ from
+    the previous map of a series (see `readmapfile`).
+    """
+
+    def __init__(self, name, timesteps, cells, extra=None, preamble=None, sep="\t",
+                 changeset=False):
+        self.name = name
+        self.timesteps = timesteps
+        self.changeset = changeset
+        self.cells = cells
+        self.extra = extra if extra is not None else {}
+        self.preamble = preamble if preamble is not None else [None, ""]
+        self.sep = sep
+
+    def __len__(self):
+        return len(self.cells["id"])
+
+    def __eq__(self, other):
+        return (self.timesteps == other.timesteps and self.changeset == other.changeset and
+                self.extra == other.extra and
+                all(np.array_equal(self.cells[c], other.cells[c], equal_nan=True)
+                    for c in cell_columns))
+
+def logical_lines(filename):
+    "Yield the raw lines and tokens of a file, joining continued lines as `basicparser` does."
+    with open(filename) as f:
+        rawlines = f.read().splitlines()
+    carry = ""
+    for raw in rawlines:
+        line = (carry+raw.split("#")[0].strip()).strip()
+        carry = ""
+        if line.endswith("\\"):
+            carry = line[:-1]
+            continue
+        yield raw, line.split()
+
+def read_text(filename):
+    "Parse a text map file."
+    timesteps, preamble, sep, changeset = None, [], None, False
+    ids, xs, ys, flags = [], [], [], []
+    values = {c: [] for c in value_columns}
+    extra = {}
+    for raw, tokens in logical_lines(filename):
+        if not tokens:
+            if sep is None:
+                preamble.append(raw)
+            continue
+        if timesteps is None and sep is None and (len(tokens) == 1 or tokens[1:] == ["update"]):
+            timesteps = int(tokens[0])
+            changeset = len(tokens) == 2
+            preamble.append(None)
+            continue
+        if sep is None:
+            sep = "\t" if "\t" in raw else " "
+        ids.append(int(tokens[0]))
+        xs.append(int(tokens[1]))
+        ys.append(int(tokens[2]))
+        row = {c: np.nan for c in value_columns}
+        bits = 0
+        others = []
+        for token in tokens[3:]:
+            var, eq, val = token.partition("=")
+            if var in flag_names and not eq and not bits & (1 << flag_names.index(var)):
+                bits |= 1 << flag_names.index(var)
+            elif var in row and eq and np.isnan(row[var]):
+                try:
+                    row[var] = float(val)
+                except ValueError:
+                    others.append(token)
+            else:
+                others.append(token)
+        for c in value_columns:
+            values[c].append(row[c])
+        flags.append(bits)
+        if others:
+            extra[len(ids) - 1] = others
+    cells = {"id":np.array(ids, dtype=np.int64), "x":np.array(xs, dtype=np.int64),
+             "y":np.array(ys, dtype=np.int64), "flags":np.array(flags, dtype=np.uint8)}
+    for c in value_columns:
+        cells[c] = np.array(values[c], dtype=np.float64)
+    return Map(os.path.basename(filename), timesteps, cells, extra, preamble, sep or "\t",
+               changeset)
+
+def format_values(values):
+    "Format a value column as in the map files (integral values without decimals)."
+    finite = np.nan_to_num(values)
+    return np.where(finite % 1 == 0, finite.astype(np.int64).astype(str), values.astype(str))
+
+def text_lines(m):
+    "Return the lines of a map in the text format."
+    timeline = str(m.timesteps)+(" update" if m.changeset else "")
+    lines = [timeline if l is None else l for l in m.preamble
+             if l is not None or m.timesteps is not None]
+    columns = [m.cells[c].astype(str) for c in ["id", "x", "y"]]
+    for c in value_columns:
+        given = ~np.isnan(m.cells[c])
+        columns.append(np.where(given, c+"="+format_values(m.cells[c]), ""))
+    for i, f in enumerate(flag_names):
+        columns.append(np.where(m.cells["flags"] & (1 << i), f, ""))
+    for row, tokens in enumerate(zip(*columns)):
+        tokens = [t for t in tokens if t] + m.extra.get(row, [])
+        lines.append(m.sep.join(tokens))
+    return lines
+
+def write_text(m, filename):
+    "Write a map in the text format."
+    with open(filename, "w", buffering=1 << 20) as f:
+        f.write("\n".join(text_lines(m))+"\n")
+
+
+## SERIES
+
+def compact_dtype(values):
+    "Return the smallest dtype that stores a column without loss."
+    if values.dtype.kind == "f":
+        narrow = values.astype(np.float32)
+        # float32 is enough if its shortest representation reads back as the same value
+        if np.array_equal(narrow.astype(str).astype(np.float64), values, equal_nan=True):
+            return np.dtype(np.float32)
+    elif values.dtype.kind == "i":
+        if len(values) == 0 or (values.min() >= -2**31 and values.max() < 2**31):
+            return np.dtype(np.int32)
+    return values.dtype
+
+def diff(old, new):
+    """
+    Find the cells of `new` that are not identical in `old`. Returns the changed
+    or added rows and the removed IDs, or None if `new` can't be rebuilt from
+    `old` this way (because the order of the cells changed).
+    """
+    oldrows = {i: r for r, i in enumerate(old.cells["id"].tolist())}
+    newids = new.cells["id"].tolist()
+    if len(oldrows) != len(old) or len(set(newids)) != len(new):
+        return None # duplicate IDs
+    pos = np.array([oldrows.get(i, -1) for i in newids], dtype=np.int64)
+    found = pos >= 0
+    same = found.copy()
+    for c in cell_columns:
+        oldvals = old.cells[c][np.where(found, pos, 0)]
+        same &= (oldvals == new.cells[c]) | (np.isnan(oldvals) & np.isnan(new.cells[c])
+                                              if c in value_columns else False)
+    for r in np.flatnonzero(same):
+        if old.extra.get(pos[r]) != new.extra.get(r):
+            same[r] = False
+    removed = np.setdiff1d(old.cells["id"], new.cells["id"])
+    # the rebuilt map keeps the old order, with new cells appended
+    gone = set(removed.tolist())
+    kept = [i for i in old.cells["id"].tolist() if i not in gone]
+    if kept + [i for i, f in zip(newids, found) if not f] != newids:
+        return None
+    return np.flatnonzero(~same), removed
+
+def apply_diff(old, name, timesteps, rows, removed, extra, preamble, sep, changeset=False):
+    "Rebuild a map from its predecessor and the stored difference."
+    keep = ~np.isin(old.cells["id"], removed)
+    cells = {c: old.cells[c][keep] for c in cell_columns}
+    oldextra = {}
+    for newrow, oldrow in enumerate(np.flatnonzero(keep)):
+        if oldrow in old.extra:
+            oldextra[newrow] = old.extra[oldrow]
+    index = {i: r for r, i in enumerate(cells["id"].tolist())}
+    present = np.array([i in index for i in rows["id"].tolist()], dtype=bool)
+    at = np.array([index[i] for i in rows["id"][present].tolist()], dtype=np.int64)
+    for c in cell_columns:
+        cells[c][at] = rows[c][present]
+        cells[c] = np.concatenate([cells[c], rows[c][~present]])
+    for r in at:
+        oldextra.pop(r, None)
+    added = len(index)
+    for r, (i, p) in enumerate(zip(rows["id"].tolist(), present)):
+        target = index[i] if p else added
+        added += not p
+        if r in extra:
+            oldextra[target] = extra[r]
+    return Map(name, timesteps, cells, oldextra, preamble, sep, changeset)
+
+def save(filename, maps):
+    """
+    Write a map or a series of maps to a binary file. Each map after the first
+    is stored as the difference to its predecessor where possible.
+    """
+    if isinstance(maps, Map):
+        maps = [maps]
+    header = {"format":"gmap", "version":VERSION, "maps":[]}
+    columns = []
+    previous = None
+    for m in maps:
+        delta = diff(previous, m) if previous is not None else None
+        rows, removed = delta if delta is not None else (np.arange(len(m)), None)
+        entry = {"name":m.name, "timesteps":m.timesteps, "preamble":m.preamble, "sep":m.sep,
+                 "changeset":m.changeset,
+                 "delta":delta is not None, "rows":len(rows),
+                 "extra":{str(k): m.extra[r] for k, r in enumerate(rows.tolist()) if r in m.extra}}
+        for c in cell_columns:
+            values = m.cells[c][rows]
+            columns.append(values.astype(compact_dtype(values)))
+        if delta is not None:
+            entry["removed"] = len(removed)
+            columns.append(removed.astype(np.int64))
+        header["maps"].append(entry)
+        previous = m
+    header["types"] = [c.dtype.str for c in columns]
+    text = json.dumps(header).encode()+b"\n"
+    text += b" " * (-len(text) % 8) # pad to keep the columns aligned
+    with open(filename, "wb") as f:
+        f.write(text)
+        for c in columns:
+            f.write(c.tobytes())
+            f.write(b"\0" * (-c.nbytes % 8))
+
+def load(filename):
+    "Read all maps from a binary map file."
+    with open(filename, "rb") as f:
+        data = f.read()
+    headerlen = data.find(b"\n") + 1
+    header = json.loads(data[:headerlen])
+    if header.get("format") != "gmap" or header.get("version", 0) > VERSION:
+        raise ValueError(filename+" is not a supported map file.")
+    types = iter(header["types"])
+    pos = headerlen + (-headerlen % 8)
+    def column(n):
+        nonlocal pos
+        dtype = np.dtype(next(types))
+        values = np.frombuffer(data, dtype=dtype, count=n, offset=pos)
+        pos += n * dtype.itemsize + (-n * dtype.itemsize % 8)
+        return values
+    maps = []
+    for entry in header["maps"]:
+        rows = {c: column(entry["rows"]) for c in cell_columns}
+        for c, v in rows.items():
+            if v.dtype == np.float32: # restore the values as they were written in the text file
+                rows[c] = v.astype(str).astype(np.float64)
+            else:
+                rows[c] = v.astype(np.float64 if c in value_columns else
+                                   np.uint8 if c == "flags" else np.int64)
+        extra = {int(k): v for k, v in entry["extra"].items()}
+        changeset = entry.get("changeset", False)
+        if entry["delta"]:
+            removed = column(entry["removed"]).astype(np.int64)
+            maps.append(apply_diff(maps[-1], entry["name"], entry["timesteps"], rows, removed,
+                                   extra, entry["preamble"], entry["sep"], changeset))
+        else:
+            maps.append(Map(entry["name"], entry["timesteps"], rows, extra,
+                            entry["preamble"], entry["sep"], changeset))
+    return maps
+
+def pack(filename, mapfiles):
+    "Convert a series of text map files to one binary file."
+    save(filename, [read_text(f) for f in mapfiles])
+    return filename
+
+def unpack(filename, outdir=None):
+    """
+    Convert a binary map file back to text maps in `outdir` (by default, a folder
+    named after the file). Maps that are already up to date are not rewritten.
+    Returns the list of text map files, in series order.
+    """
+    if outdir is None:
+        outdir = filename[:-len(SUFFIX)] if filename.endswith(SUFFIX) else filename+".maps"
+    os.makedirs(outdir, exist_ok=True)
+    mapfiles = []
+    maps = None
+    for entry in json.loads(open(filename, "rb").readline())["maps"]:
+        mapfiles.append(os.path.join(outdir, entry["name"]))
+    if all(os.path.exists(m) and os.path.getmtime(m) >= os.path.getmtime(filename)
+           for m in mapfiles):
+        return mapfiles
+    maps = load(filename)
+    for m, mapfile in zip(maps, mapfiles):
+        write_text(m, mapfile)
+    return mapfiles
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Convert GeMM maps to and from the binary format.")
+    parser.add_argument("command", choices=["pack", "unpack", "check"])
+    parser.add_argument("files", nargs="+", help="the binary file and/or text maps")
+    parser.add_argument("-o", "--outdir", default=None, help="output folder for `unpack`")
+    args = parser.parse_args()
+    if args.command == "pack":
+        pack(args.files[0], args.files[1:])
+        size = sum(os.path.getsize(f) for f in args.files[1:])
+        print("Packed "+str(len(args.files) - 1)+" maps ("+str(size // 1024)+" kB) into "+
+              args.files[0]+" ("+str(os.path.getsize(args.files[0]) // 1024)+" kB).")
+    elif args.command == "unpack":
+        for mapfile in unpack(args.files[0], args.outdir):
+            print(mapfile)
+    else:
+        # check that the maps survive a round trip through the binary format
+        maps = [read_text(f) for f in args.files]
+        tmpfile = "."+str(os.getpid())+SUFFIX
+        try:
+            save(tmpfile, maps)
+            for f, original, copy in zip(args.files, maps, load(tmpfile)):
+                identical = "\n".join(text_lines(copy))+"\n" == open(f).read()
+                print(f+": "+("ok" if original == copy else "MISMATCH")+
+                      (", text identical" if identical else ", text reformatted"))
+        finally:
+            os.remove(tmpfile)
@@ -0,0 +1,103 @@
+##
+## A vectorised map generator for GeMM (the engine behind
+## `studies/islandradiation/makemap.py`). Landmasses are built as NumPy arrays
+## (temperature and precipitation gradients, edge distances for the island
+## temperature falloff, seeded isolation masks) and written out in bulk, so that
+## maps with millions of cells can be created in seconds.
+##
+
+import sys
+import numpy as np
+
+MINTEMP = 273
+MAXTEMP = 303
+
+## LANDMASSES
+
+def continent(width, height, x=0, y=0, precipitation=False):
+    """
+    Create a continent: temperature rises from west to east, precipitation (if
+    turned on) from north to south. All cells receive an initial population.
+    Returns a dict of per-cell arrays.
+    """
+    xs, ys = np.meshgrid(np.arange(x, x + width), np.arange(y, y + height), indexing="ij")
+    maxprec = 10 if precipitation else 0
+    precstep = maxprec / height if height > 1 else 1.0
+    tempstep = (MAXTEMP - MINTEMP) / width
+    return {"type":"continent", "x":xs.ravel(), "y":ys.ravel(),
+            "temp":(MINTEMP + (xs - x + 1) * tempstep).ravel(),
+            "prec":((ys - y) * precstep).ravel(),
+            "initpop":np.ones(width * height, dtype=bool)}
+
+def island(width, height, x=0, y=0, isolation=0.0, rng=None):
+    """
+    Create an island: temperature falls by one degree per cell of distance from
+    the coast, precipitation rises from north to south. A proportion `isolation`
+    of cells is randomly marked as isolated, using the random generator `rng`
+    (see `numpy.random.default_rng`). Returns a dict of per-cell arrays.
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    xs, ys = np.meshgrid(np.arange(x, x + width), np.arange(y, y + height), indexing="ij")
+    edgedist = np.minimum.reduce([xs - x, ys - y, x + width - 1 - xs, y + height - 1 - ys])
+    return {"type":"island", "x":xs.ravel(), "y":ys.ravel(),
+            "temp":(298 - edgedist).ravel(),
+            "prec":(ys - y + 1).ravel(),
+            "isisland":np.ones(width * height, dtype=bool),
+            "isolated":rng.random(width * height) < isolation}
+
+
+## OUTPUT
+
+def format_column(values):
+    "Convert a numeric column to strings (integral values are written without decimals)."
+    values = np.asarray(values)
+    if values.dtype.kind == "f" and np.all(np.mod(values, 1) == 0):
+        values = values.astype(np.int64)
+    return values.astype(str)
+
+def format_landmass(land, startid, start=0, stop=None):
+    "Format a slice of a landmass as map file lines (without newlines)."
+    stop = len(land["x"]) if stop is None else stop
+    ids = format_column(np.arange(startid + start + 1, startid + stop + 1))
+    xs = format_column(land["x"][start:stop])
+    ys = format_column(land["y"][start:stop])
+    temps = format_column(land["temp"][start:stop])
+    precs = format_column(land["prec"][start:stop])
+    if land["type"] == "continent":
+        return [i+" "+x+" "+y+" temp="+t+" prec="+p+" initpop"
+                for i, x, y, t, p in zip(ids, xs, ys, temps, precs)]
+    isolated = np.where(land["isolated"][start:stop], "isolated", "")
+    return [i+" "+x+" "+y+" temp="+t+" prec="+p+" isisland "+iso
+            for i, x, y, t, p, iso in zip(ids, xs, ys, temps, precs, isolated)]
+
+def write_map(out, landmasses, timesteps=1000, startid=0, ocean=True, chunksize=100000):
+    """
+    Write a map file with one or more landmasses to the stream `out`. Cell IDs
+    are numbered consecutively from `startid`+1. If `ocean` is true and there is
+    a continent, a dummy island is added to make sure there is ocean. It takes
+    the next free ID and lies east of all landmasses, one column apart. A
+    `timesteps` value of zero turns off the timestep header.
+    """
+    if timesteps > 0:
+        out.write("# timesteps:\n"+str(timesteps)+"\n\n")
+    ident = startid
+    for land in landmasses:
+        out.write("# "+land["type"]+" :\n")
+        n = len(land["x"])
+        for start in range(0, n, chunksize):
+            out.write("\n".join(format_landmass(land, ident, start, min(start + chunksize, n)))+"\n")
+        out.write("\n")
+        ident += n
+    if ocean and any(land["type"] == "continent" for land in landmasses):
+        east = max(int(np.max(land["x"])) for land in landmasses if len(land["x"]))
+        north = min(int(np.min(land["y"])) for land in landmasses if len(land["y"]))
+        out.write("# dummy island:\n"+str(ident + 1)+" "+str(east + 2)+" "+str(north)+" 1273 island\n\n")
+
+def make_map(filename, landmasses, timesteps=1000, startid=0, ocean=True):
+    "Write a map file with the given landmasses (`-` for stdout)."
+    if filename == "-":
+        write_map(sys.stdout, landmasses, timesteps, startid, ocean)
+    else:
+        with open(filename, "w", buffering=1 << 20) as out:
+            write_map(out, landmasses, timesteps, startid, ocean)
@@ -0,0 +1,88 @@
+##
+## End-of-run metrics of a finished run, read from its output folder. A metric
+## is written as "<source>:<column>[:<aggregation>[:<lineage>]]":
+##
+## - "diversity:<column>" is the last line of `diversity.log` (one of population,
+##   freespace, lineages, alpha, beta or gamma), e.g. "diversity:lineages"
+## - "pops:<column>" aggregates a column of `pops.tsv` over all rows (cells and
+##   lineages) of the last timestep, by "mean" (default), "sum", "min" or "max",
+##   optionally only for one lineage, e.g. "pops:heterozygosity:mean:silvanus"
+##
+## Usage: python3 -m gemmpy.metrics <metric> <rundir> [...]
+##
+
+import os, csv, argparse
+
+from gemmpy.compact import open_output
+from gemmpy.monitor import parse_diversity, diversity_columns
+
+aggregations = {"mean":lambda v: sum(v) / len(v), "sum":sum, "min":min, "max":max}
+
+def parse_metric(text):
+    "Split a metric into its source, column, aggregation and lineage (or raise a ValueError)."
+    parts = text.split(":")
+    if len(parts) < 2 or parts[0] not in ("diversity", "pops"):
+        raise ValueError("Metrics are written as diversity:<column> or pops:<column>[:...]: "+text)
+    source, column = parts[0], parts[1]
+    aggregation = parts[2] if len(parts) > 2 and parts[2] else "mean"
+    lineage = parts[3] if len(parts) > 3 else None
+    if source == "diversity" and column not in diversity_columns:
+        raise ValueError("Unknown diversity.log column: "+column)
+    if aggregation not in aggregations:
+        raise ValueError("Unknown aggregation: "+aggregation)
+    return source, column, aggregation, lineage
+
+def final_diversity(rundir):
+    "The last entry of a run's `diversity.log` as a dict (None if there is none)."
+    last = None
+    try:
+        with open_output(rundir, "diversity.log") as f:
+            for line in f:
+                row = parse_diversity(line.strip())
+                if row:
+                    last = row
+    except OSError:
+        return None
+    return last
+
+def final_pops(rundir, column, aggregation="mean", lineage=None):
+    """
+    Aggregate a column of a run's `pops.tsv` over the rows of its last timestep
+    (None if there are none). The file is streamed, as the last timestep is
+    written last.
+    """
+    values, current = [], None
+    try:
+        with open_output(rundir, "pops.tsv") as f:
+            for row in csv.DictReader(f, delimiter="\t"):
+                if row["time"] != current:
+                    values, current = [], row["time"]
+                if lineage and row.get("lineage") != lineage:
+                    continue
+                try:
+                    values.append(float(row[column]))
+                except (KeyError, TypeError, ValueError):
+                    pass
+    except OSError:
+        return None
+    values = [v for v in values if v == v] # without NaN
+    return aggregations[aggregation](values) if values else None
+
+def metric(rundir, text):
+    "Read a metric from a run folder (None if the run has no such output)."
+    source, column, aggregation, lineage = parse_metric(text)
+    if source == "diversity":
+        row = final_diversity(rundir)
+        return row[column] if row else None
+    return final_pops(rundir, column, aggregation, lineage)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Print an end-of-run metric of some runs.")
+    parser.add_argument("metric", help="e.g. diversity:lineages or pops:heterozygosity:mean:silvanus")
+    parser.add_argument("runs", nargs="+", help="run folders")
+    args = parser.parse_args()
+    parse_metric(args.metric)
+    for run in args.runs:
+        value = metric(run, args.metric)
+        print(run+"\t"+("NA" if value is None else str(value)))
@@ -0,0 +1,439 @@
+##
+## A live monitor for many concurrent GeMM runs. It follows the `simulation.log`
+## (`UPDATE <t>` lines) and `diversity.log` (population, freespace, lineages, alpha,
+## beta, gamma) of every result directory matching a pattern, and shows the
+## timestep, speed, ETA, population size and lineage count of each run. Stalled
+## and crashed runs are flagged, and so are dead runs, whose process has gone
+## without an error (e.g. killed for running out of memory or time). The
+## processes are looked up in `/proc`, so for runs on other machines (e.g. with
+## slurm), use `--remote`. The files are watched with inotify where
+## available (falling back to polling), and the metrics can be exported as a
+## JSONL stream or a Prometheus text file.
+##
+## Usage: python3 -m gemmpy.monitor [rundir ...] [--pattern <regex>] [--jsonl <file>] [--prom <file>]
+##                                   [--remote]
+##
+
+import os, re, sys, glob, json, time, select, struct, argparse
+import ctypes, ctypes.util
+from collections import deque
+
+from gemmpy.cache import MARKER, read_config
+from gemmpy import scheduler
+
+# inotify event masks (see `man inotify`)
+IN_MODIFY = 0x002
+IN_CREATE = 0x100
+IN_MOVED_TO = 0x080
+IN_NONBLOCK = os.O_NONBLOCK
+
+diversity_columns = ["population", "freespace", "lineages", "alpha", "beta", "gamma"]
+
+## FOLLOWING FILES
+
+class LogTail:
+    "Read the lines that were appended to a file since the last call."
+
+    def __init__(self, path):
+        self.path = path
+        self.offset = 0
+        self.partial = b""
+
+    def read(self):
+        "Return the new complete lines (an empty list if there are none)."
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return []
+        if size < self.offset: # the file was truncated or replaced
+            self.offset, self.partial = 0, b""
+        if size == self.offset:
+            return []
+        with open(self.path, "rb") as f:
+            f.seek(self.offset)
+            data = f.read(size - self.offset)
+        self.offset += len(data)
+        lines = (self.partial + data).split(b"\n")
+        self.partial = lines.pop()
+        return [l.decode(errors="replace") for l in lines]
+
+
+class Inotify:
+    "A minimal inotify binding (Linux only). Raises OSError if inotify is not available."
+
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watches = {}
+
+    def watch(self, path, mask=IN_MODIFY | IN_CREATE | IN_MOVED_TO):
+        "Watch a directory for changes."
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_add_watch failed for "+path)
+        self.watches[wd] = path
+
+    def wait(self, timeout):
+        "Wait up to `timeout` seconds for events. Returns the set of directories that changed."
+        changed = set()
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return changed
+        while True:
+            try:
+                data = os.read(self.fd, 1 << 16)
+            except BlockingIOError:
+                return changed
+            pos = 0
+            while pos < len(data):
+                wd, mask, cookie, length = struct.unpack_from("iIII", data, pos)
+                pos += struct.calcsize("iIII") + length
+                if wd in self.watches:
+                    changed.add(self.watches[wd])
+
+    def close(self):
+        os.close(self.fd)
+
+
+## PROCESSES
+
+def gemm_processes():
+    """
+    Find the GeMM processes on this machine. Returns the names of the configs
+    that are being run (from the `--config` argument) and whether any worker
+    (`rungemmworker.jl`, which receives its configs on stdin) is running, or
+    None if the processes can't be listed.
+    """
+    if not os.path.isdir("/proc"):
+        return None
+    configs, workers = set(), False
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit():
+            continue
+        try:
+            with open("/proc/"+pid+"/cmdline", "rb") as f:
+                args = [a.decode(errors="replace") for a in f.read().split(b"\0")]
+        except OSError: # the process has just exited, or isn't ours to read
+            continue
+        if any(os.path.basename(a) == "rungemmworker.jl" for a in args):
+            workers = True
+        for i, a in enumerate(args):
+            if a == "--config" and i + 1 < len(args):
+                configs.add(os.path.basename(args[i+1]))
+            elif a.startswith("--config="):
+                configs.add(os.path.basename(a[len("--config="):]))
+    return configs, workers
+
+
+## RUN STATE
+
+def parse_diversity(line):
+    "Parse a line of `diversity.log` into a dict (None for the header or broken lines)."
+    values = line.split(",")
+    if len(values) != len(diversity_columns) or values[0] == "population":
+        return None
+    try:
+        return {c: float(v) for c, v in zip(diversity_columns, values)}
+    except ValueError:
+        return None
+
+def map_timesteps(mapfile):
+    "Read the number of timesteps from the first line of a map file (None if unknown)."
+    try:
+        with open(mapfile) as f:
+            for line in f:
+                tokens = line.split("#")[0].split()
+                if tokens:
+                    return int(tokens[0])
+    except (OSError, ValueError):
+        pass
+    return None
+
+def total_timesteps(rundir):
+    "Sum up the timesteps of all maps of a run, using the config and maps copied to its folder."
+    for config in glob.glob(os.path.join(rundir, "*.conf*")):
+        settings = read_config(config)
+        if "maps" not in settings:
+            continue
+        maps = [m for m in settings["maps"].strip('"').split(",") if m]
+        steps = [map_timesteps(os.path.join(rundir, os.path.basename(m))) for m in maps]
+        if steps and None not in steps:
+            return sum(steps)
+    return None
+
+
+class RunState:
+    "The progress of one run, updated from its log files."
+
+    def __init__(self, rundir, window=60):
+        self.rundir = rundir
+        self.name = os.path.basename(os.path.normpath(rundir))
+        self.simlog = LogTail(os.path.join(rundir, "simulation.log"))
+        self.divlog = LogTail(os.path.join(rundir, "diversity.log"))
+        self.total = None
+        self.timestep = 0
+        self.samples = deque() # (time, timestep) pairs within the rate window
+        self.window = window
+        self.diversity = {}
+        self.error = None
+        self.started = time.time()
+        self.lastchange = self.started
+
+    def update(self, now=None):
+        "Read new log lines. Returns true if anything changed."
+        now = now if now is not None else time.time()
+        changed = False
+        timestep = self.timestep
+        for line in self.simlog.read():
+            changed = True
+            if line.startswith("UPDATE "):
+                timestep = int(line.split()[1])
+            elif line.startswith("ERROR:"):
+                self.error = line[7:]
+        if timestep != self.timestep:
+            self.timestep = timestep
+            self.samples.append((now, timestep))
+        for line in self.divlog.read():
+            changed = True
+            self.diversity = parse_diversity(line) or self.diversity
+        while len(self.samples) > 2 and self.samples[1][0] < now - self.window:
+            self.samples.popleft()
+        if self.total is None:
+            self.total = total_timesteps(self.rundir)
+        if changed: # use the modification times, so that runs are classified correctly at once
+            self.lastchange = max(os.path.getmtime(tail.path) for tail in [self.simlog, self.divlog]
+                                  if os.path.exists(tail.path))
+        return changed
+
+    def rate(self):
+        "The recent speed in timesteps per second (None if unknown)."
+        if len(self.samples) < 2 or self.samples[-1][0] == self.samples[0][0]:
+            return None
+        return (self.samples[-1][1] - self.samples[0][1]) / (self.samples[-1][0] - self.samples[0][0])
+
+    def eta(self):
+        "The estimated remaining time in seconds (None if unknown)."
+        rate = self.rate()
+        if not rate or self.total is None:
+            return None
+        return max(self.total - self.timestep, 0) / rate
+
+    def alive(self, processes):
+        """
+        Check whether the process of this run is still running, given the result
+        of `gemm_processes` (None if this can't be told, e.g. on a worker).
+        """
+        if processes is None:
+            return None
+        configs, workers = processes
+        names = [os.path.basename(c) for c in glob.glob(os.path.join(self.rundir, "*.conf*"))]
+        if any(n in configs for n in names):
+            return True
+        return None if workers or not names else False
+
+    def status(self, now=None, stall=600, alive=None):
+        """
+        Classify the run as "done", "crashed" (an error was logged), "dead" (its
+        process is gone although the run is incomplete), "stalled" (still `alive`,
+        but no log output for `stall` seconds), "running" or "starting".
+        """
+        now = now if now is not None else time.time()
+        if os.path.exists(os.path.join(self.rundir, MARKER)):
+            return "done"
+        if self.error is not None:
+            return "crashed"
+        if alive is False: # without the run cache, there is no marker
+            return "done" if self.total and self.timestep >= self.total else "dead"
+        if now - self.lastchange > stall:
+            return "stalled"
+        return "running" if self.timestep > 0 else "starting"
+
+    def metrics(self, now=None, stall=600, alive=None):
+        "Return the current state as a dict."
+        return {"run":self.name, "status":self.status(now, stall, alive), "timestep":self.timestep,
+                "total":self.total, "rate":self.rate(), "eta":self.eta(),
+                "population":self.diversity.get("population"),
+                "lineages":self.diversity.get("lineages"),
+                "gamma":self.diversity.get("gamma"), "error":self.error}
+
+
+## THE MONITOR
+
+class Monitor:
+    """
+    Follow all result directories given in `rundirs`, plus any (new) directories
+    in `resultsdir` that match `pattern`. Runs are flagged as stalled after
+    `stall` seconds without log output, and as dead if their process is gone.
+    If `remote` is true, the runs are on other machines, so their processes
+    aren't looked up (and dead runs show up as stalled).
+    """
+
+    def __init__(self, rundirs=(), resultsdir="results", pattern=None, stall=600,
+                 jsonl=None, prom=None, polling=False, remote=False):
+        self.runs = {}
+        self.remote = remote
+        self.resultsdir = resultsdir
+        self.pattern = pattern
+        self.stall = stall
+        self.jsonl = jsonl
+        self.prom = prom
+        self.inotify = None
+        if not polling:
+            try:
+                self.inotify = Inotify()
+                if pattern is not None and os.path.isdir(resultsdir):
+                    self.inotify.watch(resultsdir, IN_CREATE | IN_MOVED_TO)
+            except (OSError, AttributeError):
+                print("inotify is not available, polling the log files instead.", file=sys.stderr)
+                self.inotify = None
+        for rundir in rundirs:
+            self.add(rundir)
+
+    def add(self, rundir):
+        "Start following a result directory."
+        if rundir in self.runs or not os.path.isdir(rundir):
+            return
+        self.runs[rundir] = RunState(rundir)
+        if self.inotify:
+            try:
+                self.inotify.watch(rundir)
+            except OSError as e: # e.g. too many watches, fall back to polling
+                print(str(e)+", polling the log files instead.", file=sys.stderr)
+                self.inotify.close()
+                self.inotify = None
+
+    def scan(self):
+        "Add new result directories matching the pattern."
+        if self.pattern is None:
+            return
+        for rundir in sorted(glob.glob(os.path.join(self.resultsdir, "*"))):
+            if re.search(self.pattern, os.path.basename(rundir)):
+                self.add(rundir)
+
+    def update(self, timeout=1.0):
+        "Wait for changes (at most `timeout` seconds) and update the affected runs."
+        if self.inotify:
+            changed = self.inotify.wait(timeout)
+            if self.resultsdir in changed or not self.runs:
+                self.scan()
+            targets = [self.runs[d] for d in changed if d in self.runs]
+        else:
+            time.sleep(timeout)
+            self.scan()
+            targets = list(self.runs.values())
+        now = time.time()
+        for run in targets:
+            run.update(now)
+
+    def snapshot(self):
+        "Return the metrics of all runs."
+        now = time.time()
+        processes = None if self.remote else gemm_processes()
+        return [run.metrics(now, self.stall, run.alive(processes))
+                for _, run in sorted(self.runs.items())]
+
+    def display(self, metrics, out=sys.stdout):
+        "Print a table of all runs."
+        if out.isatty():
+            out.write("\033[H\033[J") # clear the screen
+        out.write("%-40s %-9s %15s %9s %12s %10s %8s\n" %
+                  ("run", "status", "timestep", "steps/s", "ETA", "population", "lineages"))
+        for m in metrics:
+            progress = str(m["timestep"])+"/"+(str(m["total"]) if m["total"] else "?")
+            out.write("%-40s %-9s %15s %9s %12s %10s %8s\n" %
+                      (m["run"][-40:], m["status"], progress,
+                       "%.2f" % m["rate"] if m["rate"] else "-",
+                       scheduler.format_duration(m["eta"]) if m["eta"] is not None else "-",
+                       "%d" % m["population"] if m["population"] is not None else "-",
+                       "%d" % m["lineages"] if m["lineages"] is not None else "-"))
+        counts = {}
+        for m in metrics:
+            counts[m["status"]] = counts.get(m["status"], 0) + 1
+        rate = sum(m["rate"] or 0 for m in metrics if m["status"] == "running")
+        out.write(str(len(metrics))+" runs ("+", ".join(str(n)+" "+s for s, n in sorted(counts.items()))+
+                  "), "+str(round(rate, 2))+" steps/s in total\n")
+        for m in metrics:
+            if m["status"] in ("crashed", "dead", "stalled"):
+                out.write("! "+m["run"]+" "+m["status"]+(": "+m["error"] if m["error"] else "")+"\n")
+        out.flush()
+
+    def export(self, metrics):
+        "Append the metrics to the JSONL stream and/or rewrite the Prometheus text file."
+        now = time.time()
+        if self.jsonl:
+            with open(self.jsonl, "a") as f:
+                for m in metrics:
+                    f.write(json.dumps(dict(m, time=now))+"\n")
+        if self.prom:
+            write_prometheus(self.prom, metrics)
+
+    def run(self, interval=5.0, once=False, quiet=False):
+        "Monitor the runs until interrupted, refreshing the output every `interval` seconds."
+        self.scan()
+        try:
+            while True:
+                deadline = time.time() + interval
+                for run in self.runs.values():
+                    run.update()
+                while not once and time.time() < deadline:
+                    self.update(max(deadline - time.time(), 0))
+                metrics = self.snapshot()
+                if not quiet:
+                    self.display(metrics)
+                self.export(metrics)
+                if once:
+                    return metrics
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if self.inotify:
+                self.inotify.close()
+
+
+def write_prometheus(filename, metrics):
+    "Write the metrics in the Prometheus text format (atomically, for the node exporter)."
+    gauges = [("gemm_timestep", "timestep", "Current timestep of the run"),
+              ("gemm_timesteps_total", "total", "Total number of timesteps of the run"),
+              ("gemm_steps_per_second", "rate", "Recent simulation speed"),
+              ("gemm_eta_seconds", "eta", "Estimated remaining run time"),
+              ("gemm_population", "population", "Metacommunity size"),
+              ("gemm_lineages", "lineages", "Number of lineages")]
+    lines = []
+    for name, key, helptext in gauges:
+        lines.append("# HELP "+name+" "+helptext)
+        lines.append("# TYPE "+name+" gauge")
+        for m in metrics:
+            if m[key] is not None:
+                lines.append(name+'{run="'+m["run"]+'"} '+str(m[key]))
+    lines.append("# HELP gemm_runs Number of runs by status")
+    lines.append("# TYPE gemm_runs gauge")
+    for status in ["starting", "running", "stalled", "crashed", "dead", "done"]:
+        lines.append('gemm_runs{status="'+status+'"} '+
+                     str(len([m for m in metrics if m["status"] == status])))
+    with open(filename+".tmp", "w") as f:
+        f.write("\n".join(lines)+"\n")
+    os.replace(filename+".tmp", filename)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Follow the progress of GeMM runs.")
+    parser.add_argument("rundirs", nargs="*", help="result directories to follow")
+    parser.add_argument("-r", "--results", default="results", help="results folder")
+    parser.add_argument("-p", "--pattern", default=None,
+                        help="regex for result directories to follow (default: all, if none are given)")
+    parser.add_argument("-i", "--interval", type=float, default=5.0, help="refresh interval in seconds")
+    parser.add_argument("-s", "--stall", type=float, default=600,
+                        help="seconds without log output after which a run counts as stalled")
+    parser.add_argument("--jsonl", default=None, help="append the metrics to this JSONL file")
+    parser.add_argument("--prom", default=None, help="write the metrics to this Prometheus text file")
+    parser.add_argument("--poll", action="store_true", default=False, help="don't use inotify")
+    parser.add_argument("--remote", action="store_true", default=False,
+                        help="the runs are on other machines, don't look for their processes")
+    parser.add_argument("--once", action="store_true", default=False, help="print the status once and exit")
+    parser.add_argument("-q", "--quiet", action="store_true", default=False,
+                        help="only export the metrics, don't print the table")
+    args = parser.parse_args()
+    pattern = args.pattern if args.pattern or args.rundirs else ".*"
+    Monitor(args.rundirs, args.results, pattern, args.stall, args.jsonl, args.prom,
+            args.poll, args.remote).run(args.interval, args.once, args.quiet)
@@ -0,0 +1,274 @@
+##
+## Predict the cost of an experiment before launching it. Every map referenced by
+## a job is parsed once (cell count, carrying capacity, `initpop` cells and
+## timesteps), and combined with the settings that drive the run time
+## (`usebiggenes`, `fasta`, `outfreq`, `nniches`, `linkage`). A log-linear
+## regression, trained on the wall times and peak memory of the finished runs
+## in the catalogue (see `gemmpy/catalogue.py`), turns these into a predicted
+## wall time and peak RSS per job. The jobs are then ordered longest-first, and
+## the makespan is estimated by packing them onto the available cores and
+## memory, as the scheduler will (see `totalmem` in `gemmpy/scheduler.py`).
+##
+## Usage: python3 -m gemmpy.planner <config> [...] [-j <maxjobs>] [-m <totalmem>]
+##        python3 -m gemmpy.planner --model
+##
+
+import os, sys, math, argparse
+import numpy as np
+
+from gemmpy import cache, catalogue, mapformat, resources, scheduler
+
+# the GeMM defaults of the settings used by the model (see `src/defaults.jl`)
+defaults = {"cellsize":"20e6", "outfreq":"10", "nniches":"2", "linkage":"random",
+            "usebiggenes":"true", "fasta":"off"}
+
+# the model features (sizes are log-transformed, as their effect is multiplicative)
+feature_names = ["cells", "timesteps", "capacity", "initcapacity", "outputs", "usebiggenes",
+                 "fasta", "nniches", "linkage_random", "linkage_full"]
+
+## FEATURES
+
+_maps = {} # map statistics, keyed on (path, mtime, size)
+
+def map_stats(path):
+    "Parse a map file once and return its size statistics (None if it doesn't exist)."
+    if not os.path.isfile(path):
+        return None
+    stat = os.stat(path)
+    ident = (path, stat.st_mtime, stat.st_size)
+    if ident not in _maps:
+        m = mapformat.read_text(path)
+        capacity = m.cells["capacity"]
+        initpop = (m.cells["flags"] & (1 << mapformat.flag_names.index("initpop"))) > 0
+        _maps[ident] = {"cells":len(m), "timesteps":m.timesteps or 0,
+                        "capacity":float(np.nansum(capacity)),
+                        "nocapacity":int(np.isnan(capacity).sum()),
+                        "initpop":int(initpop.sum()),
+                        "initcapacity":float(np.nansum(capacity[initpop])),
+                        "initnocapacity":int(np.isnan(capacity[initpop]).sum())}
+    return _maps[ident]
+
+def features(config, settings):
+    """
+    Compute the model features of a run from its config path and settings.
+    Returns a dict, or None if one of its maps can't be found. (The first map of
+    a series determines the size of the world, all of them the run length.)
+    """
+    s = dict(defaults)
+    s.update(settings)
+    stats = [map_stats(m) for m in cache.map_files(config, settings)]
+    if not stats or None in stats:
+        return None
+    first = stats[0]
+    timesteps = sum(st["timesteps"] for st in stats)
+    cellsize = float(s["cellsize"])
+    capacity = first["capacity"] + first["nocapacity"] * cellsize
+    initcapacity = first["initcapacity"] + first["initnocapacity"] * cellsize
+    outfreq = max(float(s["outfreq"]), 1)
+    linkage = s["linkage"].strip('"')
+    return {"cells":math.log(max(first["cells"], 1)), "timesteps":math.log(max(timesteps, 1)),
+            "capacity":math.log(capacity + 1), "initcapacity":math.log(initcapacity + 1),
+            "outputs":math.log(timesteps / outfreq + 1),
+            "usebiggenes":float(s["usebiggenes"] == "true"),
+            "fasta":float(s["fasta"].strip('"') not in ("off", "false")),
+            "nniches":float(s["nniches"]), "linkage_random":float(linkage == "random"),
+            "linkage_full":float(linkage == "full"),
+            # not model inputs, just for the report
+            "ncells":first["cells"], "nsteps":timesteps}
+
+def job_features(job):
+    "The features of a job (read from its config file)."
+    return features(job.config, cache.read_config(job.config))
+
+def feature_vector(f):
+    return [f[n] for n in feature_names]
+
+
+## THE MODEL
+
+class CostModel:
+    """
+    A ridge regression of the logarithm of a cost (wall time or peak RSS) on
+    the standardised features. The penalty keeps the fit stable when the
+    training runs vary in only a few settings.
+    """
+
+    def __init__(self, penalty=1.0):
+        self.penalty = penalty
+        self.coefficients = None
+
+    def fit(self, X, y):
+        X, y = np.asarray(X, dtype=float), np.log(np.asarray(y, dtype=float))
+        self.mean = X.mean(axis=0)
+        self.scale = X.std(axis=0)
+        self.scale[self.scale == 0] = 1
+        Z = (X - self.mean) / self.scale
+        self.intercept = y.mean()
+        A = Z.T @ Z + self.penalty * np.eye(Z.shape[1])
+        self.coefficients = np.linalg.solve(A, Z.T @ (y - self.intercept))
+        residuals = y - self.predict_log(X)
+        self.error = float(np.exp(np.median(np.abs(residuals)))) # typical factor off
+        self.nruns = len(y)
+        return self
+
+    def predict_log(self, X):
+        return self.intercept + ((np.asarray(X, dtype=float) - self.mean) / self.scale) @ self.coefficients
+
+    def predict(self, X):
+        return np.exp(self.predict_log(X))
+
+
+def training_data(cat):
+    "Collect the features, wall times and peak RSS of the finished runs in a catalogue."
+    X, walltimes, rss = [], [], []
+    for run in cat.find("status=done"):
+        if not run["walltime"]:
+            continue
+        f = features(run["config"], run["params"])
+        if f is None:
+            continue
+        X.append(feature_vector(f))
+        walltimes.append(run["walltime"])
+        rss.append(run["maxrss"])
+    return X, walltimes, rss
+
+def train(cat=None, minruns=5):
+    """
+    Fit the wall time and memory models on the catalogue (by default, the
+    launchers' catalogue, if it exists). Either model is None if there are
+    fewer than `minruns` runs to learn from.
+    """
+    if cat is None:
+        path = "results/catalogue.sqlite"
+        if not os.path.exists(path):
+            return None, None
+        cat = catalogue.Catalogue(path)
+    X, walltimes, rss = training_data(cat)
+    wallmodel = CostModel().fit(X, walltimes) if len(X) >= minruns else None
+    withrss = [(x, r) for x, r in zip(X, rss) if r]
+    rssmodel = CostModel().fit([x for x, r in withrss], [r for x, r in withrss]) \
+        if len(withrss) >= minruns else None
+    return wallmodel, rssmodel
+
+
+## PLANNING
+
+def pack(estimates, maxjobs, totalmem=None):
+    """
+    Simulate running jobs in the given order on `maxjobs` slots and `totalmem` MB
+    of memory, starting each job as soon as a slot is free and its predicted
+    peak memory fits (as the scheduler does). `estimates` is a list of (wall
+    time, peak RSS) tuples. Returns the predicted makespan in seconds.
+    """
+    waiting = list(estimates)
+    running = [] # (end time, memory)
+    now = 0
+    while waiting or running:
+        used = sum(m for e, m in running)
+        for w in list(waiting):
+            if len(running) >= maxjobs:
+                break
+            memory = w[1] or 0
+            if not totalmem or not running or used + memory <= totalmem:
+                running.append((now + w[0], memory))
+                used += memory
+                waiting.remove(w)
+        if running:
+            running.sort()
+            now = running[0][0]
+            running = [r for r in running if r[0] > now]
+    return now
+
+def cached(job, runcache):
+    "Check (without side effects) whether a job will be skipped by the run cache."
+    if not runcache:
+        return False
+    job.key = cache.run_key(job)
+    entry = runcache.entry(job.key)
+    return bool(entry and runcache.complete(entry["dest"], job.key))
+
+def plan(jobs, maxjobs=None, totalmem=None, runcache=None, cat=None, show=True):
+    """
+    Predict the wall time and peak memory of each job, and return the jobs
+    ordered longest-first (the predicted peak memory is stored as `job.memory`
+    for the scheduler). Without enough past runs to learn from, jobs are
+    ordered by the size of their world times their number of timesteps.
+    Prints the predicted total cost and makespan (with `maxjobs` concurrent
+    runs and `totalmem` MB of memory, default: this machine's) unless `show` is false.
+    """
+    maxjobs = maxjobs if maxjobs else os.cpu_count()
+    if totalmem is None or totalmem is True:
+        totalmem = resources.total_memory()
+    runcache = cache.RunCache() if runcache is True else runcache
+    wallmodel, rssmodel = train(cat)
+    planned, unknown, skipped = [], [], 0
+    for job in jobs:
+        if cached(job, runcache):
+            skipped += 1
+            unknown.append(job) # the scheduler will skip it
+            continue
+        f = job_features(job)
+        if f is None:
+            unknown.append(job)
+            continue
+        wall = float(wallmodel.predict([feature_vector(f)])[0]) if wallmodel else None
+        job.memory = float(rssmodel.predict([feature_vector(f)])[0]) if rssmodel else None
+        work = wall if wall is not None else f["ncells"] * f["nsteps"]
+        planned.append((work, wall, f, job))
+    planned.sort(key=lambda p: -p[0])
+    if show:
+        report(planned, len(unknown) - skipped, skipped, wallmodel, rssmodel, maxjobs, totalmem)
+    return [p[3] for p in planned] + unknown
+
+def report(planned, unknown, skipped, wallmodel, rssmodel, maxjobs, totalmem, rows=10):
+    "Print the predicted cost of a plan."
+    fmt = scheduler.format_duration
+    print("Planned "+str(len(planned))+" jobs"+
+          (", "+str(skipped)+" cached" if skipped else "")+
+          (", "+str(unknown)+" without readable maps" if unknown else "")+".")
+    if not wallmodel:
+        print("Too few finished runs in the catalogue to predict run times, "+
+              "ordering jobs by map size x timesteps.")
+        return
+    print("Model trained on "+str(wallmodel.nruns)+" runs (typically off by a factor of "+
+          str(round(wallmodel.error, 2))+").")
+    walls = [p[1] for p in planned]
+    memory = [p[3].memory for p in planned]
+    print("  %-40s %8s %6s %11s %10s" % ("longest jobs", "cells", "steps", "wall time", "peak RSS"))
+    for work, wall, f, job in planned[:rows]:
+        print("  %-40s %8d %6d %11s %10s" % (job.name[:40], f["ncells"], f["nsteps"], fmt(wall),
+                                              resources.format_bytes(job.memory * 1024 * 1024)
+                                              if job.memory else "-"))
+    makespan = pack(list(zip(walls, memory)), maxjobs, totalmem)
+    print("Predicted total: "+str(round(sum(walls) / 3600, 1))+" core hours; "+
+          "makespan "+fmt(makespan)+" on "+str(maxjobs)+" cores"+
+          (" and "+resources.format_bytes(totalmem * 1024 * 1024)+" of memory" if totalmem else "")+".")
+    if totalmem and any(m and m > totalmem for m in memory):
+        print("Warning: "+str(len([m for m in memory if m and m > totalmem]))+
+              " jobs are predicted to need more memory than is available.", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Predict the cost of a set of runs.")
+    parser.add_argument("configs", nargs="*", help="config files of the planned runs")
+    parser.add_argument("-j", "--maxjobs", type=int, default=None,
+                        help="number of concurrent runs (default: number of cores)")
+    parser.add_argument("-m", "--totalmem", type=float, default=None,
+                        help="memory available to all runs in MB (default: this machine's)")
+    parser.add_argument("-d", "--database", default="results/catalogue.sqlite",
+                        help="the catalogue to learn from")
+    parser.add_argument("--model", action="store_true", help="print the fitted models")
+    args = parser.parse_args()
+    cat = catalogue.Catalogue(args.database)
+    if args.model:
+        for name, model in zip(["wall time", "peak RSS"], train(cat)):
+            if model is None:
+                print(name+": too few runs")
+                continue
+            print(name+" (log scale, "+str(model.nruns)+" runs, typically off by a factor of "+
+                  str(round(model.error, 2))+"):")
+            for n, c in zip(feature_names, model.coefficients / model.scale):
+                print("  %-16s %8.3f" % (n, c))
+    jobs = [scheduler.Job(os.path.splitext(os.path.basename(c))[0], c) for c in args.configs]
+    if jobs:
+        plan(jobs, args.maxjobs, args.totalmem, cat=cat)
@@ -0,0 +1,251 @@
+##
+## Profile GeMM runs and compare the profiles. Any config can be run under the
+## Julia profiler (via `rungemmprofile.jl`, after an unprofiled one-timestep
+## warm-up so that compilation doesn't show up). The flat and tree reports are
+## parsed, and the tree is turned into collapsed stacks ("a;b;c <samples>", the
+## input format of flame graph tools such as `flamegraph.pl` or speedscope).
+## Profiles of several replicates or scenarios can be merged, and the hottest
+## functions compared between the values of a parameter (e.g. `fasta`).
+##
+## Usage: python3 -m gemmpy.profiling run <config> [...] [-o <dir>]
+##        python3 -m gemmpy.profiling collapse <profile> [...] [-o <file>]
+##        python3 -m gemmpy.profiling hot <profile> [...] [--by <parameter>] [-n <rows>]
+##
+## A profile is the folder written by `run` (by default `profiles/<config name>`).
+##
+
+import os, re, sys, json, shutil, argparse, subprocess
+from collections import Counter
+
+from gemmpy import cache, mapformat
+
+## PARSING THE PROFILER OUTPUT
+
+def frame_name(filename, function):
+    """
+    A short name for a stack frame: the function name without its arguments
+    (plus the file for anonymous functions and macro expansions).
+    """
+    name = re.sub(r"\(.*$", "", function).strip()
+    if not name or name in ("macro expansion", "anonymous") or name.startswith("#"):
+        name += " ["+os.path.basename(filename)+"]"
+    return name
+
+def parse_flat(filename):
+    """
+    Parse a flat profile report (`Profile.print(format=:flat)`). Returns a list
+    of dicts with the sample count, overhead (samples in the frame itself),
+    file, line and function of each entry.
+    """
+    entries = []
+    with open(filename) as f:
+        for line in f:
+            match = re.match(r"^\s*(\d+)\s+(\d+)\s+(\S+)\s+(-?\d+|\?)\s+(.+?)\s*$", line)
+            if match:
+                entries.append({"count":int(match.group(1)), "overhead":int(match.group(2)),
+                                "file":match.group(3), "line":match.group(4),
+                                "function":match.group(5)})
+    return entries
+
+def parse_tree(filename):
+    """
+    Parse a tree profile report (`Profile.print(format=:tree)`). Every line
+    shows the overhead, the nesting level (one character of indentation per
+    level, or "+n" for deeply nested frames), the sample count and the frame.
+    Returns a list of (level, count, overhead, file, line, function) tuples.
+    """
+    nodes = []
+    with open(filename) as f:
+        for line in f:
+            match = re.match(r"^\s*(\d*)╎([ ╎]*)(?:\+(\d+) )?(\d+)\s+(.*?):(-?\d+|\?); (.*?)\s*$", line)
+            if not match:
+                continue
+            level = len(match.group(2))
+            if match.group(3):
+                level += len(match.group(3)) + 2 + int(match.group(3))
+            nodes.append((level, int(match.group(4)), int(match.group(1) or 0),
+                          match.group(5), match.group(6), match.group(7)))
+    return nodes
+
+def collapse(nodes):
+    "Turn a parsed profile tree into collapsed stacks (a Counter of 'a;b;c' -> samples)."
+    stacks = Counter()
+    path = []
+    for level, count, overhead, filename, line, function in nodes:
+        path = path[:level] + [frame_name(filename, function)]
+        if overhead > 0:
+            stacks[";".join(path)] += overhead
+    return stacks
+
+
+## PROFILES
+
+class Profile:
+    "The parsed profile of one run, with the settings of its config."
+
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.basename(os.path.normpath(path))
+        with open(os.path.join(path, "settings.json")) as f:
+            self.settings = json.load(f)
+        self.nodes = parse_tree(os.path.join(path, "profile_tree.txt"))
+        self.stacks = collapse(self.nodes)
+
+    def flat(self):
+        return parse_flat(os.path.join(self.path, "profile_flat.txt"))
+
+
+def merge(profiles):
+    "Merge the collapsed stacks of several profiles."
+    stacks = Counter()
+    for p in profiles:
+        stacks.update(p.stacks)
+    return stacks
+
+def function_times(stacks):
+    """
+    Count the samples of each function in a set of collapsed stacks: inclusive
+    (the function is anywhere on the stack) and self (it is at the top).
+    Returns both Counters and the total number of samples.
+    """
+    inclusive, selftime = Counter(), Counter()
+    for stack, samples in stacks.items():
+        frames = stack.split(";")
+        for f in set(frames):
+            inclusive[f] += samples
+        selftime[frames[-1]] += samples
+    return inclusive, selftime, sum(stacks.values())
+
+def write_collapsed(stacks, filename):
+    "Write collapsed stacks in the format read by flame graph tools."
+    with open(filename, "w") as f:
+        for stack, samples in sorted(stacks.items()):
+            f.write(stack+" "+str(samples)+"\n")
+
+def group_profiles(profiles, parameter=None):
+    "Group profiles by the value of a parameter (or by name, if none is given)."
+    groups = {}
+    for p in profiles:
+        key = p.settings.get(parameter, "(default)") if parameter else p.name
+        groups.setdefault(key, []).append(p)
+    return groups
+
+def hot_functions(profiles, parameter=None, rows=20, selfonly=False):
+    """
+    Print a ranked table of the hottest functions (share of samples, inclusive
+    or self) for each value of `parameter`, merging the replicates of each value.
+    Frames that are on every stack (like `runsim`) are left out.
+    """
+    groups = group_profiles(profiles, parameter)
+    shares = {}
+    for key, members in groups.items():
+        inclusive, selftime, total = function_times(merge(members))
+        counts = selftime if selfonly else inclusive
+        shares[key] = {f: counts[f] / total for f in counts} if total else {}
+    functions = Counter()
+    for key in shares:
+        for f, share in shares[key].items():
+            functions[f] = max(functions[f], share)
+    for f in list(functions):
+        if all(shares[k].get(f, 0) > 0.999 for k in shares):
+            del functions[f]
+    keys = sorted(shares.keys())
+    labels = [(parameter+"=" if parameter else "")+str(k) for k in keys]
+    print("%-40s" % ("function ("+("self" if selfonly else "inclusive")+")") +
+          "".join(" %14s" % l[:14] for l in labels))
+    for f, share in functions.most_common(rows):
+        print("%-40s" % f[:40] + "".join(" %13.1f%%" % (shares[k].get(f, 0) * 100) for k in keys))
+
+
+## RUNNING THE PROFILER
+
+def warmup_config(config, settings, pdir):
+    """
+    Write a config for the warm-up run: the same settings on the first map,
+    cut down to a single timestep. Returns None if the map can't be read.
+    """
+    maps = cache.map_files(config, settings)
+    if not maps:
+        return None
+    try:
+        m = mapformat.read_text(maps[0])
+    except (OSError, ValueError) as e:
+        print("No warm-up run for "+config+": "+str(e), file=sys.stderr)
+        return None
+    m.timesteps = 1
+    mapfile = os.path.join(pdir, "warmup.map")
+    mapformat.write_text(m, mapfile)
+    return derived_config(config, "warmup", {"dest":os.path.join(pdir, "warmup"),
+                                             "maps":os.path.relpath(mapfile, os.path.dirname(config) or ".")})
+
+def derived_config(config, suffix, overrides):
+    "Write a copy of a config with some settings overridden, next to the original."
+    name = os.path.splitext(config)[0]+"."+suffix+".config"
+    with open(config) as original, open(name, "w") as cf:
+        cf.write(original.read())
+        cf.write("\n# Overridden by `gemmpy/profiling.py`:\n")
+        for k in overrides.keys():
+            cf.write(k+" "+overrides[k]+"\n")
+    return name
+
+def profile_config(config, outdir="profiles", warmup=True):
+    """
+    Run a config under the Julia profiler and store the reports, the collapsed
+    stacks and the settings in `<outdir>/<config name>`. The run writes its
+    output to a subfolder, so the config's own `dest` is left alone.
+    """
+    settings = cache.read_config(config)
+    pdir = os.path.join(outdir, os.path.splitext(os.path.basename(config))[0])
+    shutil.rmtree(pdir, ignore_errors=True)
+    os.makedirs(pdir)
+    with open(os.path.join(pdir, "settings.json"), "w") as f:
+        json.dump(settings, f, indent=1)
+    profiled = derived_config(config, "profile", {"dest":os.path.join(pdir, "run")})
+    warm = warmup_config(config, settings, pdir) if warmup else None
+    cmd = ["julia", "rungemmprofile.jl", profiled, os.path.join(pdir, "profile")]
+    try:
+        returncode = subprocess.run(cmd + ([warm] if warm else [])).returncode
+    finally:
+        for c in (profiled, warm):
+            if c and os.path.exists(c):
+                os.remove(c)
+    if returncode != 0 or not os.path.exists(os.path.join(pdir, "profile_tree.txt")):
+        print("Profiling "+config+" failed (exit code "+str(returncode)+").", file=sys.stderr)
+        return None
+    for d in ("run", "warmup"): # the simulation output isn't needed
+        shutil.rmtree(os.path.join(pdir, d), ignore_errors=True)
+    profile = Profile(pdir)
+    write_collapsed(profile.stacks, os.path.join(pdir, "stacks.collapsed"))
+    return profile
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Profile GeMM runs and compare the profiles.")
+    parser.add_argument("command", choices=["run", "collapse", "hot"])
+    parser.add_argument("paths", nargs="+", help="config files (run) or profile folders")
+    parser.add_argument("-o", "--output", default=None,
+                        help="folder for the profiles (run, default: profiles) or "+
+                        "file for the merged stacks (collapse, default: stdout)")
+    parser.add_argument("--no-warmup", action="store_true",
+                        help="profile without a warm-up run (includes compilation)")
+    parser.add_argument("-b", "--by", default=None, help="compare profiles by this parameter (hot)")
+    parser.add_argument("-n", "--rows", type=int, default=20, help="number of functions to list (hot)")
+    parser.add_argument("--self", action="store_true", dest="selfonly",
+                        help="rank by self time instead of inclusive time (hot)")
+    args = parser.parse_args()
+    if args.command == "run":
+        profiles = [profile_config(c, args.output or "profiles", not args.no_warmup) for c in args.paths]
+        profiles = [p for p in profiles if p]
+        if len(profiles) > 0:
+            hot_functions(profiles, rows=args.rows)
+        sys.exit(0 if len(profiles) == len(args.paths) else 1)
+    profiles = [Profile(p) for p in args.paths]
+    if args.command == "collapse":
+        stacks = merge(profiles)
+        if args.output:
+            write_collapsed(stacks, args.output)
+        else:
+            for stack, samples in sorted(stacks.items()):
+                print(stack+" "+str(samples))
+    else:
+        hot_functions(profiles, args.by, args.rows, args.selfonly)
@@ -0,0 +1,153 @@
+##
+## Run replicates until their results have converged, instead of a fixed number of
+## seeds per scenario. Seeds are launched in waves: every scenario first gets
+## `minseeds` runs, then the end-of-run metrics of its finished runs (see
+## `gemmpy/metrics.py`) are combined into means with bootstrap confidence
+## intervals. A scenario is done once the interval of every metric is narrower
+## than `threshold` (relative to the mean, unless `relative` is false), or once
+## all of its seeds are used up. The seeds of the next wave go to the scenarios
+## that are furthest from converging, so the capacity freed by the stable
+## scenarios is spent on the noisy ones.
+##
+## The state of every scenario is logged to `<prefix>_replicates.tsv` after each
+## wave. As the waves only depend on the results, an interrupted experiment that
+## is relaunched with the same settings repeats the same runs, which the run
+## cache then skips.
+##
+## Usage (in a launcher): replicates.ReplicateController(**replicate_settings).run(
+##                            scenarios, range(seed1, seedN+1), setup_run, run_experiment)
+##
+
+import math
+import numpy as np
+
+from gemmpy import analysis
+from gemmpy.metrics import metric, parse_metric
+
+class ReplicateController:
+    """
+    Launch the replicates of a set of scenarios in waves until the metrics
+    (a list of metric names, e.g. "diversity:lineages") have converged.
+    Each wave starts at most `wave` runs per scenario on average, and the
+    confidence intervals have the given `level`.
+    """
+
+    def __init__(self, metrics, threshold=0.1, relative=True, wave=5, minseeds=5, level=0.95):
+        for m in metrics:
+            parse_metric(m)
+        if minseeds < 2:
+            raise ValueError("Confidence intervals need at least two seeds per scenario.")
+        self.metrics = list(metrics)
+        self.threshold = threshold
+        self.relative = relative
+        self.wave = wave
+        self.minseeds = minseeds
+        self.level = level
+        self.jobs = {} # the jobs of each scenario
+        self.state = {} # the intervals of each scenario: metric -> (n, mean, lower, upper)
+
+    def tolerance(self, mean):
+        "The widest acceptable confidence interval around a mean."
+        return self.threshold * abs(mean) if self.relative else self.threshold
+
+    def noise(self, scenario):
+        """
+        How far a scenario is from converging: the largest ratio of interval
+        width to tolerance over all metrics (infinite if a metric is unknown).
+        """
+        worst = 0
+        for m in self.metrics:
+            n, mean, lower, upper = self.state[scenario][m]
+            if n < 2:
+                return math.inf
+            tolerance = self.tolerance(mean)
+            width = upper - lower
+            if width > tolerance:
+                worst = max(worst, width / tolerance if tolerance > 0 else math.inf)
+        return worst
+
+    def converged(self, scenario):
+        return self.noise(scenario) <= 1
+
+    def update(self, scenarios):
+        "Read the metrics of the finished runs of some scenarios and recompute their intervals."
+        groups, keys = [], []
+        for s in scenarios:
+            values = [[metric(job.dest, m) for m in self.metrics] for job in self.jobs[s]]
+            for i, m in enumerate(self.metrics):
+                groups.append(np.array([v[i] for v in values if v[i] is not None], dtype=float))
+                keys.append((s, m))
+        means, lower, upper = analysis.bootstrap_ci(groups, level=self.level)
+        for i, (s, m) in enumerate(keys):
+            self.state.setdefault(s, {})[m] = (len(groups[i]), means[i], lower[i], upper[i])
+
+    def allocate(self, noisy, available, capacity):
+        """
+        Distribute the runs of a wave: one by one, each run goes to the scenario
+        whose interval is predicted to be furthest from its tolerance (intervals
+        shrink with the square root of the number of seeds). Scenarios whose
+        prediction has converged get no more runs in this wave.
+        """
+        extra = {s: 0 for s in noisy}
+        for i in range(capacity):
+            def predicted(s):
+                n = max(len(self.jobs[s]), 1)
+                return self.noise(s) * math.sqrt(n / (n + extra[s]))
+            candidates = [s for s in noisy if extra[s] < available[s] and predicted(s) > 1]
+            if not candidates:
+                break
+            extra[max(candidates, key=predicted)] += 1
+        return extra
+
+    def log(self, prefix, wave):
+        "Write the current intervals of all scenarios to `<prefix>_replicates.tsv`."
+        filename = prefix+"_replicates.tsv"
+        with open(filename, "w" if wave == 0 else "a") as f:
+            if wave == 0:
+                f.write("\t".join(["wave", "scenario", "seeds", "metric", "n", "mean",
+                                   "lower", "upper", "converged"])+"\n")
+            for s in sorted(self.state):
+                done = self.converged(s)
+                for m in self.metrics:
+                    n, mean, lower, upper = self.state[s][m]
+                    f.write("\t".join([str(wave), s, str(len(self.jobs[s])), m, str(n)] +
+                                      ["NA" if v != v else str(v) for v in (mean, lower, upper)] +
+                                      [str(done).lower()])+"\n")
+
+    def run(self, scenarios, seeds, setup, execute, prefix=None):
+        """
+        Run the scenarios (a dict of scenario names to the parameters of their
+        runs) with replicate seeds taken in order from `seeds`, until they have
+        converged or all seeds have been used. `setup(name, seed, **params)`
+        writes the config of a run and returns its job (the run is named
+        `<scenario>_<seed>`), `execute(jobs)` runs a list of jobs to completion.
+        Returns a dict of the final intervals of each scenario.
+        """
+        seeds = list(seeds)
+        self.jobs = {s: [] for s in scenarios}
+        wave = 0
+        todo = {s: min(self.minseeds, len(seeds)) for s in scenarios}
+        while todo and any(todo.values()):
+            jobs = []
+            for s, n in todo.items():
+                for seed in seeds[len(self.jobs[s]):len(self.jobs[s])+n]:
+                    job = setup(s+"_"+str(seed), seed, **scenarios[s])
+                    self.jobs[s].append(job)
+                    jobs.append(job)
+            print("Replicate wave "+str(wave)+": "+str(len(jobs))+" runs in "+
+                  str(len([n for n in todo.values() if n]))+" scenarios.")
+            execute(jobs)
+            self.update([s for s, n in todo.items() if n])
+            if prefix:
+                self.log(prefix, wave)
+            noisy = [s for s in scenarios if not self.converged(s) and len(self.jobs[s]) < len(seeds)]
+            print(str(len([s for s in scenarios if self.converged(s)]))+" of "+str(len(scenarios))+
+                  " scenarios have converged"+
+                  (", "+str(len(noisy))+" need more replicates." if noisy else "."))
+            available = {s: len(seeds) - len(self.jobs[s]) for s in noisy}
+            todo = self.allocate(noisy, available, self.wave * len(scenarios))
+            wave += 1
+        for s in scenarios:
+            if not self.converged(s):
+                print("Scenario "+s+" has not converged after "+str(len(self.jobs[s]))+" seeds.")
+        return self.state
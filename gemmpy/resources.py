@@ -0,0 +1,195 @@
+##
+## Resource profiling of simulation runs. While a job runs, the CPU time,
+## resident memory and I/O of its Julia process (read from /proc) and the size
+## of its output directory are sampled at a fixed interval. The samples of each
+## run are kept as a time series (in the run catalogue, see `gemmpy/catalogue.py`),
+## and at the end of an experiment, the cost of its runs is summarised for each
+## parameter that was varied, e.g. per `mutationrate` in `run_mutation_experiment`.
+##
+
+import os, time
+
+clock_ticks = os.sysconf("SC_CLK_TCK")
+
+# the columns of a sample: seconds since the start of the run, CPU seconds,
+# resident set size (MB), bytes read and written, and size of the output (bytes)
+sample_columns = ["time", "cputime", "rss", "read", "written", "output"]
+
+## AUXILIARY FUNCTIONS
+
+def process_usage(pid):
+    """
+    Read the CPU time (in seconds), resident set size (in MB) and the number of
+    bytes read and written by a process from /proc. Returns None if it has exited.
+    """
+    try:
+        with open("/proc/"+str(pid)+"/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        if fields[0] == "Z": # exited, but not reaped yet
+            return None
+        cputime = (int(fields[11]) + int(fields[12])) / clock_ticks
+        rss = 0
+        with open("/proc/"+str(pid)+"/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    rss = int(line.split()[1]) / 1024
+        io = {}
+        try:
+            with open("/proc/"+str(pid)+"/io") as f:
+                for line in f:
+                    key, value = line.split(":")
+                    io[key] = int(value)
+        except OSError: # not readable for zombies or other users' processes
+            pass
+        return cputime, rss, io.get("rchar", 0), io.get("wchar", 0)
+    except (OSError, ValueError, IndexError):
+        return None
+
+def directory_size(path):
+    "Return the total size of all files in a directory (0 if it doesn't exist)."
+    total = 0
+    if path and os.path.isdir(path):
+        for root, dirs, names in os.walk(path):
+            for n in names:
+                try:
+                    total += os.path.getsize(os.path.join(root, n))
+                except OSError: # deleted in the meantime
+                    pass
+    return total
+
+def total_memory():
+    "Return the total memory of this machine in MB (None if unknown)."
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemTotal:"):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+## SAMPLING
+
+class RunSampler:
+    """
+    Sample the resource use of one run every `interval` seconds. CPU time, I/O
+    and output size are counted from the start of the run (so that a run on a
+    warm worker is not charged for the worker's earlier jobs).
+    """
+
+    def __init__(self, pid, dest, interval=30):
+        self.pid = pid
+        self.dest = dest
+        self.interval = interval
+        self.start = time.time()
+        self.baseline = process_usage(pid) or (0, 0, 0, 0)
+        self.output = directory_size(dest)
+        self.samples = []
+        self.due = self.start + interval
+
+    def sample(self, force=False):
+        "Take a sample if one is due (or if `force` is true)."
+        now = time.time()
+        if now < self.due and not force:
+            return
+        self.due = now + self.interval
+        usage = process_usage(self.pid)
+        if usage is None:
+            return
+        cputime, rss, read, written = usage
+        self.samples.append((round(now - self.start, 2), round(cputime - self.baseline[0], 2),
+                             round(rss, 1), read - self.baseline[2], written - self.baseline[3],
+                             directory_size(self.dest) - self.output))
+
+    def cputime(self):
+        return self.samples[-1][1] if self.samples else None
+
+    def maxrss(self):
+        return max(s[2] for s in self.samples) if self.samples else None
+
+
+def run_costs(result):
+    """
+    Summarise the resource use of a finished run: wall time and CPU time (s),
+    peak and mean RSS (MB), bytes read and written (up to the last sample), and
+    output size.
+    """
+    samples = result.samples
+    last = samples[-1] if samples else (None,) * len(sample_columns)
+    return {"walltime":result.walltime, "cputime":result.cputime, "maxrss":result.maxrss,
+            "meanrss":sum(s[2] for s in samples) / len(samples) if samples else None,
+            "read":last[3], "written":last[4], "output":directory_size(result.job.dest)}
+
+
+## SUMMARIES
+
+def swept_parameters(results):
+    "Return the parameters that take more than one value across a set of results."
+    values = {}
+    for r in results:
+        for k, v in r.job.params.items():
+            values.setdefault(k, set()).add(str(v))
+    return sorted(k for k in values if len(values[k]) > 1)
+
+def mean(values):
+    values = [v for v in values if v is not None]
+    return sum(values) / len(values) if values else None
+
+def cost_by_parameter(results, parameter):
+    """
+    Group the costs of a set of results by the value of a parameter. Returns a
+    list of (value, number of runs, mean costs), with the maxima for `maxrss`.
+    """
+    groups = {}
+    for r in results:
+        groups.setdefault(str(r.job.params.get(parameter)), []).append(run_costs(r))
+    table = []
+    for value, costs in sorted(groups.items()):
+        summary = {k: mean(c[k] for c in costs) for k in costs[0]}
+        summary["maxrss"] = max((c["maxrss"] for c in costs if c["maxrss"] is not None), default=None)
+        table.append((value, len(costs), summary))
+    return table
+
+def format_bytes(size):
+    "Pretty-print a number of bytes."
+    if size is None:
+        return "-"
+    for unit in ["B", "kB", "MB", "GB"]:
+        if size < 1024 or unit == "GB":
+            return ("%.0f" % size if unit == "B" else "%.1f" % size)+" "+unit
+        size /= 1024
+
+def format_seconds(seconds):
+    return "-" if seconds is None else "%.1f s" % seconds
+
+def report(results, maxjobs=None):
+    """
+    Print the cost of a set of results for each swept parameter, and how many
+    runs of this kind fit on this machine at once.
+    """
+    results = [r for r in results if r.walltime > 0]
+    if not results:
+        return
+    for parameter in swept_parameters(results):
+        print("Cost by "+parameter+":")
+        print("  %-16s %5s %11s %11s %10s %10s %10s" % ("value", "runs", "wall time", "CPU time",
+                                                       "peak RSS", "written", "output"))
+        for value, n, c in cost_by_parameter(results, parameter):
+            print("  %-16s %5d %11s %11s %10s %10s %10s" % (
+                value, n, format_seconds(c["walltime"]), format_seconds(c["cputime"]),
+                format_bytes(c["maxrss"] * 1024 * 1024 if c["maxrss"] is not None else None),
+                format_bytes(c["written"]), format_bytes(c["output"])))
+    costs = [run_costs(r) for r in results]
+    # runs with fewer than two samples (e.g. ended before the second sample) are left out
+    # of the load estimate, as their CPU time may only cover the start of the run
+    load = mean(c["cputime"] / c["walltime"] for r, c in zip(results, costs)
+                if c["cputime"] is not None and len(r.samples) >= 2)
+    peak = max((c["maxrss"] for c in costs if c["maxrss"] is not None), default=None)
+    memory = total_memory()
+    if load is None or peak is None or not memory:
+        return
+    fit = min(int(os.cpu_count() / max(load, 0.01)), int(memory / peak))
+    print("Runs use "+str(round(load, 2))+" cores on average and up to "+str(round(peak))+
+          " MB of memory: "+str(fit)+" runs fit on this machine at once"+
+          (" (maxjobs is "+str(maxjobs)+")." if maxjobs else "."))
@@ -0,0 +1,302 @@
+##
+## A bounded job scheduler for GeMM simulation runs. Instead of launching every
+## run of an experiment at once, jobs are pulled from a queue and started as
+## soon as one of a fixed number of slots becomes free.
+##
+
+import os, sys, time, signal, resource, subprocess
+
+from gemmpy.cache import RunCache
+import gemmpy.watchdog, gemmpy.catalogue, gemmpy.resources, gemmpy.compact
+
+## JOBS AND RESULTS
+
+class Job:
+    "A single simulation run, defined by its config file."
+
+    def __init__(self, name, config, dest=None, seed=None, params=None):
+        self.name = name
+        self.config = config
+        self.dest = dest
+        self.seed = seed
+        self.params = params if params is not None else {}
+        self.key = None # the run cache key, see `gemmpy/cache.py`
+        self.runid = None # the run's ID in the catalogue, see `gemmpy/catalogue.py`
+        self.memory = None # the predicted peak RSS in MB, see `gemmpy/planner.py`
+
+    def command(self):
+        "The command line used to start this run."
+        return ["julia", "rungemm.jl", "--config", self.config]
+
+    def __repr__(self):
+        return "Job("+self.name+")"
+
+
+class Result:
+    "The outcome of a finished job."
+
+    def __init__(self, job, status, returncode, start, end, maxrss=None):
+        self.job = job
+        self.status = status # "done", "failed", "terminated-early", or "killed (<reason>)"
+        self.returncode = returncode
+        self.start = start
+        self.end = end
+        self.maxrss = maxrss # peak resident set size in MB (None if unknown)
+        self.cputime = None # CPU time in seconds (None if unknown)
+        self.samples = [] # resource samples, see `gemmpy/resources.py`
+
+    @property
+    def walltime(self):
+        return self.end - self.start
+
+    def __repr__(self):
+        return "Result("+self.job.name+", "+self.status+")"
+
+
+## AUXILIARY FUNCTIONS
+
+def rss(pid, field="VmRSS"):
+    """
+    Return the current resident set size of a process in MB (0 if unknown).
+    With `field="VmHWM"`, return its peak so far instead.
+    """
+    try:
+        with open("/proc/"+str(pid)+"/status") as status:
+            for line in status:
+                if line.startswith(field+":"):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError):
+        pass
+    return 0
+
+def exited(proc):
+    """
+    Check whether a process has terminated, like `Popen.poll`, but without
+    reaping it, so that `reap` can still collect its resource usage.
+    """
+    if proc.returncode is not None:
+        return True
+    try:
+        return os.waitid(os.P_PID, proc.pid, os.WEXITED | os.WNOHANG | os.WNOWAIT) is not None
+    except ChildProcessError:
+        return True
+
+def reap(proc):
+    """
+    Wait for a process to terminate. Returns its exit code (as `Popen.wait`)
+    and its resource usage (as `resource.getrusage`, None if unknown).
+    """
+    if proc.returncode is None:
+        try:
+            pid, status, usage = os.wait4(proc.pid, 0)
+            proc.returncode = os.waitstatus_to_exitcode(status)
+            return proc.returncode, usage
+        except ChildProcessError:
+            pass
+    return proc.wait(), None
+
+def limit_cpu(seconds):
+    "Return a `preexec_fn` that caps the CPU time of a child process."
+    def setlimit():
+        resource.setrlimit(resource.RLIMIT_CPU, (seconds, seconds))
+    return setlimit
+
+def format_duration(seconds):
+    "Pretty-print a duration given in seconds."
+    return "%d:%02d:%04.1f" % (seconds // 3600, (seconds % 3600) // 60, seconds % 60)
+
+
+## THE SCHEDULER
+
+class Scheduler:
+    """
+    Run jobs through a queue with at most `maxjobs` concurrent processes
+    (default: the number of CPU cores). Optionally, each job can be capped to
+    `maxmem` MB of resident memory and `maxcpu` seconds of CPU time. Jobs that
+    exceed these limits are killed. If `totalmem` is given (in MB, or True for
+    this machine's memory), a job is only started if its predicted peak memory
+    (`job.memory`, see `gemmpy/planner.py`) fits next to the running jobs; jobs
+    that don't fit yet are held back, and later jobs that do fit are started
+    first. If `cache` is a `RunCache` (or True, to use
+    the default cache), jobs whose results already exist are skipped. If
+    `watchdog` is a `Watchdog` (or a list of rules, see `gemmpy/watchdog.py`),
+    jobs are stopped as soon as one of its rules fires. If `catalogue` is a
+    `Catalogue` (or True, to use the default), every job is registered in it
+    (see `gemmpy/catalogue.py`). If `profile` is set, the resource use of each
+    job is sampled every `profile` seconds, and summarised per swept parameter
+    at the end (see `gemmpy/resources.py`). If `compact` is a `Compactor` (or
+    True, to use the defaults), the output folder of every successful job is
+    compacted in the background (see `gemmpy/compact.py`).
+    """
+
+    def __init__(self, maxjobs=None, maxmem=None, maxcpu=None, cache=None, watchdog=None,
+                 catalogue=None, profile=None, totalmem=None, compact=None, interval=0.5):
+        self.maxjobs = maxjobs if maxjobs else os.cpu_count()
+        self.maxmem = maxmem
+        self.maxcpu = maxcpu
+        self.totalmem = gemmpy.resources.total_memory() if totalmem is True else totalmem
+        self.cache = RunCache() if cache is True else cache
+        self.watchdog = gemmpy.watchdog.Watchdog(watchdog) if isinstance(watchdog, list) else watchdog
+        self.catalogue = gemmpy.catalogue.Catalogue() if catalogue is True else catalogue
+        self.profile = profile
+        self.compactor = gemmpy.compact.Compactor() if compact is True else compact
+        self.interval = interval
+        self.running = {} # maps processes to (job, start time)
+        self.watches = {} # maps processes to their watchdog state
+        self.samplers = {} # maps processes to their resource samplers
+        self.peaks = {} # maps processes to their peak RSS so far
+        self.held = [] # jobs waiting for memory to become free
+        self.results = []
+        self.skipped = 0
+
+    def launch(self, job):
+        "Start a job in a new process."
+        preexec = limit_cpu(int(self.maxcpu)) if self.maxcpu else None
+        if self.catalogue:
+            self.catalogue.register(job)
+        proc = subprocess.Popen(job.command(), preexec_fn=preexec)
+        self.running[proc] = (job, time.time())
+        if self.watchdog:
+            self.watches[proc] = self.watchdog.watch(job)
+        if self.profile:
+            self.samplers[proc] = gemmpy.resources.RunSampler(proc.pid, job.dest, self.profile)
+        return proc
+
+    def stop(self, proc, timeout=10):
+        "Terminate a job's process (and kill it if it doesn't exit within `timeout` seconds)."
+        self.peaks[proc] = rss(proc.pid, "VmHWM") or self.peaks.get(proc)
+        proc.terminate()
+        deadline = time.time() + timeout
+        while not exited(proc) and time.time() < deadline:
+            time.sleep(0.1)
+        if not exited(proc):
+            proc.kill()
+
+    def finish(self, proc, status=None):
+        "Record the result of a job whose process has terminated."
+        job, start = self.running.pop(proc)
+        self.watches.pop(proc, None)
+        sampler = self.samplers.pop(proc, None)
+        peak = self.peaks.pop(proc, None)
+        returncode, usage = reap(proc)
+        if status is None:
+            if returncode == 0:
+                status = "done"
+            elif returncode == -signal.SIGXCPU:
+                status = "killed (cpu time)"
+            else:
+                status = "failed"
+        # The `ru_maxrss` of a child includes the memory of the launcher it was forked
+        # from, so it is only used if the job ended before its peak could be read.
+        if not peak and usage:
+            peak = usage.ru_maxrss / 1024
+        result = Result(job, status, returncode, start, time.time(), peak)
+        if usage:
+            result.cputime = usage.ru_utime + usage.ru_stime
+        if sampler:
+            result.samples = sampler.samples
+        self.results.append(result)
+        if self.cache and status in ("done", "terminated-early"):
+            self.cache.store(job, status)
+        if self.catalogue:
+            self.catalogue.finish(result)
+        if self.compactor and status in ("done", "terminated-early"):
+            self.compactor.submit(job.dest)
+        if status not in ("done", "terminated-early"):
+            print("Job "+job.name+" "+status+" (exit code "+str(returncode)+").",
+                  file=sys.stderr)
+        return result
+
+    def check(self):
+        """
+        Reap finished jobs, sample the resource use of the others, kill those
+        that exceed the memory limit, and stop those that the watchdog has given up on.
+        The peak memory of each job is read from `/proc` (`VmHWM`) while it runs.
+        """
+        for proc in list(self.running.keys()):
+            if exited(proc):
+                self.finish(proc)
+                continue
+            self.peaks[proc] = rss(proc.pid, "VmHWM") or self.peaks.get(proc)
+            if proc in self.samplers:
+                self.samplers[proc].sample()
+            if self.maxmem and rss(proc.pid) > self.maxmem:
+                proc.kill()
+                self.finish(proc, "killed (memory)")
+            elif self.watches.get(proc):
+                rule = self.watches[proc].check()
+                if rule:
+                    print("Stopping job "+self.running[proc][0].name+" early ("+rule+").")
+                    self.stop(proc)
+                    self.finish(proc, "terminated-early")
+
+    def fits(self, job):
+        "Check whether a job's predicted memory fits next to the running jobs."
+        if not self.totalmem or not job.memory or not self.running:
+            return True
+        used = sum(max(j.memory or 0, rss(proc.pid)) for proc, (j, start) in self.running.items())
+        return used + job.memory <= self.totalmem
+
+    def run(self, jobs):
+        """
+        Run all jobs and wait until they have finished. `jobs` may be any iterable
+        (including a generator); it is only consumed when a slot becomes free.
+        Returns a list of results.
+        """
+        queue = iter(jobs)
+        t0 = time.time()
+        exhausted = False
+        try:
+            while not exhausted or self.running or self.held:
+                for job in list(self.held):
+                    if len(self.running) < self.maxjobs and self.fits(job):
+                        self.held.remove(job)
+                        self.launch(job)
+                while (not exhausted and len(self.running) < self.maxjobs
+                       and len(self.held) < self.maxjobs):
+                    job = next(queue, None)
+                    if job is None:
+                        exhausted = True
+                    elif self.cache and self.cache.skip(job):
+                        self.skipped += 1
+                    elif self.fits(job):
+                        self.launch(job)
+                    else:
+                        self.held.append(job)
+                time.sleep(self.interval)
+                self.check()
+        except KeyboardInterrupt:
+            print("Interrupted, terminating "+str(len(self.running))+" running jobs.",
+                  file=sys.stderr)
+            for proc in list(self.running.keys()):
+                proc.terminate()
+                self.finish(proc, "killed (interrupt)")
+            raise
+        finally:
+            if self.compactor:
+                self.compactor.wait()
+            self.report(time.time() - t0)
+        return self.results
+
+    def report(self, elapsed):
+        "Print a throughput summary for all jobs run so far."
+        if self.skipped:
+            print("Skipped "+str(self.skipped)+" jobs with cached results.")
+        summarise(self.results, elapsed)
+        if self.profile:
+            gemmpy.resources.report(self.results, self.maxjobs)
+
+
+def summarise(results, elapsed):
+    "Print the throughput (jobs/hour and mean wall time) of a set of results."
+    n = len(results)
+    if n == 0:
+        print("No jobs were run.")
+        return
+    failed = len([r for r in results if r.status not in ("done", "terminated-early")])
+    early = len([r for r in results if r.status == "terminated-early"])
+    meanwall = sum(r.walltime for r in results) / n
+    print("Ran "+str(n)+" jobs ("+str(failed)+" unsuccessful"+
+          (", "+str(early)+" terminated early" if early else "")+") in "+format_duration(elapsed)+
+          ": "+str(round(n / (elapsed / 3600), 2))+" jobs/hour, mean wall time "+
+          format_duration(meanwall)+".")
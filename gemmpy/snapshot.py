@@ -0,0 +1,198 @@
+##
+## A content-addressed store of the code that runs depend on, replacing the
+## tarballs that the launchers used to write on every invocation. Each file is
+## stored once, zstd-compressed and named by the SHA-256 hash of its contents,
+## in `snapshots/objects`. A snapshot is a manifest mapping file paths to hashes
+## (plus the git commit), named by the hash of the manifest itself, so launching
+## with unchanged code adds nothing but a line to `snapshots/launches.tsv`.
+## Hashes are cached by file size and modification time, so unchanged files
+## (like the large map files) are not even read again. The catalogue records the
+## snapshot of every run (see `gemmpy/catalogue.py`).
+##
+## Usage: python3 -m gemmpy.snapshot take <file or pattern> [...]
+##        python3 -m gemmpy.snapshot list
+##        python3 -m gemmpy.snapshot show <snapshot>
+##        python3 -m gemmpy.snapshot diff <snapshot> <snapshot>
+##        python3 -m gemmpy.snapshot restore <snapshot> <folder>
+##
+## Snapshots can be given by any unique prefix of their ID.
+##
+
+import os, sys, glob, json, time, hashlib, argparse
+
+import zstandard
+
+from gemmpy import cache
+
+STORE = "snapshots"
+HASHES = "hashes.json" # file hashes, keyed on path, size and modification time
+LAUNCHES = "launches.tsv"
+
+_current = None
+
+## AUXILIARY FUNCTIONS
+
+def expand(patterns):
+    "Expand a list of files, folders and glob patterns into a sorted list of files."
+    files = set()
+    for pattern in patterns:
+        for path in glob.glob(pattern) or []:
+            if os.path.isdir(path):
+                for root, dirs, names in os.walk(path, followlinks=True):
+                    files.update(os.path.join(root, n) for n in names)
+            elif os.path.isfile(path):
+                files.add(path)
+    return sorted(os.path.normpath(f) for f in files)
+
+def object_path(store, digest):
+    return os.path.join(store, "objects", digest[:2], digest+".zst")
+
+def manifest_path(store, ident):
+    return os.path.join(store, "manifests", ident+".json")
+
+def current():
+    "The ID of the snapshot taken by this launcher (None if there is none)."
+    return _current
+
+
+## THE STORE
+
+class SnapshotStore:
+    "A store of file contents and snapshot manifests in the folder `path`."
+
+    def __init__(self, path=STORE):
+        self.path = path
+        hashfile = os.path.join(path, HASHES)
+        self.hashes = json.load(open(hashfile)) if os.path.exists(hashfile) else {}
+        self.changed = False
+
+    def hash(self, filename):
+        "Hash a file, unless its size and modification time are unchanged since the last time."
+        st = os.stat(filename) # follows symlinks, like `tar h`
+        state = [st.st_size, st.st_mtime_ns]
+        entry = self.hashes.get(filename)
+        if entry and entry[:2] == state:
+            return entry[2]
+        digest = cache.file_hash(filename)
+        self.hashes[filename] = state + [digest]
+        self.changed = True
+        return digest
+
+    def add(self, filename, digest):
+        "Store the contents of a file (unless they are already stored). Returns true if they weren't."
+        target = object_path(self.path, digest)
+        if os.path.exists(target):
+            return False
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(filename, "rb") as src, open(target+".tmp", "wb") as dst:
+            zstandard.ZstdCompressor(level=10).copy_stream(src, dst)
+        os.replace(target+".tmp", target)
+        return True
+
+    def take(self, patterns, command=None):
+        """
+        Snapshot the files matching `patterns`. Only contents that are not in the
+        store yet are added. The launch is recorded with its `command` line.
+        Returns the snapshot ID and the number of newly stored files.
+        """
+        files = {}
+        added = 0
+        for f in expand(patterns):
+            files[f] = self.hash(f)
+            added += self.add(f, files[f])
+        manifest = {"commit":cache.git_commit(), "files":files}
+        text = json.dumps(manifest, sort_keys=True, indent=1)
+        ident = hashlib.sha256(text.encode()).hexdigest()
+        target = manifest_path(self.path, ident)
+        if not os.path.exists(target):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(target+".tmp", "w") as f:
+                f.write(text)
+            os.replace(target+".tmp", target)
+        if self.changed:
+            with open(os.path.join(self.path, HASHES+".tmp"), "w") as f:
+                json.dump(self.hashes, f)
+            os.replace(os.path.join(self.path, HASHES+".tmp"), os.path.join(self.path, HASHES))
+            self.changed = False
+        with open(os.path.join(self.path, LAUNCHES), "a") as f:
+            f.write("\t".join([time.strftime("%Y-%m-%d %H:%M:%S"), ident,
+                               command if command else ""])+"\n")
+        return ident, added
+
+    def resolve(self, prefix):
+        "Find the snapshot with the given ID prefix (raises a ValueError unless there is exactly one)."
+        found = [os.path.basename(m)[:-len(".json")]
+                 for m in glob.glob(manifest_path(self.path, prefix+"*"))]
+        if len(found) != 1:
+            raise ValueError(("No" if not found else "More than one")+" snapshot "+prefix+".")
+        return found[0]
+
+    def manifest(self, ident):
+        with open(manifest_path(self.path, self.resolve(ident))) as f:
+            return json.load(f)
+
+    def launches(self):
+        "List the recorded launches as (time, snapshot ID, command) tuples."
+        path = os.path.join(self.path, LAUNCHES)
+        if not os.path.exists(path):
+            return []
+        with open(path) as f:
+            return [tuple(line.rstrip("\n").split("\t")) for line in f if line.strip()]
+
+    def restore(self, ident, folder):
+        "Write the files of a snapshot into a folder. Returns the list of files."
+        files = self.manifest(ident)["files"]
+        dctx = zstandard.ZstdDecompressor()
+        for name, digest in sorted(files.items()):
+            target = os.path.join(folder, name)
+            os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+            with open(object_path(self.path, digest), "rb") as src, open(target, "wb") as dst:
+                dctx.copy_stream(src, dst)
+            if cache.file_hash(target) != digest:
+                raise ValueError("The stored copy of "+name+" is corrupted.")
+        return sorted(files)
+
+
+def archive(patterns, store=STORE):
+    """
+    Snapshot the code of a launch (called by the launchers instead of writing a
+    tarball). Returns the snapshot ID, which is also recorded for all runs
+    registered in the catalogue from now on.
+    """
+    global _current
+    t0 = time.time()
+    _current, added = SnapshotStore(store).take(patterns, " ".join(sys.argv))
+    print("Code snapshot "+_current[:12]+" ("+(str(added)+" new files" if added else "unchanged")+
+          ", "+str(round(time.time() - t0, 2))+" s).")
+    return _current
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Take, inspect and restore code snapshots.")
+    parser.add_argument("command", choices=["take", "list", "show", "diff", "restore"])
+    parser.add_argument("args", nargs="*", help="files/patterns (take), snapshots, or a folder (restore)")
+    parser.add_argument("-s", "--store", default=STORE, help="the snapshot store (default: "+STORE+")")
+    args = parser.parse_args()
+    store = SnapshotStore(args.store)
+    if args.command == "take":
+        archive(args.args, args.store)
+    elif args.command == "list":
+        for launched, ident, command in store.launches():
+            print(launched+"  "+ident[:12]+"  "+command)
+    elif args.command == "show":
+        manifest = store.manifest(args.args[0])
+        print("commit "+manifest["commit"])
+        for name, digest in sorted(manifest["files"].items()):
+            print(digest[:12]+"  "+name)
+    elif args.command == "diff":
+        old, new = (store.manifest(a)["files"] for a in args.args[:2])
+        for name in sorted(set(old) | set(new)):
+            if name not in new:
+                print("removed  "+name)
+            elif name not in old:
+                print("added    "+name)
+            elif old[name] != new[name]:
+                print("changed  "+name)
+    else:
+        for name in store.restore(args.args[0], args.args[1]):
+            print("Restored "+name)
@@ -0,0 +1,170 @@
+##
+## Build habitat succession map series (like the Chyulu maps of the phylogeny
+## study) directly from a stack of GeoTIFF rasters, one raster or band per epoch.
+## Cells are converted as in `Create_Maps_Chyulu_Hill_Succession.R`. The first epoch
+## is written as a full map, every later epoch as a change set that only lists the
+## cells that differ from the epoch before (marked by `<timesteps> update` on its
+## timestep line, see `readmapfile`). Existing series of full maps can be
+## converted to change sets, too.
+##
+## Usage: python3 -m gemmpy.succession rasters <epoch.tif> [...] [-o <dir>] [-t <timesteps>]
+##        python3 -m gemmpy.succession maps <map> [...] [-o <dir>]
+##        python3 -m gemmpy.succession check <map> [...]
+##
+
+import os, sys, argparse
+import numpy as np
+
+from gemmpy import mapformat
+
+## RASTERS
+
+def read_rasters(files):
+    """
+    Read a stack of GeoTIFF files into a list of arrays, one per band, with nodata
+    cells set to NaN. Returns the arrays and a name for each epoch.
+    """
+    import rasterio # only needed for this function
+    epochs, names, grid = [], [], None
+    for f in files:
+        with rasterio.open(f) as src:
+            if grid is None:
+                grid = (src.shape, src.transform)
+            elif (src.shape, src.transform) != grid:
+                raise ValueError(f+" does not have the same grid as "+files[0]+".")
+            base = os.path.splitext(os.path.basename(f))[0]
+            for band, values in enumerate(src.read(masked=True), 1):
+                epochs.append(values.astype(np.float64).filled(np.nan))
+                names.append(base+(".map" if src.count == 1 else "_"+str(band)+".map"))
+    return epochs, names
+
+def capacity(cover, lucky=None):
+    """
+    Calculate the carrying capacity from the forest cover as in
+    `Create_Maps_Chyulu_Hill_Succession.R`: two individuals per percent cover,
+    or none below two, except in the `lucky` cells, which get two. (The R script
+    draws these cells anew for every map, so cells differ between epochs that
+    haven't changed. Here, they are drawn once for the whole series.)
+    """
+    cc = np.floor(cover) * 2
+    minimum = np.where(lucky, 2, 0) if lucky is not None else 0
+    return np.where(cc >= 2, cc, minimum)
+
+def raster_map(cover, name, timesteps=5000, lucky=None, temp=293):
+    "Convert a forest cover raster to a map (nodata cells are left out)."
+    nrows, ncols = cover.shape
+    values = cover.ravel()
+    valid = ~np.isnan(values)
+    cover = values[valid]
+    cells = {"id":np.arange(1, nrows * ncols + 1)[valid],
+             "x":np.tile(np.arange(1, ncols + 1), nrows)[valid],
+             "y":np.repeat(np.arange(1, nrows + 1), ncols)[valid],
+             "temp":np.full(len(cover), float(temp)),
+             "prec":np.round(cover, 2),
+             "capacity":capacity(cover, lucky.ravel()[valid] if lucky is not None else None),
+             "flags":np.where(cover > 0, 1 << mapformat.flag_names.index("initpop"), 0).astype(np.uint8)}
+    preamble = ["## ZOSTEROPS EXPERIMENT MAP", "", "# Timesteps", None, "",
+                "# Simulation arena - autogenerated by `gemmpy/succession.py`",
+                "", "# <id> <x> <y> <temperature> <forest cover> [parameters]"]
+    return mapformat.Map(name, timesteps, cells, preamble=preamble)
+
+def raster_series(files, timesteps=5000, lucky=0.01, seed=0):
+    "Convert a stack of GeoTIFF files to a series of full maps."
+    epochs, names = read_rasters(files)
+    mask = np.random.default_rng(seed).random(epochs[0].shape) < lucky if lucky else None
+    return [raster_map(cover, name, timesteps, mask) for cover, name in zip(epochs, names)]
+
+
+## CHANGE SETS
+
+def validate(maps):
+    """
+    Check that a series of full maps can be expressed as change sets: every map
+    runs for at least one timestep, and no cell is removed or reordered.
+    Raises a ValueError otherwise.
+    """
+    for i, m in enumerate(maps):
+        if m.changeset:
+            raise ValueError(m.name+" is already a change set.")
+        if m.timesteps is None or m.timesteps < 1:
+            raise ValueError(m.name+" has no valid number of timesteps.")
+        if len(np.unique(m.cells["id"])) != len(m):
+            raise ValueError(m.name+" has duplicate cell IDs.")
+        if i == 0:
+            continue
+        delta = mapformat.diff(maps[i-1], m)
+        if delta is None:
+            raise ValueError(m.name+" lists its cells in a different order than "+maps[i-1].name+".")
+        if len(delta[1]) > 0:
+            raise ValueError(m.name+" removes "+str(len(delta[1]))+" cells of "+maps[i-1].name+".")
+
+def changeset(old, new):
+    "Return the minimal change set that turns map `old` into map `new`."
+    rows, removed = mapformat.diff(old, new)
+    cells = {c: new.cells[c][rows] for c in mapformat.cell_columns}
+    extra = {i: new.extra[r] for i, r in enumerate(rows.tolist()) if r in new.extra}
+    return mapformat.Map(new.name, new.timesteps, cells, extra, new.preamble, new.sep,
+                         changeset=True)
+
+def changesets(maps):
+    "Turn a validated series of full maps into its first map followed by change sets."
+    validate(maps)
+    return maps[:1] + [changeset(old, new) for old, new in zip(maps, maps[1:])]
+
+def expand(series):
+    "Turn a series of maps and change sets back into full maps (as `updateworld` does)."
+    maps = []
+    for m in series:
+        if not m.changeset:
+            maps.append(m)
+        elif not maps:
+            raise ValueError("The first map of a series can't be a change set ("+m.name+").")
+        else:
+            full = mapformat.apply_diff(maps[-1], m.name, m.timesteps, m.cells,
+                                        np.array([], dtype=np.int64), m.extra, m.preamble, m.sep)
+            maps.append(full)
+    return maps
+
+def write_series(series, outdir="."):
+    "Write a series of maps as text files. Returns the value for the `maps` setting."
+    os.makedirs(outdir, exist_ok=True)
+    mapfiles = []
+    for i, m in enumerate(series):
+        mapfile = os.path.join(outdir, m.name)
+        if mapfile in mapfiles: # a map that is used twice needs its own change set file
+            mapfile = os.path.splitext(mapfile)[0]+"_"+str(i+1)+".map"
+        mapfiles.append(mapfile)
+        mapformat.write_text(m, mapfile)
+    return ",".join(mapfiles)
+
+def report(series):
+    "Print the size of each epoch's change set."
+    for m in series:
+        print(m.name+": "+str(m.timesteps)+" timesteps, "+str(len(m))+
+              (" changed cells" if m.changeset else " cells"))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Build map series with per-epoch change sets.")
+    parser.add_argument("command", choices=["rasters", "maps", "check"])
+    parser.add_argument("files", nargs="+", help="GeoTIFF files or map files, in series order")
+    parser.add_argument("-o", "--outdir", default=".", help="output folder")
+    parser.add_argument("-t", "--timesteps", type=int, default=5000,
+                        help="number of timesteps per epoch (for rasters)")
+    parser.add_argument("-l", "--lucky", type=float, default=0.01,
+                        help="proportion of cells with a minimum capacity (for rasters)")
+    parser.add_argument("-s", "--seed", type=int, default=0,
+                        help="random seed for the minimum capacity cells (for rasters)")
+    args = parser.parse_args()
+    try:
+        if args.command == "rasters":
+            maps = raster_series(args.files, args.timesteps, args.lucky, args.seed)
+        else:
+            maps = expand([mapformat.read_text(f) for f in args.files])
+        series = changesets(maps)
+    except ValueError as e:
+        print("Invalid map series: "+str(e), file=sys.stderr)
+        sys.exit(1)
+    report(series)
+    if args.command != "check":
+        print("maps "+write_series(series, args.outdir))
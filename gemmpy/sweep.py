@@ -0,0 +1,216 @@
+##
+## A declarative parameter sweep engine. A sweep is defined by a parameter space
+## (a dict mapping setting names to lists of values or continuous ranges) and a
+## design (full grid, Latin hypercube, Sobol or random sampling). Points and jobs
+## are generated lazily, so even designs with millions of points can be streamed
+## into a bounded scheduler without writing every config up front.
+##
+
+import itertools, random
+
+## PARAMETER SPACE
+
+class Range:
+    """
+    A continuous parameter range from `low` to `high`. With `log=True`, values are
+    sampled uniformly on a log scale; with `integer=True`, they are rounded.
+    Ranges can only be used with sampling designs, not with a full grid.
+    """
+
+    def __init__(self, low, high, log=False, integer=False):
+        if log and (low <= 0 or high <= 0):
+            raise ValueError("Log-scaled ranges must be positive.")
+        self.low = low
+        self.high = high
+        self.log = log
+        self.integer = integer
+
+    def value(self, u):
+        "Map a number `u` from the unit interval onto this range."
+        if self.log:
+            v = self.low * (self.high / self.low) ** u
+        else:
+            v = self.low + u * (self.high - self.low)
+        return int(round(v)) if self.integer else v
+
+    def __repr__(self):
+        return "Range("+str(self.low)+", "+str(self.high)+")"
+
+
+def scale(values, u):
+    "Map a number `u` from the unit interval onto a list of values or a range."
+    if isinstance(values, Range):
+        return values.value(u)
+    return values[min(int(u * len(values)), len(values) - 1)]
+
+
+## DESIGNS
+
+def check_grid(space):
+    "Make sure that a full grid can be built over the parameter space."
+    for key, values in space.items():
+        if isinstance(values, Range):
+            raise ValueError("Cannot build a full grid over the continuous range "+key+".")
+
+def grid_points(space):
+    "Generate every combination of the values in the parameter space."
+    check_grid(space)
+    keys = list(space.keys())
+    for combination in itertools.product(*[space[k] for k in keys]):
+        yield dict(zip(keys, combination))
+
+def random_points(space, n, seed=0):
+    "Generate `n` points sampled uniformly at random from the parameter space."
+    rng = random.Random(seed)
+    for i in range(n):
+        yield {k: scale(v, rng.random()) for k, v in space.items()}
+
+def mix(x):
+    "A fast 64-bit integer hash (the SplitMix64 finaliser)."
+    x = (x + 0x9e3779b97f4a7c15) & 0xffffffffffffffff
+    x = ((x ^ (x >> 30)) * 0xbf58476d1ce4e5b9) & 0xffffffffffffffff
+    x = ((x ^ (x >> 27)) * 0x94d049bb133111eb) & 0xffffffffffffffff
+    return x ^ (x >> 31)
+
+def permutation(n, key):
+    """
+    Return a pseudo-random permutation of range(n) as a function, without
+    storing it. (A small Feistel network with cycle walking.)
+    """
+    half = max(1, ((n - 1).bit_length() + 1) // 2)
+    mask = (1 << half) - 1
+    def permute(i):
+        while True:
+            left, right = i >> half, i & mask
+            for r in range(4):
+                left, right = right, left ^ (mix(right ^ (key * 4 + r) << half) & mask)
+            i = (left << half) | right
+            if i < n:
+                return i
+    return permute
+
+def latin_hypercube_points(space, n, seed=0):
+    """
+    Generate `n` points from a Latin hypercube design: for each parameter, every
+    one of `n` equally sized strata is sampled exactly once.
+    """
+    keys = list(space.keys())
+    rng = random.Random(seed)
+    perms = [permutation(n, mix(seed * 1000003 + d)) for d in range(len(keys))]
+    for i in range(n):
+        yield {k: scale(space[k], (perms[d](i) + rng.random()) / n)
+               for d, k in enumerate(keys)}
+
+# Sobol direction numbers for dimensions 2-21 (Joe & Kuo 2008, new-joe-kuo-6.21201):
+# (degree s, coefficient a, initial direction numbers m)
+SOBOL_DIRECTIONS = [
+    (1, 0, [1]), (2, 1, [1, 3]), (3, 1, [1, 3, 1]), (3, 2, [1, 1, 1]),
+    (4, 1, [1, 1, 3, 3]), (4, 4, [1, 3, 5, 13]), (5, 2, [1, 1, 5, 5, 17]),
+    (5, 4, [1, 1, 5, 5, 5]), (5, 7, [1, 1, 7, 11, 19]), (5, 11, [1, 1, 5, 1, 1]),
+    (5, 13, [1, 1, 1, 3, 11]), (5, 14, [1, 3, 5, 5, 31]), (6, 1, [1, 3, 3, 9, 7, 49]),
+    (6, 13, [1, 1, 1, 15, 21, 21]), (6, 16, [1, 3, 1, 13, 27, 49]),
+    (6, 19, [1, 1, 1, 15, 7, 5]), (6, 22, [1, 3, 1, 15, 13, 25]),
+    (6, 25, [1, 1, 5, 5, 19, 61]), (7, 1, [1, 3, 7, 11, 23, 15, 103]),
+    (7, 4, [1, 3, 7, 13, 13, 15, 69])]
+
+SOBOL_BITS = 32
+
+def sobol_directions(dim):
+    "Compute the direction numbers for dimension `dim` (counting from 0)."
+    if dim == 0:
+        return [1 << (SOBOL_BITS - i) for i in range(1, SOBOL_BITS + 1)]
+    s, a, m = SOBOL_DIRECTIONS[dim - 1]
+    v = [m[i] << (SOBOL_BITS - i - 1) for i in range(min(s, SOBOL_BITS))]
+    for i in range(s, SOBOL_BITS):
+        vi = v[i - s] ^ (v[i - s] >> s)
+        for k in range(1, s):
+            if (a >> (s - 1 - k)) & 1:
+                vi ^= v[i - k]
+        v.append(vi)
+    return v
+
+def sobol_points(space, n, skip=0):
+    """
+    Generate `n` points of a (non-scrambled) Sobol sequence, after skipping the
+    first `skip` points. Supports up to 21 parameters.
+    """
+    keys = list(space.keys())
+    if len(keys) > len(SOBOL_DIRECTIONS) + 1:
+        raise ValueError("Sobol designs support at most "+str(len(SOBOL_DIRECTIONS) + 1)+
+                         " parameters.")
+    if skip + n > 2 ** SOBOL_BITS:
+        raise ValueError("Too many points for a "+str(SOBOL_BITS)+"-bit Sobol sequence.")
+    directions = [sobol_directions(d) for d in range(len(keys))]
+    x = [0] * len(keys)
+    for i in range(skip + n):
+        if i >= skip:
+            yield {k: scale(space[k], x[d] / 2 ** SOBOL_BITS) for d, k in enumerate(keys)}
+        c = (~i & (i + 1)).bit_length() - 1 # index of the lowest zero bit of i
+        for d in range(len(keys)):
+            x[d] ^= directions[d][c]
+
+
+## SWEEPS
+
+class Sweep:
+    """
+    A parameter sweep over `space` (a dict of setting names to value lists or
+    `Range`s). `design` is one of "grid", "lhs", "sobol", or "random"; all designs
+    except the grid need the number of points `n`. `abbreviations` optionally maps
+    setting names to shorter labels for the run names.
+    """
+
+    designs = ("grid", "lhs", "sobol", "random")
+
+    def __init__(self, space, design="grid", n=None, seed=0, abbreviations=None):
+        if design not in self.designs:
+            raise ValueError("Unknown sweep design "+str(design)+".")
+        if design != "grid" and not n:
+            raise ValueError("The "+design+" design needs a number of points.")
+        if design == "grid":
+            check_grid(space)
+        self.space = space
+        self.design = design
+        self.n = n
+        self.seed = seed
+        self.abbreviations = abbreviations if abbreviations else {}
+
+    def __len__(self):
+        if self.design == "grid":
+            size = 1
+            for values in self.space.values():
+                size *= len(values)
+            return size
+        return self.n
+
+    def points(self):
+        "Generate the parameter combinations of this sweep, in a fixed order."
+        if self.design == "grid":
+            return grid_points(self.space)
+        elif self.design == "lhs":
+            return latin_hypercube_points(self.space, self.n, self.seed)
+        elif self.design == "sobol":
+            return sobol_points(self.space, self.n)
+        else:
+            return random_points(self.space, self.n, self.seed)
+
+    def runname(self, prefix, index, point, seed):
+        """
+        Return a deterministic name for a run. Grid runs are labelled by their
+        parameter values, sampled runs by their index in the design.
+        """
+        if self.design == "grid":
+            label = "_".join(self.abbreviations.get(k, k)+str(point[k]) for k in point)
+        else:
+            label = self.design+str(index).zfill(len(str(len(self) - 1)))
+        return prefix+"_"+label+"_"+str(seed)
+
+    def jobs(self, prefix, seeds, setup):
+        """
+        Lazily generate the jobs for this sweep, one per point and seed.
+        `setup(name, seed, **params)` must write the config file for a run and
+        return its job (cf. `setup_run` in the launcher scripts).
+        """
+        for seed in seeds:
+            for index, point in enumerate(self.points()):
+                yield setup(self.runname(prefix, index, point, seed), seed, **point)
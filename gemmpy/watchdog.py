@@ -0,0 +1,97 @@
+##
+## Stop runs early once their outcome is settled. A watchdog follows the
+## `diversity.log` of each running job (population, freespace, lineages, alpha,
+## beta, gamma) and applies a set of rules, such as "population == 0 for 10"
+## (the population has been extinct for ten outputs), "lineages == 1" or
+## "gamma unchanged for 50". When a rule fires, the scheduler stops the job and
+## records it as "terminated-early", and the freed slot goes to the next job.
+##
+
+import os, re, operator
+
+from gemmpy import monitor
+
+comparisons = {"==":operator.eq, "!=":operator.ne, "<":operator.lt,
+               "<=":operator.le, ">":operator.gt, ">=":operator.ge}
+
+## RULES
+
+class Rule:
+    """
+    A condition on one column of `diversity.log` that has to hold for `outputs`
+    consecutive outputs. `test` is a comparison operator (with `value`), or
+    "unchanged" (the value is the same as in the previous output).
+    """
+
+    def __init__(self, column, test, value=None, outputs=1):
+        if column not in monitor.diversity_columns:
+            raise ValueError("Unknown diversity.log column: "+column)
+        if test != "unchanged" and test not in comparisons:
+            raise ValueError("Unknown test: "+test)
+        self.column = column
+        self.test = test
+        self.value = value
+        self.outputs = outputs
+
+    def holds(self, row, previous):
+        "Check the condition for one output (`previous` is the output before, or None)."
+        if self.test == "unchanged":
+            return previous is not None and row[self.column] == previous[self.column]
+        return comparisons[self.test](row[self.column], self.value)
+
+    def __str__(self):
+        text = self.column+" "+self.test
+        if self.test != "unchanged":
+            text += " "+("%g" % self.value)
+        return text+(" for "+str(self.outputs) if self.outputs != 1 else "")
+
+def parse_rule(text):
+    """
+    Parse a rule written as "<column> <op> <value> [for <n>]" or
+    "<column> unchanged for <n>" (counted in outputs, see `outfreq`).
+    """
+    match = re.match(r"^\s*(\w+)\s+(==|!=|<=|>=|<|>)\s+([-+.\deE]+)(?:\s+for\s+(\d+))?\s*$", text)
+    if match:
+        return Rule(match.group(1), match.group(2), float(match.group(3)),
+                    int(match.group(4) or 1))
+    match = re.match(r"^\s*(\w+)\s+unchanged\s+for\s+(\d+)\s*$", text)
+    if match:
+        return Rule(match.group(1), "unchanged", None, int(match.group(2)))
+    raise ValueError("Invalid watchdog rule: "+text)
+
+
+## WATCHING RUNS
+
+class RunWatch:
+    "Apply the rules to the `diversity.log` of one run as it is written."
+
+    def __init__(self, rundir, rules):
+        self.tail = monitor.LogTail(os.path.join(rundir, "diversity.log"))
+        self.rules = rules
+        self.counts = [0] * len(rules)
+        self.previous = None
+
+    def check(self):
+        "Read the new outputs. Returns the rule that fired (as text), or None."
+        for line in self.tail.read():
+            row = monitor.parse_diversity(line)
+            if row is None:
+                continue
+            for i, rule in enumerate(self.rules):
+                self.counts[i] = self.counts[i] + 1 if rule.holds(row, self.previous) else 0
+            self.previous = row
+            for i, rule in enumerate(self.rules):
+                if self.counts[i] >= rule.outputs:
+                    return str(rule)
+        return None
+
+
+class Watchdog:
+    "A set of rules (`Rule` objects or their text form) that is applied to every job."
+
+    def __init__(self, rules):
+        self.rules = [parse_rule(r) if isinstance(r, str) else r for r in rules]
+
+    def watch(self, job):
+        "Start watching a job (returns None if the job has no output directory)."
+        return RunWatch(job.dest, self.rules) if job.dest else None
@@ -0,0 +1,201 @@
+##
+## A pool of warm Julia workers (`rungemmworker.jl`). Each worker loads GeMM once
+## and then runs jobs sent to it over a pipe, so short runs don't each pay for
+## package loading and compilation. GeMM clears its global state (species
+## archetypes, cached world size, invasion species pool) at the start of every
+## run (`resetstate!`), so jobs with different settings or maps can share a
+## worker. Works as a drop-in for `scheduler.Scheduler`.
+##
+
+import os, sys, time, queue, threading, subprocess
+
+import gemmpy.watchdog, gemmpy.catalogue, gemmpy.resources, gemmpy.compact
+from gemmpy.cache import RunCache
+from gemmpy.scheduler import Result, format_duration, summarise
+
+TAG = "GEMMWORKER"
+
+class Worker:
+    "A single Julia worker process."
+
+    def __init__(self):
+        t0 = time.time()
+        self.messages = queue.Queue()
+        self.proc = subprocess.Popen(["julia", "rungemmworker.jl"], stdin=subprocess.PIPE,
+                                     stdout=subprocess.PIPE, text=True, bufsize=1)
+        self.reader = threading.Thread(target=self.read, daemon=True)
+        self.reader.start()
+        self.fresh = True
+        msg = self.receive()
+        if msg is None or msg[0] != "READY":
+            raise RuntimeError("Julia worker failed to start (exit code "+
+                               str(self.proc.poll())+").")
+        self.startup = time.time() - t0
+
+    def read(self):
+        "Forward simulation output to stdout and worker messages to the queue."
+        for line in self.proc.stdout:
+            if line.startswith(TAG+"\t"):
+                self.messages.put(line.rstrip("\n").split("\t")[1:])
+            else:
+                sys.stdout.write(line)
+        self.messages.put(None) # the worker has exited
+
+    def receive(self):
+        "Wait for the next message from the worker (None if it died)."
+        return self.messages.get()
+
+    def run(self, job, watch=None, profile=None, interval=0.5):
+        """
+        Run a job on this worker. Returns a result with the time split into
+        `startup` (worker startup on its first job, plus dispatch overhead) and
+        `simtime` (time spent inside the simulation). If `watch` (see
+        `gemmpy/watchdog.py`) fires, the worker is stopped and has to be replaced.
+        If `profile` is set, the worker's resource use is sampled every `profile`
+        seconds while it runs the job (see `gemmpy/resources.py`).
+        """
+        start = time.time()
+        sampler = gemmpy.resources.RunSampler(self.proc.pid, job.dest, profile) if profile else None
+        seed = job.seed if job.seed is not None else 0
+        try:
+            self.proc.stdin.write("RUN\t"+job.config+"\t"+str(seed)+"\n")
+            self.proc.stdin.flush()
+        except BrokenPipeError:
+            pass
+        rule = None
+        while watch or sampler:
+            try:
+                msg = self.messages.get(timeout=interval)
+                break
+            except queue.Empty:
+                if sampler:
+                    sampler.sample()
+                rule = watch.check() if watch else None
+                if rule:
+                    print("Stopping job "+job.name+" early ("+rule+").")
+                    self.proc.terminate()
+                    break
+        if not (watch or sampler) or rule:
+            msg = self.receive()
+        end = time.time()
+        if sampler:
+            sampler.sample(force=True)
+        if msg is None:
+            status = "terminated-early" if rule else "failed"
+            result = Result(job, status, self.proc.wait(), start, end)
+            result.simtime = end - start
+        else:
+            result = Result(job, msg[2], 0 if msg[2] == "done" else 1, start, end)
+            result.simtime = float(msg[3])
+        if sampler:
+            result.samples = sampler.samples
+            result.cputime = sampler.cputime()
+            result.maxrss = sampler.maxrss() # the worker's peak while running this job
+        result.startup = (result.walltime - result.simtime)
+        if self.fresh:
+            result.startup += self.startup
+            self.fresh = False
+        return result
+
+    def alive(self):
+        return self.proc.poll() is None
+
+    def stop(self):
+        "Shut down the worker once it has finished its current job."
+        if self.alive():
+            self.proc.stdin.close()
+            self.proc.wait()
+
+
+class WorkerPool:
+    """
+    Run jobs on `nworkers` warm Julia workers (default: the number of CPU cores).
+    Workers that crash (e.g. after a GeMM error) are replaced automatically.
+    `cache`, `watchdog`, `catalogue`, `profile` and `compact` work as for `scheduler.Scheduler`
+    (but the peak memory of a job is only known if it is profiled, as the workers
+    are shared).
+    """
+
+    def __init__(self, nworkers=None, cache=None, watchdog=None, catalogue=None, profile=None,
+                 compact=None):
+        self.nworkers = nworkers if nworkers else os.cpu_count()
+        self.cache = RunCache() if cache is True else cache
+        self.watchdog = gemmpy.watchdog.Watchdog(watchdog) if isinstance(watchdog, list) else watchdog
+        self.catalogue = gemmpy.catalogue.Catalogue() if catalogue is True else catalogue
+        self.profile = profile
+        self.compactor = gemmpy.compact.Compactor() if compact is True else compact
+        self.lock = threading.Lock()
+        self.results = []
+        self.skipped = 0
+
+    def serve(self, jobs):
+        "Keep one worker busy with jobs until the queue is empty."
+        worker = None
+        try:
+            while True:
+                with self.lock:
+                    job = next(jobs, None)
+                    if job is None:
+                        break
+                    if self.cache and self.cache.skip(job):
+                        self.skipped += 1
+                        continue
+                if self.catalogue:
+                    self.catalogue.register(job)
+                if worker is None or not worker.alive():
+                    try:
+                        worker = Worker()
+                    except RuntimeError as e:
+                        print(str(e), file=sys.stderr)
+                        worker = None
+                if worker is None:
+                    now = time.time()
+                    result = Result(job, "failed", None, now, now)
+                    result.startup, result.simtime = 0, 0
+                else:
+                    result = worker.run(job, self.watchdog.watch(job) if self.watchdog else None,
+                                        self.profile)
+                if result.status not in ("done", "terminated-early"):
+                    print("Job "+job.name+" "+result.status+".", file=sys.stderr)
+                with self.lock:
+                    self.results.append(result)
+                    if self.cache and result.status in ("done", "terminated-early"):
+                        self.cache.store(job, result.status)
+                    if self.compactor and result.status in ("done", "terminated-early"):
+                        self.compactor.submit(job.dest)
+                if self.catalogue:
+                    self.catalogue.finish(result)
+        finally:
+            if worker:
+                worker.stop()
+
+    def run(self, jobs):
+        "Run all jobs and wait until they have finished. Returns a list of results."
+        jobs = iter(jobs)
+        t0 = time.time()
+        threads = [threading.Thread(target=self.serve, args=(jobs,))
+                   for i in range(self.nworkers)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        if self.compactor:
+            self.compactor.wait()
+        self.report(time.time() - t0)
+        return self.results
+
+    def report(self, elapsed):
+        "Print the per-job startup and simulation times and a throughput summary."
+        for r in self.results:
+            print(r.job.name+": startup "+format_duration(r.startup)+
+                  ", simulation "+format_duration(r.simtime))
+        if self.results:
+            startup = sum(r.startup for r in self.results)
+            simtime = sum(r.simtime for r in self.results)
+            print("Total startup "+format_duration(startup)+", total simulation "+
+                  format_duration(simtime)+".")
+        if self.skipped:
+            print("Skipped "+str(self.skipped)+" jobs with cached results.")
+        summarise(self.results, elapsed)
+        if self.profile:
+            gemmpy.resources.report(self.results, self.nworkers)
@@ -1,16 +1,25 @@
 #!/usr/bin/env julia
-#Robin - copy of rungemm.jl for debugging in VScode
-using BenchmarkTools 
+# Run a single benchmark case for the benchmark suite (see `gemmpy/benchmark.py`).
+# If a warm-up config is given, it is run first (usually the same settings on a
+# small map with a single timestep), so that compilation time is not included
+# in the timed run.
+#
+# Usage: julia rungemm_benchmark.jl <config> [<warm-up config>]
+# Prints: GEMMBENCH <simulation seconds> <bytes allocated> <GC seconds> <peak RSS in kB>
 
-thisDir = joinpath(pwd(), "src")
-any(path -> path == thisDir, LOAD_PATH) || push!(LOAD_PATH, thisDir)
 using Pkg
 Pkg.activate(".")
 using GeMM
 
-# remove od folder with results
-remove_old_results = `rm -r results/islsim_test`
-run(remove_old_results)
+config = ARGS[1]
+warmup = length(ARGS) > 1 ? ARGS[2] : ""
+empty!(ARGS) # `getsettings` would try to parse our arguments
 
-#run gemm directly from .config file
-rungemm("studies/islandradiation/islsim_test.config", 0)
\ No newline at end of file
+isempty(warmup) || GeMM.runsim(warmup)
+stats = @timed GeMM.runsim(config)
+# `Sys.maxrss()` would include the memory of the process we were forked from,
+# so read the peak from `/proc` instead (0 where that isn't available)
+hwm = isfile("/proc/self/status") ?
+    filter(l -> startswith(l, "VmHWM:"), readlines("/proc/self/status")) : []
+peakrss = isempty(hwm) ? 0 : parse(Int, split(hwm[1])[2])
+println("GEMMBENCH\t", stats.time, "\t", stats.bytes, "\t", stats.gctime, "\t", peakrss)
@@ -1,7 +1,11 @@
 #!/usr/bin/env julia
-# A very thin wrapper to start a GeMM simulation. If you need something fancier,
-# have a look at `rungemmparallel.jl`, or import the GeMM module into your own
-# wrapper script.
+# Run a GeMM simulation under the Julia profiler and save the flat and tree
+# reports as `<prefix>_flat.txt` and `<prefix>_tree.txt`. If a warm-up config
+# is given, it is run first without profiling, so that compilation doesn't show
+# up in the profile. (`gemmpy/profiling.py` uses this to profile any config.)
+#
+# Usage: julia rungemmprofile.jl [<config> [<output prefix> [<warm-up config>]]]
+# Without arguments, the island test config is profiled.
 
 thisDir = joinpath(pwd(), "src")
 any(path -> path == thisDir, LOAD_PATH) || push!(LOAD_PATH, thisDir)
@@ -10,17 +14,28 @@ Pkg.activate(".")
 using GeMM
 
 using Profile
-Profile.clear()
 
-rm("results/islsim_test/", recursive=true, force=true)
+config = length(ARGS) > 0 ? ARGS[1] : "studies/islandradiation/islsim_test.config"
+prefix = length(ARGS) > 1 ? ARGS[2] : "profile"
+warmup = length(ARGS) > 2 ? ARGS[3] : ""
+empty!(ARGS) # `getsettings` would try to parse our arguments
+
+seed = 0 # use the seed from the config
+if config == "studies/islandradiation/islsim_test.config"
+    rm("results/islsim_test/", recursive=true, force=true)
+    seed = 2
+end
+
+isempty(warmup) || GeMM.runsim(warmup)
 
-@profile rungemm("studies/islandradiation/islsim_test.config", 2)
+Profile.init(n = 10^7, delay = 0.005)
+Profile.clear()
+@profile rungemm(config, seed)
 
-open("profile_flat.txt", "w") do s
+open(prefix*"_flat.txt", "w") do s
     Profile.print(IOContext(s, :displaysize=>(300,145)), format=:flat, mincount=10, sortedby=:count)
 end
 
-open("profile_tree.txt", "w") do s
+open(prefix*"_tree.txt", "w") do s
     Profile.print(IOContext(s, :displaysize=>(300,300)), mincount=10)
 end
-
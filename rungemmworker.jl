@@ -0,0 +1,38 @@
+#!/usr/bin/env julia
+# A long-lived worker for the Python launchers (see `gemmpy/workers.py`).
+# GeMM is only loaded and compiled once; afterwards, the worker runs one
+# simulation after the other as it receives jobs on stdin. (`runsim` resets
+# GeMM's global state before each run, see `resetstate!`, so a job gives the
+# same result as in a fresh process with the same seed.)
+#
+# Protocol (one tab-separated message per line):
+#   stdin:   RUN <config> <seed>
+#   stdout:  GEMMWORKER READY
+#            GEMMWORKER DONE <config> <done|failed> <simulation seconds>
+# Any other output on stdout is normal simulation output.
+
+using Pkg
+Pkg.activate(".")
+using GeMM
+
+const TAG = "GEMMWORKER"
+
+println(TAG, "\tREADY")
+flush(stdout)
+
+for line in eachline(stdin)
+    msg = split(line, '\t')
+    (isempty(msg) || msg[1] != "RUN") && continue
+    config = String(msg[2])
+    seed = length(msg) > 2 ? parse(Int, msg[3]) : 0
+    status = "done"
+    simtime = @elapsed try
+        GeMM.runsim(config, seed)
+    catch e
+        showerror(stderr, e, catch_backtrace())
+        println(stderr)
+        status = "failed"
+    end
+    println(TAG, "\tDONE\t", config, "\t", status, "\t", simtime)
+    flush(stdout)
+end
@@ -197,15 +197,19 @@ function createworld(maptable::Array{Array{String,1},1})
 end
 
 """
-    updateworld(world, maptable, cellsize)
+    updateworld(world, maptable, changeset)
 
 Reinitialise the world from another parsed map file. Works analogously to 
 `createworld`. Intended for use in scenarios where the model world changes
 during a run (e.g. through global warming or island ontogeny).
 If the ID of an old patch matches the ID of a new patch, its community and
 seed bank are transferred to the new patch.
+If `changeset` is true, the map file only lists new or changed patches, and
+all other patches are kept as they are.
 """
-function updateworld(oldworld::Array{Patch,1}, maptable::Array{Array{String,1},1})
+function updateworld(oldworld::Array{Patch,1}, maptable::Array{Array{String,1},1},
+                     changeset::Bool=false)
+    changeset && return updatepatches(oldworld, maptable)
     simlog("Updating world...")
     newworld = Array{Patch}(undef, length(maptable))
     for entry in eachindex(maptable)
@@ -221,3 +225,33 @@ function updateworld(oldworld::Array{Patch,1}, maptable::Array{Array{String,1},1
     (setting("mode") == "zosterops") && findneighbours!(newworld)
     return newworld
 end
+
+"""
+    updatepatches(world, maptable)
+
+Apply a change set (cf. `readmapfile`) to the world: patches that are listed
+replace the old patch with the same ID (keeping its community and seed bank),
+patches with new IDs are added. Returns the updated world.
+"""
+function updatepatches(oldworld::Array{Patch,1}, maptable::Array{Array{String,1},1})
+    simlog("Updating $(length(maptable)) patches...")
+    newworld = copy(oldworld)
+    index = Dict(p.id => i for (i, p) in enumerate(oldworld))
+    for entry in eachindex(maptable)
+        newpatch = createpatch(maptable[entry])
+        if haskey(index, newpatch.id)
+            newpatch.community = oldworld[index[newpatch.id]].community
+            newpatch.seedbank = oldworld[index[newpatch.id]].seedbank
+            newworld[index[newpatch.id]] = newpatch
+        else
+            push!(newworld, newpatch)
+            index[newpatch.id] = length(newworld)
+        end
+    end
+    global newpatch = nothing # remove variable used in `createpatch()`
+    if setting("mode") == "zosterops"
+        foreach(p -> empty!(p.neighbours), newworld)
+        findneighbours!(newworld)
+    end
+    return newworld
+end
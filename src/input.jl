@@ -154,15 +154,21 @@ end
     readmapfile(mapfilename)
 
 Parse a map file and return the number of timesteps this map is to be used for
-(first line of the file) and the patch definitions. The latter is used by
-`createworld` and `updateworld!`.
+(first line of the file), the patch definitions, and whether the file is a
+change set. The patch definitions are used by `createworld` and `updateworld!`.
+
+A change set only lists the patches that differ from the previous map, and is
+marked by the keyword `update` after the number of timesteps (e.g. `5000 update`).
 """
 function readmapfile(mapfilename::String)
     simlog("Reading map file $mapfilename.")
+    changeset = false
     if isfile(mapfilename)
         maptable = basicparser(mapfilename)
         timesteps = parse(Int, maptable[1][1])
-        if length(maptable[1]) != 1 || !isa(timesteps, Integer)
+        if length(maptable[1]) == 2 && maptable[1][2] == "update"
+            changeset = true
+        elseif length(maptable[1]) != 1 || !isa(timesteps, Integer)
             timesteps = 10
             simlog("Invalid timestep information in the mapfile. Setting timesteps to 10.", 'w')
         end
@@ -171,5 +177,5 @@ function readmapfile(mapfilename::String)
         timesteps = 10
         maptable = [["",""], ["1", "1", "1", "initpop"], ["2", "2", "1"]]
     end
-    return timesteps,maptable[2:end]
+    return timesteps,maptable[2:end],changeset
 end
@@ -40,6 +40,16 @@ let speciespool = Individual[]
             patch.invasible && invade!(patch, setting("propagule-pressure"))
         end
     end
+
+    """
+        resetspeciespool!()
+
+    Empty the foreign species pool, so that the next simulation run in the same
+    process creates its own (cf. `resetstate!`).
+    """
+    global function resetspeciespool!()
+        empty!(speciespool)
+    end
 end
 
 
@@ -5,6 +5,7 @@ Performs a simulation run using configuration file `config`, random seed `seed`
 and other settings provided via commandline, configuration file or the defaults.
 """
 function runsim(config::String = "", seed::Integer = 0)
+    resetstate!()
     initsettings(defaultSettings()) #needed for log calls during `getsettings()`
     initsettings(getsettings(config, seed))
     Random.seed!(setting("seed"))
@@ -15,13 +16,14 @@ function runsim(config::String = "", seed::Integer = 0)
     correctmode!()
     for m in 1:length(setting("maps"))
         timeoffset += timesteps
-        timesteps, maptable = readmapfile(setting("maps")[m])
+        timesteps, maptable, changeset = readmapfile(setting("maps")[m])
         if m == 1
+            changeset && simlog("The first map file can't be a change set.", 'e')
             world = createworld(maptable)
             writedata(world, timeoffset)
             setting("fasta") != "off" && writefasta(world, timeoffset)
         else
-            world = updateworld(world, maptable)
+            world = updateworld(world, maptable, changeset)
         end
         simulate!(world, timesteps, timeoffset)
     end
@@ -29,6 +31,21 @@ function runsim(config::String = "", seed::Integer = 0)
 end
 
 
+"""
+    resetstate!()
+
+Clear the state that GeMM keeps between function calls (the Zosterops species
+archetypes, the world size cached by `coordinate`, and the invasion species pool).
+Called at the start of every `runsim`, so that several runs in one process
+(e.g. on a worker, see `rungemmworker.jl`) are independent of each other.
+"""
+function resetstate!()
+    resetzosteropsspecies!()
+    resetcoordinates!()
+    resetspeciespool!()
+    global newpatch = nothing
+end
+
 """
     rungemm(config, seed)
 
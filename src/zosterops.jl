@@ -88,6 +88,16 @@ let zosterops = Individual[] #holds the species archetypes
         bird.sex = sex
         return bird
     end
+
+    """
+        resetzosteropsspecies!()
+
+    Forget the species archetypes, so that they are created anew from the
+    settings of the next simulation run (cf. `resetstate!`).
+    """
+    global function resetzosteropsspecies!()
+        empty!(zosterops)
+    end
 end
 
 """
@@ -281,6 +291,16 @@ let width = 0, height = 0
         i = ((y-1) * width) + x
         return i
     end
+
+    """
+        resetcoordinates!()
+
+    Forget the world size cached by `coordinate`, so that it is recalculated
+    for the next world (cf. `resetstate!`).
+    """
+    global function resetcoordinates!()
+        width, height = 0, 0
+    end
 end
 
 """
@@ -7,16 +7,35 @@
 
 # NOTE: make sure to copy/symlink this to the model root folder before running
 
-import os, sys, shutil, time, random
+import os, sys, time, random, shutil
+
+sys.path.insert(0, os.getcwd()) # the shared launcher library `gemmpy` lives in the model root
+from gemmpy import scheduler, executors, snapshot
 
 global simname, replicates
 
 simname = "experiment"
 replicates = 1
 
+# Where to run the simulations (see `gemmpy/executors.py`). Runs are submitted as slurm
+# job arrays where slurm is available (e.g. on gaia), and started locally otherwise.
+# Can also be set with a commandline flag, e.g. `--local`, `--slurm` or `--mock`.
+backend = "slurm" if shutil.which("sbatch") else "local"
+
+# Resources per run for the slurm backend (see `gemmpy/executors.py`)
+slurm_settings = {"cpus":2, "mem":"50GB", "maxjobs":None, "wait":False}
+
+# Limits for running the jobs locally (see `gemmpy/scheduler.py`)
+scheduler_settings = {"maxjobs":os.cpu_count(), "cache":True, "catalogue":True}
+
+# The files that the runs depend on, recorded in the snapshot store at every launch
+# (see `gemmpy/snapshot.py`)
+code_files = ["README.md", "rungemmparallel.jl", "experiment.py", "analyse.R", "src"]
+
 # First commandline arg gives the simulation name, the second the number of replicates.
 # If the simname contains the string "default", or "default" is appended as a fourth
 # argument, the default simulation is run. Otherwise, an invasion experiment is set up.
+backend = executors.backend_option(sys.argv, backend)
 if len(sys.argv) >= 2:
     simname = sys.argv[1]
 if len(sys.argv) >= 3:
@@ -45,6 +64,9 @@ constant_settings = {"cellsize":2e6, # 2 tonnes/hectar -> default 20?
                      "burn-in": 500,
                      "global-species-pool":100}
 
+# The maps are referenced in place (relative to the model root, where the configs are written)
+mapdir = "studies/invasions/"
+
 # These settings are varied (the first value is the default,
 # every combination of the rest is tested)
 varying_settings = {"maps":["invasion.map",
@@ -54,23 +76,17 @@ varying_settings = {"maps":["invasion.map",
                     "disturbance":[0,1,10]}
 
 def archive_code():
-    "Save the current codebase in a tar archive."
-    tarname = time.strftime("codebase_%d%b%y.tar.gz")
-    print("Archiving codebase in "+tarname)
-    os.system("git log -1 > commit.txt")
-    cmd = "tar czfh "+tarname+" README.md commit.txt rungemmparallel.jl experiment.py analyse.R src/*"
-    os.system(cmd)
-    os.remove("commit.txt")
-
-def slurm(config):
-    "Send a job to slurm"
-    if "gaia" in os.uname().nodename:
-        cmd = "sbatch -c 2 --mem 50GB ./run_simulation.jl --config "+str(config)
-        os.system(cmd)
-        os.system("rm "+config) #cleanup
-        time.sleep(3) #prevent output folder merges
-    else:
-        print("Not on gaia, slurm is probably not available. Retaining job "+config)
+    "Record the current codebase in the snapshot store."
+    return snapshot.archive(code_files)
+
+def job(config, seed):
+    "Return the job for a config file (its output goes to `results/<config name>`)."
+    name = config.replace(".conf", "")
+    return scheduler.Job(name, config, "results/"+name, seed)
+
+def run_jobs(jobs):
+    "Run a set of jobs with the configured backend."
+    return executors.make_executor(backend, scheduler_settings, slurm_settings).run(jobs)
 
 def write_config(config, maps, mintemp, prop_pressure, disturbance, seed):
     "Write out a config file with the given values"
@@ -96,26 +112,24 @@ def run_defaults():
     "Create a series of runs with the default values (no invasion events)"
     global simname, replicates
     print("Running default simulation with "+str(replicates)+" replicates.")
-    if varying_settings["maps"][0] not in os.listdir():
-        shutil.copy("studies/invasions/"+varying_settings["maps"][0], ".")
-    write_config(simname+".conf",
-                 varying_settings["maps"][0],
-                 varying_settings["propagule-pressure"][0],
-                 varying_settings["disturbance"][0], 0)
-    i = 0
-    while i < replicates:
-        slurm(simname+".conf")
-        i = i+1
+    jobs = []
+    for i in range(replicates): # one config per replicate, so that each has its own output
+        config = simname+"_r"+str(i+1)+".conf"
+        seed = random.randint(0,100000)
+        write_config(config, mapdir+varying_settings["maps"][0], -1,
+                     varying_settings["propagule-pressure"][0],
+                     varying_settings["disturbance"][0], seed)
+        jobs.append(job(config, seed))
+    run_jobs(jobs)
 
 def run_experiment(control=False):
     "Create a full experiment with all parameter combinations"
     global simname, replicates
+    jobs = []
     i = 0
     while i < replicates:
         seed = random.randint(0,100000)
         for tm in varying_settings["maps"][1:]:
-            if tm not in os.listdir():
-                shutil.copy("studies/invasions/"+tm, ".")
             # figure out the range of optimum temperature
             if "hot" in tm: mt = 298
             elif "cold" in tm: mt = 278
@@ -129,12 +143,13 @@ def run_experiment(control=False):
                     print("Running simulation with specification "+spec+" for "
                           +str(replicates)+" replicates.")
                     runname = simname+"_r"+str(i+1)+"_"+spec
-                    write_config(runname+".conf", tm, mt, pp, db, seed)
-                    slurm(runname+".conf")
+                    write_config(runname+".conf", mapdir+tm, mt, pp, db, seed)
+                    jobs.append(job(runname+".conf", seed))
                     if control:
-                        write_config(runname+"_control.conf", tm, mt, 0, db, seed)
-                        slurm(runname+"_control.conf")
+                        write_config(runname+"_control.conf", mapdir+tm, mt, 0, db, seed)
+                        jobs.append(job(runname+"_control.conf", seed))
         i = i + 1
+    run_jobs(jobs)
     print("Done.")
 
 if __name__ == '__main__':
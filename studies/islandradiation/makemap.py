@@ -2,57 +2,29 @@
 
 # Create mapfiles for island speciation model
 # Ludwig Leidinger 2017 <l.leidinger@gmx.net>
+#
+# The map generation itself is done by `gemmpy/mapgen.py` (vectorised with NumPy),
+# which can also be used as a Python API. Use --seed for reproducible maps.
 
 import argparse
-import math
-import random
+import os
+import sys
 
-def print_map(xlen, ylen, landtype, xpos, ypos, ident, isol, precon):
-    print("#", landtype, ":")
-    mintemp = 273
-    maxtemp = 303
-    minprec = 0
-    maxprec = 10 if precon else minprec
-    if ylen > 1:
-        precstep = (maxprec - minprec) / (ylen)
-    else:
-        precstep = 1.0
-    temp = mintemp
-    if landtype == "continent":
-        landtype = ""
-        prec = 0
-        tempstep = round((maxtemp - mintemp) / xlen)
-        for x in range(xpos, xpos + xlen):
-            prec = 0
-            temp += tempstep
-            for y in range(ypos, ypos + ylen):
-                ident += 1
-                print(ident, " ", x, " ", y, " ", "temp=", temp, " ", "prec=", prec, " ", "initpot", sep = '')
-                prec += precstep
-    else:
-        landtype = "isisland"
-        temp = 298
-        tempstep = 1
-        precstep = 1
-        for x in range(xpos, xpos + xlen):
-            prec = 1
-            for y in range(ypos, ypos + ylen):
-                ident += 1
-                mindist = min([abs(x - xpos), abs(y - ypos), abs(xpos + xlen - x - 1), abs(ypos + ylen - y - 1)])
-                localtemp = temp - mindist * tempstep
-                isolated = "isolated" if random.random() < isol else ""
-                print(ident, " ", x, " ", y, " ", "temp=", localtemp, " ", "prec=", prec, " ", landtype, " ", isolated, sep ='')
-                prec += precstep
-    print()
+import numpy as np
 
-def add_ocean():
-    print("# dummy island:")
-    ident = 9999
-    temp = 1273
-    x = 1000
-    y = 0
-    print(ident, x, y, temp, "island")
-    print()
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", ".."))
+from gemmpy import mapgen
+
+def parse_landmass(spec, rng):
+    "Parse an additional landmass given as `<type>:<width>x<height>@<x>,<y>[:<isolation>]`."
+    parts = spec.split(":")
+    size, pos = parts[1].split("@")
+    width, height = map(int, size.split("x"))
+    x, y = map(int, pos.split(","))
+    if parts[0] == "continent":
+        return mapgen.continent(width, height, x, y)
+    isolation = float(parts[2]) if len(parts) > 2 else 0.0
+    return mapgen.island(width, height, x, y, isolation, rng)
 
 def print_all():
     parser = argparse.ArgumentParser()
@@ -76,12 +48,20 @@ def print_all():
                         help = "turns on additional environment niche")
     parser.add_argument("--nodummy", action = "store_true", default = False,
                         help = "turns off creation of dummy island. A dummy island ensures there is ocean.")
+    parser.add_argument("-a", "--add", type = str, action = "append", default = [],
+                        help = "additional landmass as <continent|island>:<width>x<height>@<x>,<y>[:<isolation>] (repeatable)")
+    parser.add_argument("-s", "--seed", type = int, default = None,
+                        help = "random seed for the isolated patches")
+    parser.add_argument("-o", "--output", type = str, default = "-",
+                        help = "output file (default: stdout)")
     args = parser.parse_args()
-    if args.time > 0:
-        print("# timesteps:")
-        print(args.time)
-        print()
-    print_map(args.width, args.height, args.land, args.longitute, args.latitude, args.identifier, args.isolation, args.precipitation)
-    args.land == "continent" and not args.nodummy and add_ocean()
+    rng = np.random.default_rng(args.seed)
+    if args.land == "continent":
+        land = mapgen.continent(args.width, args.height, args.longitute, args.latitude, args.precipitation)
+    else:
+        land = mapgen.island(args.width, args.height, args.longitute, args.latitude, args.isolation, rng)
+    landmasses = [land] + [parse_landmass(spec, rng) for spec in args.add]
+    mapgen.make_map(args.output, landmasses, args.time, args.identifier, not args.nodummy)
 
-print_all()
+if __name__ == '__main__':
+    print_all()
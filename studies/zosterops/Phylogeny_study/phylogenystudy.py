@@ -10,12 +10,18 @@
 
 import os, sys, shutil, time, subprocess
 
+sys.path.insert(0, os.getcwd()) # the shared launcher library `gemmpy` lives in the model root
+from gemmpy import scheduler, executors, planner, mapformat, replicates, snapshot, defaults
+
 ## PARAMETERS AND VARIABLES
 
+# The maps are referenced in place (relative to the model root, where the configs are written)
+mapdir = "studies/zosterops/Phylogeny_study/Chyulu_Taita_Maps/"
+
 # See `zosterops.config` for details
 default_settings = {
     # input/output settings
-    "maps":"Chyulu_25.map",
+    "maps":mapdir+"Chyulu_25.map",
     "outfreq":1000,
     "fastaoutfreq":10000,
     "logging":"true",
@@ -64,22 +70,60 @@ default_settings = {
 }
 
 alternate_speciations = ["ecological","neutral"]
-all_maps = "Chyulu_25.map,Chyulu_50.map,Chyulu_75.map,Chyulu_100.map,Chyulu_125.map,Chyulu_150.map,Chyulu_175.map,Chyulu_200.map,Chyulu_225.map,Chyulu_250.map,Chyulu_275.map,Chyulu_300.map,Chyulu_325.map,Chyulu_350.map,Chyulu_350.map,Chyulu_375.map,Chyulu_400.map,Chyulu_425.map,Chyulu_450.map,Chyulu_475.map,Chyulu_500.map,Chyulu_525.map,Chyulu_550.map,Chyulu_575.map,Chyulu_600.map,Chyulu_625.map,Chyulu_650.map,Chyulu_675.map,Chyulu_700.map,Chyulu_725.map,Chyulu_750.map"
+all_maps = ",".join(mapdir+m for m in
+                    ["Chyulu_25.map", "Chyulu_50.map", "Chyulu_75.map", "Chyulu_100.map", "Chyulu_125.map",
+                     "Chyulu_150.map", "Chyulu_175.map", "Chyulu_200.map", "Chyulu_225.map", "Chyulu_250.map",
+                     "Chyulu_275.map", "Chyulu_300.map", "Chyulu_325.map", "Chyulu_350.map", "Chyulu_350.map",
+                     "Chyulu_375.map", "Chyulu_400.map", "Chyulu_425.map", "Chyulu_450.map", "Chyulu_475.map",
+                     "Chyulu_500.map", "Chyulu_525.map", "Chyulu_550.map", "Chyulu_575.map", "Chyulu_600.map",
+                     "Chyulu_625.map", "Chyulu_650.map", "Chyulu_675.map", "Chyulu_700.map", "Chyulu_725.map",
+                     "Chyulu_750.map"])
+
+# Limits and optional features for running the jobs of an experiment (cache, watchdog,
+# catalogue, profiling, memory planning, compaction): see `gemmpy/defaults.py` for all
+# settings and their defaults. Features are turned on here, e.g. with
+# `defaults.scheduler(watchdog=["population == 0 for 10"], catalogue=True, profile=30)`.
+scheduler_settings = defaults.scheduler()
+
+# Where to run the simulations (see `gemmpy/executors.py`): "local" (a bounded queue
+# of Julia processes), "workers" (a pool of warm Julia workers, which saves the startup
+# and compilation time of short runs), "slurm" (job arrays) or "mock" (a local stand-in
+# for slurm, for testing). Can also be set with a commandline flag, e.g. `--slurm`.
+backend = "local"
+
+# Before launching, predict the cost of each run from the finished runs in the catalogue,
+# print the expected total, and start the longest runs first (see `gemmpy/planner.py`).
+# With the `--plan` commandline flag, only the plan is printed. (Planning writes the
+# configs of all jobs before the first one starts, so it is off by default; for large
+# sweeps, jobs are otherwise streamed into the scheduler as slots become free.)
+plan_jobs = False
+plan_only = False
+
+# Further settings for the slurm backend (see `gemmpy/executors.py` and `gemmpy/defaults.py`)
+slurm_settings = defaults.slurm()
+
+# Instead of running every seed from <seed1> to <seedN>, launch the replicates in waves
+# and stop each scenario once its results are stable (see `gemmpy/replicates.py`).
+# Can also be set with the `--converge` commandline flag.
+converge = False
+
+# Settings for `converge` (see `gemmpy/replicates.py` and `gemmpy/defaults.py`)
+replicate_settings = defaults.replicates()
+
+# The files that the runs depend on. They are recorded in the snapshot store at every
+# launch, storing only files that changed (see `gemmpy/snapshot.py`; the snapshot of
+# each run is in the catalogue, and `python3 -m gemmpy.snapshot restore` recovers it).
+code_files = ["README.md", "rungemm.jl", "rungemmworker.jl", "src", "gemmpy/*.py",
+              "studies/zosterops/Phylogeny_study/phylogenystudy.py",
+              "studies/zosterops/Phylogeny_study/*.R",
+              "studies/zosterops/Phylogeny_study/Chyulu_Taita_Maps/*.map"]
 
 
 ## AUXILIARY FUNCTIONS
 
 def archive_code():
-    "Save the current codebase in a tar archive."
-    tarname = time.strftime("GeMM_source_%d%b%y.tar.gz")
-    print("Archiving codebase in "+tarname)
-    os.system("git log -1 > current_commit.txt")
-    cmd = "tar czhf " + tarname + " README.md current_commit.txt rungemm.jl src/* " +\
-        "studies/zosterops/*.py studies/zosterops/*.R studies/zosterops/*.map " +\
-        "studies/zosterops/*.config"
-    subprocess.run(cmd, shell=True)
-    os.remove("current_commit.txt")
-    return tarname
+    "Record the current codebase in the snapshot store."
+    return snapshot.archive(code_files)
 
 def write_config(config, dest, seed, **params):
     "Write out a config file with the given values"
@@ -100,7 +144,6 @@ def run_default():
     print("Running a default simulation.")
     conf = "zosterops_default.config"
     dest = "results/taita_hills"
-    shutil.copy("studies/zosterops/Phylogeny_study/Chyulu_Taita_Maps/Chyulu_25.map", ".")
     if os.path.exists(dest):
         if input("Delete old test data? (y/n) ") == 'y':
             shutil.rmtree(dest)
@@ -113,48 +156,65 @@ def run_default():
 
 ## EXPERIMENT FUNCTIONS
 
-## TODO write a generic experiment function
-## def run_experiment(configs)
+def setup_run(name, seed, **params):
+    "Write the config file for a run and return the corresponding job."
+    write_config(name+".config", "results/"+name, seed, **params)
+    settings = default_settings.copy()
+    settings.update(params)
+    return scheduler.Job(name, name+".config", "results/"+name, seed, settings)
+
+def run_experiment(jobs):
+    "Run a set of jobs with the configured backend (locally, at most `maxjobs` at once)."
+    if plan_jobs or plan_only:
+        jobs = planner.plan(jobs, scheduler_settings["maxjobs"], scheduler_settings["totalmem"],
+                            scheduler_settings["cache"])
+        if plan_only:
+            return []
+    return executors.make_executor(backend, scheduler_settings, slurm_settings).run(jobs)
+
+
+def run_replicates(experiment, scenarios, seed1, seedN):
+    """
+    Run each scenario (a dict of scenario names to run parameters) once for each
+    replicate seed from 1 to N. With `converge`, only run as many of these seeds
+    as each scenario needs for its results to stabilise.
+    """
+    if converge and not plan_only:
+        controller = replicates.ReplicateController(**replicate_settings)
+        return controller.run(scenarios, range(seed1, seedN+1), setup_run, run_experiment,
+                              prefix=experiment)
+    run_experiment(setup_run(s+"_"+str(seed), seed, **scenarios[s])
+                   for seed in range(seed1, seedN+1) for s in scenarios)
 
-        
 def run_phylogeny_experiment(seed1, seedN, maps=all_maps):
     """
     Launch a set of replicate simulations for the phylogeny experiment.
     Starts one run for each speciation scenario for each replicate seed from 1 to N.
+    `maps` is a comma-separated list of map files, or a binary map series.
     """
     print("Running "+str(seedN-seed1+1)+" replicates of the phylogeny experiment.")
-    running_sims = []
-    seed = seed1
-    
-   # dir_src = ("/studies/zosterops/Chyulu_Taita_Maps/")
-   # dir_dst = (' .')
-
-   # for filename in os.listdir(dir_src):
-    #    if filename.endswith('.map'):
-     #       shutil.copy( dir_src + filename, dir_dst)
-      #      print(filename)
-    source = ("studies/zosterops/Phylogeny_study/Chyulu_Taita_Maps/")
-    #destination = " . "
-    for files in os.listdir(source):
-        full_file_name = os.path.join(source, files)
-        if full_file_name.endswith(".map"):
-            shutil.copy(full_file_name, ".")
-    while seed <= seedN:
-        for m in alternate_speciations:
-            conf = "savannah"+"_"+str(m)+"_"+str(seed)
-            write_config(conf+".config", "results/"+conf, seed, speciation=m, maps=all_maps)
-            sim = subprocess.Popen(["julia", "rungemm.jl", "--config", conf+".config"])
-            running_sims.append(sim)
-        seed = seed + 1
-    for s in running_sims:
-        s.wait()
+    if maps.endswith(mapformat.SUFFIX):
+        # a packed map series, unpacked once for all runs (see `gemmpy/mapformat.py`)
+        maps = ",".join(mapformat.unpack(maps))
+    scenarios = {"savannah"+"_"+str(m): {"speciation":m, "maps":maps} for m in alternate_speciations}
+    run_replicates("savannah", scenarios, seed1, seedN)
 
 ## RUNTIME SCRIPT
         
 ## USAGE OPTIONS:
 ## ./habitatstudy.py [archive/default]
 ## ./habitatstudy.py [tolerance/habitat/mutation/linkage/phylogeny] <seed1> <seedN> [tolerance]
+## (add `--workers` to run the simulations on a pool of warm Julia workers, or
+## `--slurm` to submit them as slurm job arrays; `--plan` only prints the predicted cost;
+## `--converge` stops adding seeds to a scenario once its results are stable)
 if __name__ == '__main__':
+    backend = executors.backend_option(sys.argv, backend)
+    if "--plan" in sys.argv:
+        sys.argv.remove("--plan")
+        plan_only = True
+    if "--converge" in sys.argv:
+        sys.argv.remove("--converge")
+        converge = True
     archive_code()
     if len(sys.argv) < 2 or sys.argv[1] == "default":
         run_default()
@@ -9,8 +9,14 @@
 
 import os, sys, shutil, time, subprocess
 
+sys.path.insert(0, os.getcwd()) # the shared launcher library `gemmpy` lives in the model root
+from gemmpy import scheduler, executors, planner, mapformat, replicates, snapshot, defaults
+
 ## PARAMETERS AND VARIABLES
 
+# The maps are referenced in place (relative to the model root, where the configs are written)
+mapdir = "studies/zosterops/"
+
 # See `zosterops.config` for details
 default_settings = {
     # input/output settings
@@ -51,7 +57,7 @@ default_settings = {
     "species":'[Dict("lineage"=>"silvanus","precopt"=>180,"prectol"=>90,"tempopt"=>293,"temptol"=>2),Dict("lineage"=>"flavilateralis","precopt"=>50,"prectol"=>47,"tempopt"=>293,"temptol"=>2)]',
     "traitnames":'["compat","dispmean","dispshape","numpollen","precopt","prectol","repsize","seqsimilarity","seedsize","tempopt","temptol"]',
     # variable parameters
-    "maps":"taita_hills.map",
+    "maps":mapdir+"taita_hills.map",
     "tolerance":0.01
 }
 
@@ -65,20 +71,50 @@ alternate_mutationrates = ["0", "3.6e09", "3.6e10", "3.6e11"]
 
 alternate_linkages = ["none", "random", "full"]
 
+# Limits and optional features for running the jobs of an experiment (cache, watchdog,
+# catalogue, profiling, memory planning, compaction): see `gemmpy/defaults.py` for all
+# settings and their defaults. Features are turned on here, e.g. with
+# `defaults.scheduler(watchdog=["population == 0 for 10"], catalogue=True, profile=30)`.
+scheduler_settings = defaults.scheduler()
+
+# Where to run the simulations (see `gemmpy/executors.py`): "local" (a bounded queue
+# of Julia processes), "workers" (a pool of warm Julia workers, which saves the startup
+# and compilation time of short runs), "slurm" (job arrays) or "mock" (a local stand-in
+# for slurm, for testing). Can also be set with a commandline flag, e.g. `--slurm`.
+backend = "local"
+
+# Before launching, predict the cost of each run from the finished runs in the catalogue,
+# print the expected total, and start the longest runs first (see `gemmpy/planner.py`).
+# With the `--plan` commandline flag, only the plan is printed. (Planning writes the
+# configs of all jobs before the first one starts, so it is off by default; for large
+# sweeps, jobs are otherwise streamed into the scheduler as slots become free.)
+plan_jobs = False
+plan_only = False
+
+# Further settings for the slurm backend (see `gemmpy/executors.py` and `gemmpy/defaults.py`)
+slurm_settings = defaults.slurm()
+
+# Instead of running every seed from <seed1> to <seedN>, launch the replicates in waves
+# and stop each scenario once its results are stable (see `gemmpy/replicates.py`).
+# Can also be set with the `--converge` commandline flag.
+converge = False
+
+# Settings for `converge` (see `gemmpy/replicates.py` and `gemmpy/defaults.py`)
+replicate_settings = defaults.replicates()
+
+# The files that the runs depend on. They are recorded in the snapshot store at every
+# launch, storing only files that changed (see `gemmpy/snapshot.py`; the snapshot of
+# each run is in the catalogue, and `python3 -m gemmpy.snapshot restore` recovers it).
+code_files = ["README.md", "rungemm.jl", "rungemmworker.jl", "src", "gemmpy/*.py",
+              "studies/zosterops/*.py", "studies/zosterops/*.R",
+              "studies/zosterops/*.map", "studies/zosterops/*.config"]
+
 
 ## AUXILIARY FUNCTIONS
 
 def archive_code():
-    "Save the current codebase in a tar archive."
-    tarname = time.strftime("GeMM_source_%d%b%y.tar.gz")
-    print("Archiving codebase in "+tarname)
-    os.system("git log -1 > current_commit.txt")
-    cmd = "tar czhf " + tarname + " README.md current_commit.txt rungemm.jl src/* " +\
-        "studies/zosterops/*.py studies/zosterops/*.R studies/zosterops/*.map " +\
-        "studies/zosterops/*.config"
-    subprocess.run(cmd, shell=True)
-    os.remove("current_commit.txt")
-    return tarname
+    "Record the current codebase in the snapshot store."
+    return snapshot.archive(code_files)
 
 def write_config(config, dest, seed, **params):
     "Write out a config file with the given values"
@@ -99,7 +135,6 @@ def run_default():
     print("Running a default simulation.")
     conf = "zosterops_default.config"
     dest = "results/taita_hills"
-    shutil.copy("studies/zosterops/"+default_settings["maps"], ".")
     if os.path.exists(dest):
         if input("Delete old test data? (y/n) ") == 'y':
             shutil.rmtree(dest)
@@ -112,8 +147,34 @@ def run_default():
 
 ## EXPERIMENT FUNCTIONS
 
-## TODO write a generic experiment function
-## def run_experiment(configs)
+def setup_run(name, seed, **params):
+    "Write the config file for a run and return the corresponding job."
+    write_config(name+".config", "results/"+name, seed, **params)
+    settings = default_settings.copy()
+    settings.update(params)
+    return scheduler.Job(name, name+".config", "results/"+name, seed, settings)
+
+def run_experiment(jobs):
+    "Run a set of jobs with the configured backend (locally, at most `maxjobs` at once)."
+    if plan_jobs or plan_only:
+        jobs = planner.plan(jobs, scheduler_settings["maxjobs"], scheduler_settings["totalmem"],
+                            scheduler_settings["cache"])
+        if plan_only:
+            return []
+    return executors.make_executor(backend, scheduler_settings, slurm_settings).run(jobs)
+
+def run_replicates(experiment, scenarios, seed1, seedN):
+    """
+    Run each scenario (a dict of scenario names to run parameters) once for each
+    replicate seed from 1 to N. With `converge`, only run as many of these seeds
+    as each scenario needs for its results to stabilise.
+    """
+    if converge and not plan_only:
+        controller = replicates.ReplicateController(**replicate_settings)
+        return controller.run(scenarios, range(seed1, seedN+1), setup_run, run_experiment,
+                              prefix=experiment)
+    run_experiment(setup_run(s+"_"+str(seed), seed, **scenarios[s])
+                   for seed in range(seed1, seedN+1) for s in scenarios)
 
 def run_hybridisation_experiment(seed1, seedN):
     """
@@ -121,18 +182,8 @@ def run_hybridisation_experiment(seed1, seedN):
     Starts one run for each tolerance setting for each replicate seed from 1 to N.
     """
     print("Running "+str(seedN-seed1+1)+" replicates of the hybridisation experiment.")
-    running_sims = []
-    shutil.copy("studies/zosterops/"+default_settings["maps"], ".")
-    seed = seed1
-    while seed <= seedN:
-        for t in alternate_tolerances:
-            conf = "tolerance_"+str(t)+"_"+str(seed)
-            write_config(conf+".config", "results/"+conf, seed, tolerance=t)
-            sim = subprocess.Popen(["julia", "rungemm.jl", "--config", conf+".config"])
-            running_sims.append(sim)
-        seed = seed + 1
-    for s in running_sims:
-        s.wait()
+    scenarios = {"tolerance_"+str(t): {"tolerance":t} for t in alternate_tolerances}
+    run_replicates("tolerance", scenarios, seed1, seedN)
         
 def run_habitat_experiment(seed1, seedN, tolerance=default_settings["tolerance"]):
     """
@@ -140,18 +191,9 @@ def run_habitat_experiment(seed1, seedN, tolerance=default_settings["tolerance"]
     Starts one run for each map scenario for each replicate seed from 1 to N.
     """
     print("Running "+str(seedN-seed1+1)+" replicates of the habitat fragmentation experiment.")
-    running_sims = []
-    seed = seed1
-    while seed <= seedN:
-        for m in alternate_maps:
-            shutil.copy("studies/zosterops/"+m, ".")
-            conf = "habitat_tol"+str(tolerance)+"_"+m.split("_")[2][:-4]+"_"+str(seed)
-            write_config(conf+".config", "results/"+conf, seed, maps=m, tolerance=tolerance)
-            sim = subprocess.Popen(["julia", "rungemm.jl", "--config", conf+".config"])
-            running_sims.append(sim)
-        seed = seed + 1
-    for s in running_sims:
-        s.wait()
+    scenarios = {"habitat_tol"+str(tolerance)+"_"+m.split("_")[2][:-4]:
+                 {"maps":mapdir+m, "tolerance":tolerance} for m in alternate_maps}
+    run_replicates("habitat", scenarios, seed1, seedN)
 
 def run_mutation_experiment(seed1, seedN):
     """
@@ -159,20 +201,9 @@ def run_mutation_experiment(seed1, seedN):
     Starts one run for each mutation setting for each replicate seed from 1 to N.
     """
     print("Running "+str(seedN-seed1+1)+" replicates of the mutation experiment.")
-    running_sims = []
-    if default_settings["maps"] not in os.listdir():
-        shutil.copy("studies/zosterops/"+default_settings["maps"], ".")
-    seed = seed1
-    while seed <= seedN:
-        for m in alternate_mutationrates:
-            conf = "mutation_"+str(m)+"_"+str(seed)
-            write_config(conf+".config", "results/"+conf, seed, tolerance=0,
-                         mutate="true", mutationrate=m)
-            sim = subprocess.Popen(["julia", "rungemm.jl", "--config", conf+".config"])
-            running_sims.append(sim)
-        seed = seed + 1
-    for s in running_sims:
-        s.wait()
+    scenarios = {"mutation_"+str(m): {"tolerance":0, "mutate":"true", "mutationrate":m}
+                 for m in alternate_mutationrates}
+    run_replicates("mutation", scenarios, seed1, seedN)
 
 def run_linkage_experiment(seed1, seedN):
     """
@@ -180,18 +211,8 @@ def run_linkage_experiment(seed1, seedN):
     Starts one run for each linkage setting for each replicate seed from 1 to N.
     """
     print("Running "+str(seedN-seed1+1)+" replicates of the linkage experiment.")
-    running_sims = []
-    shutil.copy("studies/zosterops/"+default_settings["maps"], ".")
-    seed = seed1
-    while seed <= seedN:
-        for l in alternate_linkages:
-            conf = "linkage_"+str(l)+"_"+str(seed)
-            write_config(conf+".config", "results/"+conf, seed, linkage=l)
-            sim = subprocess.Popen(["julia", "rungemm.jl", "--config", conf+".config"])
-            running_sims.append(sim)
-        seed = seed + 1
-    for s in running_sims:
-        s.wait()
+    scenarios = {"linkage_"+str(l): {"linkage":l} for l in alternate_linkages}
+    run_replicates("linkage", scenarios, seed1, seedN)
 
 def run_long_experiment(seed1, seedN):
     """
@@ -199,28 +220,30 @@ def run_long_experiment(seed1, seedN):
     experiment with 1000 timesteps).
     """
     print("Running "+str(seedN-seed1+1)+" replicates of the long experiment.")
-    running_sims = []
     mapfile = "taita_hills_long.map"
-    shutil.copy("studies/zosterops/"+default_settings["maps"], mapfile)
-    os.system('sed -e "4s/300/1000/" -i '+mapfile)
-    seed = seed1
-    while seed <= seedN:
-        for t in alternate_tolerances:
-            conf = "tolerance_long_"+str(t)+"_"+str(seed)
-            write_config(conf+".config", "results/"+conf, seed, tolerance=t,
-                         maps=mapfile, outfreq=25)
-            sim = subprocess.Popen(["julia", "rungemm.jl", "--config", conf+".config"])
-            running_sims.append(sim)
-        seed = seed + 1
-    for s in running_sims:
-        s.wait()
+    longmap = mapformat.read_text(default_settings["maps"])
+    longmap.timesteps = 1000
+    mapformat.write_text(longmap, mapfile)
+    scenarios = {"tolerance_long_"+str(t): {"tolerance":t, "maps":mapfile, "outfreq":25}
+                 for t in alternate_tolerances}
+    run_replicates("tolerance_long", scenarios, seed1, seedN)
 
 ## RUNTIME SCRIPT
         
 ## USAGE OPTIONS:
 ## ./habitatstudy.py [archive/default]
 ## ./habitatstudy.py [tolerance/habitat/mutation/linkage] <seed1> <seedN> [tolerance]
+## (add `--workers` to run the simulations on a pool of warm Julia workers, or
+## `--slurm` to submit them as slurm job arrays; `--plan` only prints the predicted cost;
+## `--converge` stops adding seeds to a scenario once its results are stable)
 if __name__ == '__main__':
+    backend = executors.backend_option(sys.argv, backend)
+    if "--plan" in sys.argv:
+        sys.argv.remove("--plan")
+        plan_only = True
+    if "--converge" in sys.argv:
+        sys.argv.remove("--converge")
+        converge = True
     archive_code()
     if len(sys.argv) < 2 or sys.argv[1] == "default":
         run_default()
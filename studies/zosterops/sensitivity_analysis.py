@@ -9,12 +9,18 @@
 
 import os, sys, shutil, time, subprocess
 
+sys.path.insert(0, os.getcwd()) # the shared launcher library `gemmpy` lives in the model root
+from gemmpy import scheduler, executors, planner, sweep, adaptive, snapshot, defaults
+
 ## PARAMETERS AND VARIABLES
 
+# The maps are referenced in place (relative to the model root, where the configs are written)
+mapdir = "studies/zosterops/Phylogeny_study/Chyulu_Taita_Maps/"
+
 # See `zosterops.config` for details
 default_settings = {
     # input/output settings
-    "maps":"Chyulu_025.map",
+    "maps":mapdir+"Chyulu_25.map",
     "outfreq":10,
     "fastaoutfreq":1000,
     "logging":"true",
@@ -59,27 +65,78 @@ default_settings = {
     "speciation":"ecological"
 }
 
-alternate_speciations = ["ecological","neutral"]
-alternate_perfecttol=[10.0]
-alternate_phylconstr=[0.05]
-alternate_mutationrate=[2.5e11]
-alternate_dispmean=[18]
-alternate_dispshape=[2.0]
-alternate_tolerance=[0.25]
+# The parameter space of the sensitivity analysis (see `gemmpy/sweep.py`).
+# Each setting maps to a list of values, or to a `sweep.Range(low, high)` for
+# continuous parameters (only possible with a sampling design).
+sensitivity_space = {
+    "speciation":["ecological","neutral"],
+    "perfecttol":[10.0],
+    "phylconstr":[0.05],
+    "mutationrate":[2.5e11],
+    "dispmean":[18],
+    "dispshape":[2.0],
+    "tolerance":[0.25]
+}
+
+# "grid" runs every combination of the values above, "lhs", "sobol" and "random"
+# sample `sensitivity_points` points from the space instead. "adaptive" runs an
+# initial Latin hypercube and then places further points where the response is
+# most uncertain or changes fastest (see `gemmpy/adaptive.py` and `adaptive_settings`).
+sensitivity_design = "grid"
+sensitivity_points = None
+
+# Settings for the adaptive design: response = the end-of-run metric to explore
+# (see `gemmpy/metrics.py`), initial = number of points of the initial design,
+# batch = points per following round, budget = total number of runs (including
+# all replicates), gradient = weight of steep regions relative to uncertain ones.
+# (The responses are read after each round, so the backend has to wait for the runs.)
+adaptive_settings = {
+    "response":"diversity:lineages",
+    "initial":20,
+    "batch":8,
+    "budget":200,
+    "gradient":1.0
+}
+
+# short labels for the run names
+sensitivity_abbreviations = {"phylconstr":"phyl", "perfecttol":"pertol", "mutationrate":"mutate",
+                             "dispmean":"dispm", "dispshape":"dispsh", "tolerance":"comtol"}
+
+# Limits and optional features for running the jobs of an experiment (cache, watchdog,
+# catalogue, profiling, memory planning, compaction): see `gemmpy/defaults.py` for all
+# settings and their defaults. Features are turned on here, e.g. with
+# `defaults.scheduler(watchdog=["population == 0 for 10"], catalogue=True, profile=30)`.
+scheduler_settings = defaults.scheduler()
+
+# Where to run the simulations (see `gemmpy/executors.py`): "local" (a bounded queue
+# of Julia processes), "workers" (a pool of warm Julia workers, which saves the startup
+# and compilation time of short runs), "slurm" (job arrays) or "mock" (a local stand-in
+# for slurm, for testing). Can also be set with a commandline flag, e.g. `--slurm`.
+backend = "local"
+
+# Before launching, predict the cost of each run from the finished runs in the catalogue,
+# print the expected total, and start the longest runs first (see `gemmpy/planner.py`).
+# With the `--plan` commandline flag, only the plan is printed. (Planning writes the
+# configs of all jobs before the first one starts, so it is off by default; for large
+# sweeps, jobs are otherwise streamed into the scheduler as slots become free.)
+plan_jobs = False
+plan_only = False
+
+# Further settings for the slurm backend (see `gemmpy/executors.py` and `gemmpy/defaults.py`)
+slurm_settings = defaults.slurm()
+# The files that the runs depend on. They are recorded in the snapshot store at every
+# launch, storing only files that changed (see `gemmpy/snapshot.py`; the snapshot of
+# each run is in the catalogue, and `python3 -m gemmpy.snapshot restore` recovers it).
+code_files = ["README.md", "rungemm.jl", "rungemmworker.jl", "src", "gemmpy/*.py",
+              "studies/zosterops/sensitivity_analysis.py",
+              "studies/zosterops/Phylogeny_study/Chyulu_Taita_Maps/*.map"]
+
 
 ## AUXILIARY FUNCTIONS
 
 def archive_code():
-    "Save the current codebase in a tar archive."
-    tarname = time.strftime("GeMM_source_%d%b%y.tar.gz")
-    print("Archiving codebase in "+tarname)
-    os.system("git log -1 > current_commit.txt")
-    cmd = "tar czhf " + tarname + " README.md current_commit.txt rungemm.jl src/* " +\
-        "studies/zosterops/*.py studies/zosterops/*.R studies/zosterops/*.map " +\
-        "studies/zosterops/*.config"
-    subprocess.run(cmd, shell=True)
-    os.remove("current_commit.txt")
-    return tarname
+    "Record the current codebase in the snapshot store."
+    return snapshot.archive(code_files)
 
 def write_config(config, dest, seed, **params):
     "Write out a config file with the given values"
@@ -100,7 +157,6 @@ def run_default():
     print("Running a default simulation.")
     conf = "zosterops_default.config"
     dest = "results/taita_hills"
-    shutil.copy("studies/zosterops/Chyulu_Taita_Maps/Chyulu_025.map", ".")
     if os.path.exists(dest):
         if input("Delete old test data? (y/n) ") == 'y':
             shutil.rmtree(dest)
@@ -113,42 +169,50 @@ def run_default():
 
 ## EXPERIMENT FUNCTIONS
 
-## TODO write a generic experiment function
-## def run_experiment(configs)
+def setup_run(name, seed, **params):
+    "Write the config file for a run and return the corresponding job."
+    write_config(name+".config", "results/"+name, seed, **params)
+    settings = default_settings.copy()
+    settings.update(params)
+    return scheduler.Job(name, name+".config", "results/"+name, seed, settings)
+
+def run_experiment(jobs):
+    "Run a set of jobs with the configured backend (locally, at most `maxjobs` at once)."
+    if plan_jobs or plan_only:
+        jobs = planner.plan(jobs, scheduler_settings["maxjobs"], scheduler_settings["totalmem"],
+                            scheduler_settings["cache"])
+        if plan_only:
+            return []
+    return executors.make_executor(backend, scheduler_settings, slurm_settings).run(jobs)
 
         
 def run_sensitivity_analysis(seed1, seedN):
     """
     Launch a set of replicate simulations for the trait space experiment.
-    Starts one run for each speciation scenario for each replicate seed from 1 to N.
+    Starts one run for each point of the sensitivity sweep for each replicate seed from 1 to N.
     """
     print("Running "+str(seedN-seed1+1)+" replicates of the trait space exploration experiment.")
-    running_sims = []
-    seed = seed1
-    species_no=0
-    shutil.copy("/home/charlotte/Zosterops/gemm/studies/zosterops/Phylogeny_study/Chyulu_Taita_Maps2/Chyulu_025.map", ".")
-    while seed <= seedN:
-        for s in alternate_speciations:
-            for pt in alternate_perfecttol:
-                for pc in alternate_phylconstr:
-                    for m in alternate_mutationrate:
-                        for dm in alternate_dispmean:
-                            for ds in alternate_dispshape:
-                                for t in alternate_tolerance:
-                                    conf = str(s)+"_"+str(seed)+"_phyl"+str(pc)+"_pertol"+str(pt)+"_mutate"+str(m)+"_dispm"+str(dm)+"_dispsh"+str(ds)+"_comtol"+str(t)
-                                    write_config(conf+".config", "results/"+conf, seed, speciation=s, perfecttol=pt, phylconstr=pc, mutationrate=m, dispmean=dm, dispshape=ds, tolerance=t)
-                                    sim = subprocess.Popen(["julia", "rungemm.jl", "--config", conf+".config"])
-                                    running_sims.append(sim)
-        seed = seed + 1
-    for s in running_sims:
-        s.wait()
+    if sensitivity_design == "adaptive":
+        design = adaptive.AdaptiveSweep(sensitivity_space, **adaptive_settings)
+        design.run("sensitivity", range(seed1, seedN+1), setup_run, run_experiment)
+        return
+    design = sweep.Sweep(sensitivity_space, sensitivity_design, sensitivity_points,
+                         abbreviations=sensitivity_abbreviations)
+    print("The "+sensitivity_design+" design has "+str(len(design))+" points per replicate.")
+    run_experiment(design.jobs("sensitivity", range(seed1, seedN+1), setup_run))
 
 ## RUNTIME SCRIPT
         
 ## USAGE OPTIONS:
 ## ./habitatstudy.py [archive/default]
 ## ./habitatstudy.py [tolerance/habitat/mutation/linkage/phylogeny/traitspace] <seed1> <seedN> [tolerance]
+## (add `--workers` to run the simulations on a pool of warm Julia workers, or
+## `--slurm` to submit them as slurm job arrays; `--plan` only prints the predicted cost)
 if __name__ == '__main__':
+    backend = executors.backend_option(sys.argv, backend)
+    if "--plan" in sys.argv:
+        sys.argv.remove("--plan")
+        plan_only = True
     archive_code()
     if len(sys.argv) < 2 or sys.argv[1] == "default":
         run_default()
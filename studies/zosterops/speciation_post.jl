@@ -5,6 +5,7 @@ the seqs file. It automatically takes the first half of the genome and concatena
 These are then loaded into a further tool (eg. FasTree)
 
 this is meant to be parallelised via an sbatch command in slurm
+(`gemmpy/alignment.py` does the same for many runs at once, in parallel across timesteps)
 
 No warranties for anything. Use at your own risk.
 Robin Rölz, 21/09/2021"""
@@ -0,0 +1,9 @@
+##
+## The Python tests of the launcher library `gemmpy` (the Julia tests are run by
+## `runtests.jl`). Run them from the model root with `python3 -m pytest test`.
+##
+
+import os, sys
+
+# `gemmpy` lives in the model root, as for the launchers
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
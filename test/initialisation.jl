@@ -11,6 +11,7 @@ include("../src/run_simulation.jl")
 include("../src/defaults.jl")
 include("../src/entities.jl")
 include("../src/genetics.jl")
+include("../src/input.jl")
 include("../src/output.jl")
 include("../src/initialisation.jl")
 
@@ -20,3 +21,40 @@ initsettings(defaultSettings())
     ind = createind()
     @test typeof(ind) == Individual
 end
+
+@testset "ChangeSet" begin
+    # applying a change set must give the same world as reading the full map
+    # that it describes (cf. `gemmpy/succession.py`)
+    function writemap(lines)
+        filename, io = mktemp()
+        foreach(l -> println(io, l), lines)
+        close(io)
+        filename
+    end
+    basemap = writemap(["10", "1 1 1 temp=293 prec=100", "2 2 1 temp=293 prec=100",
+                        "3 1 2 temp=295 prec=80 isisland", "4 2 2 temp=295 prec=80"])
+    changes = writemap(["5 update", "# patch 2 gets warmer, 3 is no longer an island",
+                        "2 2 1 temp=296 prec=100", "3 1 2 temp=295 prec=80 isisland=false",
+                        "5 3 1 temp=290 prec=120"])
+    fullmap = writemap(["5", "1 1 1 temp=293 prec=100", "2 2 1 temp=296 prec=100",
+                        "3 1 2 temp=295 prec=80 isisland=false", "4 2 2 temp=295 prec=80",
+                        "5 3 1 temp=290 prec=120"])
+    timesteps, maptable, changeset = readmapfile(basemap)
+    @test !changeset
+    world = createworld(maptable)
+    timesteps, maptable, changeset = readmapfile(changes)
+    @test timesteps == 5
+    @test changeset
+    updated = updateworld(world, maptable, changeset)
+    expected = createworld(readmapfile(fullmap)[2])
+    @test length(updated) == length(expected)
+    sort!(updated, by = p -> p.id)
+    sort!(expected, by = p -> p.id)
+    for (u, e) in zip(updated, expected)
+        @test all(getfield(u, f) == getfield(e, f) for f in fieldnames(Patch))
+    end
+    # the old world is left unchanged
+    @test world[2].temp == 293
+    @test world[3].isisland
+    foreach(rm, [basemap, changes, fullmap])
+end
@@ -0,0 +1,103 @@
+## Tests for the compaction of run folders in `gemmpy/compact.py`
+
+import os, io
+
+from gemmpy import compact
+
+mapfile = "10\n\n1 1 1 temp=293 prec=100 initpop\n2 2 1 temp=294 prec=90\n"
+
+def make_run(rundir, loglines=10):
+    "Create a run folder with a map copy, logs, population statistics and a dump."
+    os.makedirs(rundir)
+    files = {"Chyulu_1.map":mapfile,
+             "diversity.log":"population,freespace,lineages,alpha,beta,gamma\n"+
+                             "".join(str(i)+",0.5,"+str(i % 7)+",2,1.5,3\n" for i in range(loglines)),
+             "pops.tsv":"time\tx\ty\tlineage\n1\t1\t1\tA\n",
+             "inds_s1.tsv":"id\tlineage\n1\tA\n"}
+    for name, text in files.items():
+        with open(os.path.join(rundir, name), "w") as f:
+            f.write(text)
+    return {n: t.encode() for n, t in files.items()}
+
+def test_roundtrip_chunks(tmp_path):
+    "Files larger than a chunk are packed in several chunks and read back unchanged."
+    run = str(tmp_path / "run1")
+    files = make_run(run, loglines=500000) # about 10 MB
+    assert compact.compact(run) > 0
+    assert sorted(os.listdir(run)) == ["inds_s1.tsv", compact.PACK]
+    members = compact.packed(run)
+    assert len(members["diversity.log"]["chunks"]) == -(-len(files["diversity.log"]) // compact.CHUNKSIZE) > 1
+    assert compact.list_outputs(run) == sorted(files)
+    for name, data in files.items():
+        with compact.open_output(run, name, "rb") as f:
+            assert f.read() == data
+    assert compact.output_state(run, "pops.tsv")[0] == len(files["pops.tsv"])
+
+def test_seek_across_chunks(tmp_path):
+    "Seeking and reading work across chunk boundaries, in binary and text mode."
+    run = str(tmp_path / "run1")
+    data = make_run(run, loglines=500000)["diversity.log"]
+    compact.compact(run)
+    boundary = compact.CHUNKSIZE
+    with compact.open_output(run, "diversity.log", "rb") as f:
+        f.seek(boundary - 10)
+        assert f.read(20) == data[boundary-10:boundary+10]
+        f.seek(-15, io.SEEK_END)
+        assert f.read() == data[-15:]
+        f.seek(2 * boundary + 3)
+        assert f.read(5) == data[2*boundary+3:2*boundary+8] and f.tell() == 2 * boundary + 8
+        f.seek(5)
+        assert f.read(5) == data[5:10]
+    with compact.open_output(run, "diversity.log") as f:
+        lines = f.readlines()
+    assert "".join(lines).encode() == data
+
+def test_recompact(tmp_path):
+    "Compacting again keeps the packed files, replaces changed ones and adds new ones."
+    run = str(tmp_path / "run1")
+    files = make_run(run)
+    compact.compact(run)
+    with open(os.path.join(run, "diversity.log"), "w") as f:
+        f.write("population\n42\n")
+    with open(os.path.join(run, "simulation.log"), "w") as f:
+        f.write("done\n")
+    compact.compact(run)
+    assert sorted(os.listdir(run)) == ["inds_s1.tsv", compact.PACK]
+    assert compact.list_outputs(run) == sorted(list(files) + ["simulation.log"])
+    with compact.open_output(run, "diversity.log") as f:
+        assert f.read() == "population\n42\n"
+    with compact.open_output(run, "pops.tsv", "rb") as f:
+        assert f.read() == files["pops.tsv"]
+    with compact.open_output(run, "simulation.log") as f:
+        assert f.read() == "done\n"
+    assert compact.compact(run) == 0 # nothing left to compact
+
+def test_extract(tmp_path):
+    "Extracted files are plain again, with their original contents and modification times."
+    run = str(tmp_path / "run1")
+    files = make_run(run)
+    mtime = os.path.getmtime(os.path.join(run, "pops.tsv"))
+    compact.compact(run)
+    assert compact.extract(run, ["pops.tsv"]) == ["pops.tsv"]
+    assert open(os.path.join(run, "pops.tsv"), "rb").read() == files["pops.tsv"]
+    assert os.path.getmtime(os.path.join(run, "pops.tsv")) == mtime
+    assert sorted(compact.extract(run)) == sorted(n for n in files if n != "inds_s1.tsv")
+    for name, data in files.items():
+        assert open(os.path.join(run, name), "rb").read() == data
+
+def test_map_store(tmp_path):
+    "Identical map copies of several runs are stored once and read through references."
+    runs = [str(tmp_path / "results" / name) for name in ["run1", "run2"]]
+    for run in runs:
+        make_run(run)
+        compact.compact(run)
+    store = os.path.join(str(tmp_path / "results"), compact.STORE)
+    blobs = [f for _, _, fs in os.walk(store) for f in fs]
+    refs = [compact.packed(run)["Chyulu_1.map"]["ref"] for run in runs]
+    assert blobs == [refs[0]] and refs[0] == refs[1]
+    with compact.pack_of(runs[1]) as pack:
+        assert os.path.samefile(pack.blob("Chyulu_1.map"), os.path.join(store, refs[0][:2], refs[0]))
+    with compact.open_output(runs[1], "Chyulu_1.map") as f:
+        assert f.read() == mapfile
+    assert compact.output_exists(runs[0], "Chyulu_1.map")
+    assert not compact.output_exists(runs[0], "Chyulu_2.map")
@@ -0,0 +1,67 @@
+## Tests for the binary map format in `gemmpy/mapformat.py`
+
+import os, glob, shutil
+import numpy as np
+
+from gemmpy import mapformat
+
+chyulu = sorted(glob.glob(os.path.join(os.path.dirname(__file__), "..", "studies", "zosterops",
+                                       "Phylogeny_study", "Chyulu_Taita_Maps", "Chyulu_*.map")),
+                key=lambda f: int(f.split("_")[-1][:-len(".map")]))
+
+def write(path, lines):
+    with open(path, "w") as f:
+        f.write("\n".join(lines)+"\n")
+    return str(path)
+
+def test_text_roundtrip(tmp_path):
+    "Reading and writing a text map keeps comments, flags, missing values and extra parameters."
+    lines = ["# A test map", "", "20", "", "# <id> <x> <y>",
+             "1\t1\t1\ttemp=293\tprec=180.5\tcapacity=4\tinitpop",
+             "2\t2\t1\ttemp=293.25\tisisland\tisolated",
+             "3\t1\t2\tprec=0\tinvasible\tnicheb=3"]
+    original = write(tmp_path / "test.map", lines)
+    m = mapformat.read_text(original)
+    assert m.timesteps == 20 and len(m) == 3 and not m.changeset
+    assert np.isnan(m.cells["temp"][2]) and m.extra == {2: ["nicheb=3"]}
+    mapformat.write_text(m, str(tmp_path / "copy.map"))
+    assert open(tmp_path / "copy.map").read() == open(original).read()
+
+def test_series_roundtrip(tmp_path):
+    "A series with changed, added and removed cells is packed as differences and unpacked unchanged."
+    base = ["10", "1 1 1 temp=293 prec=100 initpop", "2 2 1 temp=293 prec=100",
+            "3 3 1 temp=293 prec=0.1"]
+    files = [write(tmp_path / "a.map", base),
+             write(tmp_path / "b.map", ["10"] + base[1:3] + ["3 3 1 temp=294 prec=0.1",
+                                                            "4 4 1 temp=290 prec=7 isisland"]),
+             write(tmp_path / "c.map", ["10", base[1], "4 4 1 temp=290 prec=7 isisland"]),
+             write(tmp_path / "d.map", ["5 update", "4 4 1 temp=291 prec=7 isisland"]),
+             write(tmp_path / "e.map", ["10", "4 4 1 temp=290 prec=7", base[1]])] # reordered
+    packed = mapformat.pack(str(tmp_path / "series.gmap"), files)
+    loaded = mapformat.load(packed)
+    assert [m.name for m in loaded] == [os.path.basename(f) for f in files]
+    assert loaded == [mapformat.read_text(f) for f in files]
+    assert loaded[3].changeset and loaded[3].timesteps == 5
+    unpacked = mapformat.unpack(packed, str(tmp_path / "out"))
+    for original, copy in zip(files, unpacked):
+        assert open(copy).read() == open(original).read()
+
+def test_chyulu_maps(tmp_path):
+    "The Chyulu succession maps are reproduced byte for byte, and packed much smaller."
+    files = chyulu[:4]
+    assert files, "the Chyulu maps are missing"
+    packed = mapformat.pack(str(tmp_path / "chyulu.gmap"), files)
+    assert os.path.getsize(packed) < sum(os.path.getsize(f) for f in files) / 4
+    for original, copy in zip(files, mapformat.unpack(packed)):
+        assert open(copy).read() == open(original).read()
+
+def test_unpack_up_to_date(tmp_path):
+    "Unpacking again doesn't rewrite maps that are newer than the packed file."
+    files = [shutil.copy(chyulu[0], tmp_path / "first.map")]
+    packed = mapformat.pack(str(tmp_path / "one.gmap"), files)
+    mapfile = mapformat.unpack(packed)[0]
+    os.utime(mapfile, (os.path.getmtime(packed) + 10,) * 2)
+    with open(mapfile, "a") as f:
+        f.write("# edited\n")
+    assert mapformat.unpack(packed) == [mapfile]
+    assert open(mapfile).read().endswith("# edited\n")
@@ -0,0 +1,113 @@
+## Tests for the vectorised map generator in `gemmpy/mapgen.py`
+
+import io, contextlib, random
+import numpy as np
+
+from gemmpy import mapgen
+
+## The original generator from `studies/islandradiation/makemap.py` (before it
+## was vectorised), kept as the reference for small maps.
+
+def old_print_map(xlen, ylen, landtype, xpos, ypos, ident, isol, precon):
+    print("#", landtype, ":")
+    mintemp = 273
+    maxtemp = 303
+    minprec = 0
+    maxprec = 10 if precon else minprec
+    if ylen > 1:
+        precstep = (maxprec - minprec) / (ylen)
+    else:
+        precstep = 1.0
+    temp = mintemp
+    if landtype == "continent":
+        landtype = ""
+        prec = 0
+        tempstep = round((maxtemp - mintemp) / xlen)
+        for x in range(xpos, xpos + xlen):
+            prec = 0
+            temp += tempstep
+            for y in range(ypos, ypos + ylen):
+                ident += 1
+                print(ident, " ", x, " ", y, " ", "temp=", temp, " ", "prec=", prec, " ", "initpot", sep = '')
+                prec += precstep
+    else:
+        landtype = "isisland"
+        temp = 298
+        tempstep = 1
+        precstep = 1
+        for x in range(xpos, xpos + xlen):
+            prec = 1
+            for y in range(ypos, ypos + ylen):
+                ident += 1
+                mindist = min([abs(x - xpos), abs(y - ypos), abs(xpos + xlen - x - 1), abs(ypos + ylen - y - 1)])
+                localtemp = temp - mindist * tempstep
+                isolated = "isolated" if random.random() < isol else ""
+                print(ident, " ", x, " ", y, " ", "temp=", localtemp, " ", "prec=", prec, " ", landtype, " ", isolated, sep ='')
+                prec += precstep
+    print()
+
+def old_map(*args):
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        old_print_map(*args)
+    return out.getvalue()
+
+def new_map(land, startid):
+    out = io.StringIO()
+    mapgen.write_map(out, [land], timesteps=0, startid=startid, ocean=False)
+    return out.getvalue()
+
+def parse(text):
+    "Parse map lines into (id, x, y, temp, prec, flags) tuples."
+    cells = []
+    for line in text.splitlines():
+        if not line.strip() or line.startswith("#"):
+            continue
+        tokens = line.split()
+        values = dict(t.split("=") for t in tokens[3:] if "=" in t)
+        # the old generator misspelt the initial population flag
+        flags = sorted("initpop" if t == "initpot" else t for t in tokens[3:] if "=" not in t)
+        cells.append((int(tokens[0]), int(tokens[1]), int(tokens[2]),
+                      float(values["temp"]), float(values["prec"]), flags))
+    return cells
+
+def assert_same(old, new):
+    assert len(old) == len(new)
+    for o, n in zip(old, new):
+        assert o[:3] == n[:3] and o[5] == n[5]
+        assert np.isclose(o[3], n[3]) and np.isclose(o[4], n[4])
+
+def test_continent_matches_old_generator():
+    "Small continents match the old generator where its rounded temperature step was exact."
+    for width, height, x, y, startid, prec in [(3, 4, 0, 0, 0, False), (5, 7, 2, 3, 10, True),
+                                               (6, 1, 1, 1, 0, True), (10, 3, 0, 5, 4, True)]:
+        land = mapgen.continent(width, height, x, y, prec)
+        assert_same(parse(old_map(width, height, "continent", x, y, startid, 0.0, prec)),
+                    parse(new_map(land, startid)))
+
+def test_island_matches_old_generator():
+    "Small islands match the old generator, with no or only isolated cells."
+    for width, height, x, y, isolation in [(4, 4, 0, 0, 0.0), (5, 3, 2, 1, 0.0), (3, 6, 0, 2, 1.0)]:
+        land = mapgen.island(width, height, x, y, isolation, np.random.default_rng(1))
+        assert_same(parse(old_map(width, height, "island", x, y, 0, isolation, False)),
+                    parse(new_map(land, 0)))
+
+def test_temperature_gradient_on_wide_continents():
+    "The temperature step is not rounded away on continents wider than 60 cells."
+    land = mapgen.continent(90, 1)
+    temps = np.unique(land["temp"])
+    assert len(temps) == 90 and np.isclose(temps[-1], mapgen.MAXTEMP)
+
+def test_dummy_island():
+    "The dummy island takes the next free ID and lies outside all landmasses."
+    rng = np.random.default_rng(0)
+    landmasses = [mapgen.continent(40, 30, 1, 2), mapgen.island(5, 5, 1200, 4, 0.2, rng)]
+    out = io.StringIO()
+    mapgen.write_map(out, landmasses, startid=9990)
+    cells = [line.split() for line in out.getvalue().splitlines()
+             if line.strip() and not line.startswith("#")][1:]
+    ids = [int(c[0]) for c in cells]
+    assert len(set(ids)) == len(ids) and ids[-1] == max(ids) == 9990 + 40 * 30 + 25 + 1
+    dummy = (int(cells[-1][1]), int(cells[-1][2]))
+    assert dummy == (1206, 2)
+    assert dummy not in {(int(c[1]), int(c[2])) for c in cells[:-1]}
@@ -0,0 +1,103 @@
+## Tests for the replicate waves in `gemmpy/replicates.py`
+
+import os, math
+import numpy as np
+import pytest
+
+from gemmpy import replicates, scheduler
+
+def lineages(scenario, seed):
+    "The final number of lineages of a (fake) run: constant, moderately noisy or very noisy."
+    rng = np.random.default_rng(seed)
+    if scenario == "stable":
+        return 10
+    elif scenario == "noisy":
+        return 100 + rng.normal(0, 8)
+    return 100 + rng.normal(0, 100)
+
+class FakeRuns:
+    "Stand-ins for the launchers' `setup_run` and `run_experiment`, writing a `diversity.log` per run."
+
+    def __init__(self, resultsdir):
+        self.resultsdir = resultsdir
+        self.waves = []
+
+    def setup(self, name, seed, **params):
+        return scheduler.Job(name, name+".config", os.path.join(self.resultsdir, name), seed, params)
+
+    def execute(self, jobs):
+        self.waves.append([job.name for job in jobs])
+        for job in jobs:
+            if job.params.get("fails"):
+                continue
+            os.makedirs(job.dest)
+            with open(os.path.join(job.dest, "diversity.log"), "w") as f:
+                f.write("population,freespace,lineages,alpha,beta,gamma\n")
+                value = lineages(job.name.split("_")[0], job.seed)
+                f.write("500,0,"+str(value)+",1,1,"+str(value)+"\n")
+
+def run(tmp_path, scenarios, seeds=range(1, 31), **settings):
+    runs = FakeRuns(str(tmp_path / "results"))
+    controller = replicates.ReplicateController(["diversity:lineages"], **settings)
+    state = controller.run(scenarios, seeds, runs.setup, runs.execute, str(tmp_path / "exp"))
+    return controller, state, runs
+
+def test_waves(tmp_path):
+    "Stable scenarios stop after the first wave, noisy ones get more seeds until they converge or run out."
+    scenarios = {"stable":{}, "noisy":{}, "chaotic":{}}
+    controller, state, runs = run(tmp_path, scenarios, wave=4, minseeds=5)
+    seeds = {s: len(controller.jobs[s]) for s in scenarios}
+    assert len(runs.waves[0]) == 15
+    assert seeds["stable"] == 5 and controller.converged("stable")
+    assert 5 < seeds["noisy"] < 30 and controller.converged("noisy")
+    assert seeds["chaotic"] == 30 and not controller.converged("chaotic")
+    assert all(len(w) <= 4 * len(scenarios) for w in runs.waves[1:])
+    n, mean, lower, upper = state["noisy"]["diversity:lineages"]
+    assert n == seeds["noisy"] and lower <= mean <= upper
+    assert upper - lower <= 0.1 * mean
+    # the seeds of a scenario are used in order, and each run once
+    assert [j.seed for j in controller.jobs["noisy"]] == list(range(1, seeds["noisy"] + 1))
+
+def test_reproducible(tmp_path):
+    "A relaunch with the same settings repeats the same runs (so the run cache can skip them)."
+    scenarios = {"stable":{}, "noisy":{}, "chaotic":{}}
+    first = run(tmp_path / "a", scenarios, seeds=range(1, 16))[2].waves
+    second = run(tmp_path / "b", scenarios, seeds=range(1, 16))[2].waves
+    assert first == second and len(first) > 1
+
+def test_log(tmp_path):
+    controller, state, runs = run(tmp_path, {"stable":{}, "noisy":{}}, minseeds=3)
+    with open(str(tmp_path / "exp")+"_replicates.tsv") as f:
+        rows = [line.rstrip("\n").split("\t") for line in f]
+    assert rows[0] == ["wave", "scenario", "seeds", "metric", "n", "mean", "lower", "upper",
+                       "converged"]
+    assert len(rows) - 1 == 2 * len(runs.waves) # every scenario, after every wave
+    last = [r for r in rows if r[1] == "noisy"][-1]
+    assert int(last[0]) == len(runs.waves) - 1 and last[-1] == "true"
+
+def test_failed_runs(tmp_path):
+    "Runs without results don't count, and a scenario without any results never converges."
+    controller, state, runs = run(tmp_path, {"stable":{}, "broken":{"fails":True}},
+                                  seeds=range(1, 11), minseeds=3)
+    assert state["broken"]["diversity:lineages"][0] == 0
+    assert controller.noise("broken") == math.inf
+    assert len(controller.jobs["broken"]) == 10 and len(controller.jobs["stable"]) == 3
+
+def test_allocate():
+    "A wave goes to the noisiest scenarios first, and only until their predicted intervals are narrow enough."
+    controller = replicates.ReplicateController(["diversity:lineages"], threshold=1, relative=False)
+    controller.jobs = {"a": [None] * 4, "b": [None] * 4, "c": [None] * 4}
+    controller.state = {"a": {"diversity:lineages": (4, 10, 9, 13)}, # width 4
+                        "b": {"diversity:lineages": (4, 10, 9.5, 10.7)}, # width 1.2
+                        "c": {"diversity:lineages": (4, 10, 9.8, 10.2)}} # converged
+    extra = controller.allocate(["a", "b"], {"a": 100, "b": 100}, 100)
+    # the width shrinks with the square root of the number of seeds: 4 * sqrt(4 / 64) = 1
+    assert extra == {"a": 60, "b": 2}
+    assert controller.allocate(["a", "b"], {"a": 100, "b": 100}, 5) == {"a": 5, "b": 0}
+    assert controller.allocate(["a", "b"], {"a": 3, "b": 1}, 100) == {"a": 3, "b": 1}
+
+def test_settings():
+    with pytest.raises(ValueError):
+        replicates.ReplicateController(["diversity:lineages"], minseeds=1)
+    with pytest.raises(ValueError):
+        replicates.ReplicateController(["diversity:species"])
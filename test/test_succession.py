@@ -0,0 +1,63 @@
+## Tests for the change-set map series in `gemmpy/succession.py`
+
+import os, glob
+import numpy as np
+import pytest
+
+from gemmpy import mapformat, succession
+
+chyulu = sorted(glob.glob(os.path.join(os.path.dirname(__file__), "..", "studies", "zosterops",
+                                       "Phylogeny_study", "Chyulu_Taita_Maps", "Chyulu_*.map")),
+                key=lambda f: int(f.split("_")[-1][:-len(".map")]))
+
+def cover_map(cover, name):
+    return succession.raster_map(np.array(cover, dtype=float), name, timesteps=10)
+
+def test_expand_changesets():
+    "Expanding the change sets of a series gives back the full maps."
+    covers = [[[0, 10, 20], [30, 50, np.nan]],
+              [[0, 12, 20], [30, 0.5, np.nan]],
+              [[0, 12, 20], [30, 0.5, np.nan]], # an unchanged epoch
+              [[1, 12, 20], [30, 0.5, 40]]] # a new cell
+    maps = [cover_map(c, "epoch"+str(i)+".map") for i, c in enumerate(covers)]
+    series = succession.changesets(maps)
+    assert not series[0].changeset and all(m.changeset for m in series[1:])
+    assert [len(m) for m in series] == [5, 2, 0, 2]
+    assert succession.expand(series) == maps
+
+def test_written_series(tmp_path):
+    "A series written as text reads back as the same change sets, with a file for every epoch."
+    maps = [cover_map([[5, 10]], "epoch.map"), cover_map([[5, 20]], "epoch.map")]
+    series = succession.changesets(maps)
+    setting = succession.write_series(series, str(tmp_path))
+    files = setting.split(",")
+    assert len(files) == 2 and files[0] != files[1]
+    with open(files[1]) as f:
+        assert f.read().split("\n")[3] == "10 update"
+    readback = [mapformat.read_text(f) for f in files]
+    assert readback == series
+    assert succession.expand(readback) == maps
+
+def test_chyulu_series():
+    "The Chyulu maps convert to change sets that expand to the original maps."
+    maps = [mapformat.read_text(f) for f in chyulu[:3]]
+    series = succession.changesets(maps)
+    assert sum(len(m) for m in series[1:]) < sum(len(m) for m in maps[1:])
+    assert succession.expand(series) == maps
+
+def test_invalid_series():
+    maps = [cover_map([[5, 10]], "a.map"), cover_map([[5, np.nan]], "b.map")]
+    with pytest.raises(ValueError, match="removes"):
+        succession.validate(maps) # change sets can't remove cells
+    series = succession.changesets([maps[0], maps[0]])
+    with pytest.raises(ValueError, match="already a change set"):
+        succession.validate(series)
+    with pytest.raises(ValueError, match="first map"):
+        succession.expand(series[1:])
+
+def test_capacity():
+    "Capacities follow the R script: two per percent cover, and a minimum in the lucky cells."
+    cover = np.array([0, 0.5, 1.7, 10.2])
+    assert succession.capacity(cover).tolist() == [0, 0, 2, 20]
+    lucky = np.array([True, False, True, False])
+    assert succession.capacity(cover, lucky).tolist() == [2, 0, 2, 20]
@@ -0,0 +1,72 @@
+## Tests for the sweep designs in `gemmpy/sweep.py`
+
+import pytest
+
+from gemmpy import sweep
+
+@pytest.mark.parametrize("n", [1, 2, 7, 64, 1000])
+def test_permutation(n):
+    "The Feistel permutation is a bijection on range(n), and depends on its key."
+    perms = [sweep.permutation(n, key) for key in (0, 1)]
+    for permute in perms:
+        assert sorted(permute(i) for i in range(n)) == list(range(n))
+    if n > 2:
+        assert [perms[0](i) for i in range(n)] != [perms[1](i) for i in range(n)]
+
+def test_latin_hypercube():
+    "Every stratum of every parameter is sampled exactly once, and the design is reproducible."
+    n = 50
+    space = {"a":sweep.Range(0, 1), "b":sweep.Range(0, 1), "c":sweep.Range(0, 1)}
+    points = list(sweep.latin_hypercube_points(space, n, seed=3))
+    for k in space:
+        assert sorted(int(p[k] * n) for p in points) == list(range(n))
+    assert points == list(sweep.latin_hypercube_points(space, n, seed=3))
+    assert points != list(sweep.latin_hypercube_points(space, n, seed=4))
+
+def test_sobol_strata():
+    "The first 2^k points of each dimension of a Sobol sequence hit every dyadic interval once."
+    space = {str(d): sweep.Range(0, 1) for d in range(21)}
+    points = list(sweep.sobol_points(space, 256))
+    assert points[0] == {k: 0.0 for k in space}
+    for k in space:
+        for bits in (1, 4, 8):
+            first = points[:2 ** bits]
+            assert sorted(int(p[k] * 2 ** bits) for p in first) == list(range(2 ** bits))
+
+def test_sobol_reference():
+    "The Sobol sequence matches the unscrambled sequence of scipy (same direction numbers)."
+    qmc = pytest.importorskip("scipy.stats.qmc")
+    space = {str(d): sweep.Range(0, 1) for d in range(8)}
+    ours = [list(p.values()) for p in sweep.sobol_points(space, 127, skip=1)]
+    reference = qmc.Sobol(8, scramble=False).random(128)[1:]
+    assert ours == reference.tolist()
+
+def test_sobol_limits():
+    with pytest.raises(ValueError):
+        list(sweep.sobol_points({str(d): [0, 1] for d in range(22)}, 4))
+
+def test_grid_sweep():
+    "A grid sweep covers every combination once per seed, with names that don't depend on the order."
+    space = {"tolerance":[0.01, 0.1], "linkage":["none", "full"], "mutation":[0]}
+    s = sweep.Sweep(space, abbreviations={"tolerance":"t"})
+    assert len(s) == 4
+    jobs = list(s.jobs("exp", [1, 2], lambda name, seed, **params: (name, seed, params)))
+    assert len(jobs) == 8
+    assert len(set(name for name, seed, params in jobs)) == 8
+    assert jobs[0] == ("exp_t0.01_linkagenone_mutation0_1", 1,
+                       {"tolerance":0.01, "linkage":"none", "mutation":0})
+
+def test_scaled_values():
+    "Sampled values stay within their ranges and value lists."
+    space = {"rate":sweep.Range(1e-9, 1e-5, log=True), "size":sweep.Range(1, 10, integer=True),
+             "mode":["a", "b", "c"]}
+    for design in ("lhs", "sobol", "random"):
+        points = list(sweep.Sweep(space, design, n=100).points())
+        assert len(points) == 100
+        assert all(1e-9 <= p["rate"] <= 1e-5 for p in points)
+        assert all(isinstance(p["size"], int) and 1 <= p["size"] <= 10 for p in points)
+        assert set(p["mode"] for p in points) == {"a", "b", "c"}
+    with pytest.raises(ValueError):
+        sweep.Sweep(space) # no grid over ranges
+    with pytest.raises(ValueError):
+        list(sweep.grid_points(space))
@@ -0,0 +1,47 @@
+## Tests for the early-stopping rules in `gemmpy/watchdog.py`
+
+import pytest
+
+from gemmpy import scheduler, watchdog
+
+header = "population,freespace,lineages,alpha,beta,gamma\n"
+
+def row(population, lineages=3, gamma=3):
+    return ",".join(str(v) for v in [population, 0.5, lineages, 2, 1.5, gamma])+"\n"
+
+def test_parse_rule():
+    "Rules are parsed from their text form and written back the same way."
+    rule = watchdog.parse_rule("population == 0 for 10")
+    assert (rule.column, rule.test, rule.value, rule.outputs) == ("population", "==", 0.0, 10)
+    assert str(rule) == "population == 0 for 10"
+    rule = watchdog.parse_rule(" lineages <= 1.5e0 ")
+    assert (rule.test, rule.value, rule.outputs) == ("<=", 1.5, 1) and str(rule) == "lineages <= 1.5"
+    rule = watchdog.parse_rule("gamma unchanged for 50")
+    assert (rule.test, rule.value, rule.outputs) == ("unchanged", None, 50)
+    assert str(rule) == "gamma unchanged for 50"
+    for text in ["population = 0", "population == zero", "gamma unchanged", "species == 0"]:
+        with pytest.raises(ValueError):
+            watchdog.parse_rule(text)
+
+def test_extinct_population(tmp_path):
+    "The default rule only fires after ten consecutive outputs without population."
+    log = tmp_path / "diversity.log"
+    log.write_text(header + row(100) + row(0) * 4 + row(20))
+    job = scheduler.Job("run", "run.config", dest=str(tmp_path))
+    watch = watchdog.Watchdog(["population == 0 for 10"]).watch(job)
+    assert watch.check() is None
+    with open(log, "a") as f:
+        f.write(row(0) * 9)
+    assert watch.check() is None
+    with open(log, "a") as f:
+        f.write(row(0) + "0,0.") # the last line is still being written
+    assert watch.check() == "population == 0 for 10"
+
+def test_unchanged_and_order(tmp_path):
+    "`unchanged` counts outputs equal to the previous one, and the first rule that holds is reported."
+    (tmp_path / "diversity.log").write_text(header + row(50, gamma=4) + row(60, gamma=4) + row(70, gamma=4))
+    rules = [watchdog.parse_rule("gamma unchanged for 3"), watchdog.parse_rule("gamma unchanged for 2")]
+    watch = watchdog.RunWatch(str(tmp_path), rules)
+    assert watch.check() == "gamma unchanged for 2"
+    watch = watchdog.RunWatch(str(tmp_path), [watchdog.parse_rule("lineages == 1")])
+    assert watch.check() is None